@@ -1,7 +1,28 @@
 from django.contrib import admin
-from .models import Product, ProductBatch, StockMovement
+from .models import (
+    Product, ProductBatch, ProductClassification, PurchaseOrder, PurchaseOrderItem, StockMovement,
+    StockMovementArchive, StockSnapshot, Supplier,
+)
 
 # Minimal registration - keep admin focused on core models
 admin.site.register(Product)
 admin.site.register(ProductBatch)
 admin.site.register(StockMovement)
+admin.site.register(StockSnapshot)
+admin.site.register(StockMovementArchive)
+admin.site.register(ProductClassification)
+admin.site.register(Supplier)
+
+# Draft orders written by the reorder suggestions are reviewed here
+class PurchaseOrderItemInline(admin.TabularInline):
+    model = PurchaseOrderItem
+    extra = 0
+    raw_id_fields = ('product',)
+
+@admin.register(PurchaseOrder)
+class PurchaseOrderAdmin(admin.ModelAdmin):
+    list_display = ('order_number', 'supplier', 'status', 'order_date', 'total_amount', 'created_by')
+    list_filter = ('status', 'order_date')
+    search_fields = ('order_number', 'supplier__name')
+    readonly_fields = ('order_number', 'total_amount')  # numbered on creation, totalled by the items
+    inlines = [PurchaseOrderItemInline]
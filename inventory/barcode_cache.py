@@ -0,0 +1,138 @@
+"""Barcode -> product snapshot cache for scanner-driven checkout.
+
+Lookups hit a process-local dict first, then, when ``BARCODE_CACHE_ALIAS``
+names an entry of ``CACHES`` (e.g. Redis or memcached shared by all workers),
+that shared backend, and only then the database. Entries are dropped or
+patched by the receivers in ``inventory.signals`` when a product is saved or
+deleted and when its stock changes. Local entries also expire after
+``BARCODE_CACHE_LOCAL_TTL`` seconds so changes made by another worker process
+become visible even without a shared backend.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Product
+
+LOCAL_TTL = getattr(settings, 'BARCODE_CACHE_LOCAL_TTL', 30)
+SHARED_TTL = getattr(settings, 'BARCODE_CACHE_SHARED_TTL', 300)
+KEY_PREFIX = 'barcode:'
+
+
+def product_snapshot(product):
+    """The product fields returned to the POS for a scan."""
+    return {
+        'id': product.id,
+        'name': product.name,
+        'dci': product.dci,
+        'price': float(product.selling_price),
+        'current_stock': product.current_stock,
+        'minimum_stock_level': product.minimum_stock_level,
+        'barcode': product.barcode,
+    }
+
+
+class BarcodeCache:
+    def __init__(self, alias=None):
+        self._lock = threading.Lock()
+        self._alias = alias
+        self._local = {}  # barcode -> (snapshot, expires_at)
+        self._barcodes = {}  # product id -> barcode, for invalidation
+        self.reset_stats()
+
+    @property
+    def alias(self):
+        return self._alias or getattr(settings, 'BARCODE_CACHE_ALIAS', None)
+
+    @property
+    def shared(self):
+        return caches[self.alias] if self.alias else None
+
+    def reset_stats(self):
+        with self._lock:
+            self.local_hits = 0
+            self.shared_hits = 0
+            self.misses = 0
+
+    def clear(self):
+        with self._lock:
+            self._local.clear()
+            self._barcodes.clear()
+
+    def get(self, barcode):
+        """Return the snapshot for an active product with ``barcode``, or ``None``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._local.get(barcode)
+            if entry is not None and entry[1] > now:
+                self.local_hits += 1
+                return entry[0]
+
+        shared = self.shared
+        snapshot = shared.get(KEY_PREFIX + barcode) if shared is not None else None
+        if snapshot is not None:
+            with self._lock:
+                self.shared_hits += 1
+        else:
+            product = Product.objects.filter(barcode=barcode, is_active=True).first()
+            with self._lock:
+                self.misses += 1
+            if product is None:
+                return None
+            snapshot = product_snapshot(product)
+            if shared is not None:
+                shared.set(KEY_PREFIX + barcode, snapshot, SHARED_TTL)
+
+        with self._lock:
+            self._local[barcode] = (snapshot, now + LOCAL_TTL)
+            self._barcodes[snapshot['id']] = barcode
+        return snapshot
+
+    def invalidate(self, product_id, *barcodes):
+        """Forget a product, under its cached barcode and any of ``barcodes``."""
+        with self._lock:
+            keys = {self._barcodes.pop(product_id, None), *barcodes} - {None, ''}
+            for barcode in keys:
+                self._local.pop(barcode, None)
+        shared = self.shared
+        if shared is not None and keys:
+            shared.delete_many([KEY_PREFIX + barcode for barcode in keys])
+
+    def update_stock(self, changes):
+        """Apply ``{product_id: new_stock}``, as sent by ``stock_changed``."""
+        shared_updates = {}
+        with self._lock:
+            for product_id, stock in changes.items():
+                barcode = self._barcodes.get(product_id)
+                entry = self._local.get(barcode) if barcode else None
+                if entry is not None:
+                    snapshot = dict(entry[0], current_stock=stock)
+                    self._local[barcode] = (snapshot, entry[1])
+                    shared_updates[KEY_PREFIX + barcode] = snapshot
+        shared = self.shared
+        if shared is None:
+            return
+        if shared_updates:
+            shared.set_many(shared_updates, SHARED_TTL)
+        # Other workers may have cached products this one has not seen
+        unknown = [pid for pid in changes if pid not in self._barcodes]
+        if unknown:
+            barcodes = Product.objects.filter(pk__in=unknown).exclude(barcode=None).values_list('barcode', flat=True)
+            shared.delete_many([KEY_PREFIX + barcode for barcode in barcodes])
+
+    def stats(self):
+        with self._lock:
+            lookups = self.local_hits + self.shared_hits + self.misses
+            return {
+                'local_hits': self.local_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': round((lookups - self.misses) / lookups, 4) if lookups else 0.0,
+                'local_entries': len(self._local),
+                'shared_backend': self.alias,
+            }
+
+
+barcode_cache = BarcodeCache()
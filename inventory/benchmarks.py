@@ -0,0 +1,99 @@
+"""Helpers shared by the ``bench_*`` management commands.
+
+Benchmarks can run against the real catalogue or against synthetic products
+created inside a transaction that is rolled back afterwards, so they never
+leave data behind. Load tests, whose threads each have their own connection
+and would not see such a transaction, use a throwaway test database instead.
+"""
+import random
+import statistics
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+
+from django.db import transaction
+
+from .models import Product
+from .summary import add_products
+
+STEMS = [
+    'Amoxicilline', 'Paracétamol', 'Ibuprofène', 'Métronidazole', 'Ciprofloxacine',
+    'Oméprazole', 'Metformine', 'Amlodipine', 'Salbutamol', 'Artéméther',
+    'Luméfantrine', 'Cotrimoxazole', 'Doxycycline', 'Diclofénac', 'Ceftriaxone',
+    'Glibenclamide', 'Losartan', 'Prednisolone', 'Quinine', 'Fer Acide Folique',
+]
+FORMS = ['comprimés', 'gélules', 'sirop', 'suspension', 'injectable', 'pommade', 'sachets']
+PREFIXES = ['300', '340', '400', '611', '613', '890']  # GS1 country prefixes
+DOSES = ['100mg', '250mg', '500mg', '1g', '5mg', '10mg', '20mg', '40mg', '125mg/5ml']
+
+
+def synthetic_products(count, seed=0):
+    """Return ``count`` unsaved, realistic-looking ``Product`` instances."""
+    rng = random.Random(seed)
+    classes = [code for code, _ in Product.THERAPEUTIC_CLASSES]
+    products = []
+    for i in range(count):
+        stem = rng.choice(STEMS)
+        cost = Decimal(rng.randint(100, 20000))
+        products.append(Product(
+            name=f'{stem} {rng.choice(DOSES)} {rng.choice(FORMS)}',
+            dci=stem.lower(),
+            therapeutic_class=rng.choice(classes),
+            cost_price=cost,
+            selling_price=(cost * Decimal('1.3')).quantize(Decimal('1')),
+            current_stock=rng.choice([0, 0, 2, 5, 10, 50, 200]),
+            minimum_stock_level=rng.choice([5, 10, 20]),
+            barcode=f'{rng.choice(PREFIXES)}{rng.randint(1000, 9999)}{seed:02d}{i:06d}',
+        ))
+    return products
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
+
+
+@contextmanager
+def throwaway_database():
+    """Run the block against a freshly migrated test database, destroyed afterwards.
+
+    Every connection, including those of other threads, uses it meanwhile.
+    """
+    from django.test.utils import setup_databases, teardown_databases
+
+    old_config = setup_databases(verbosity=0, interactive=False, serialized_aliases=set())
+    try:
+        yield
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+def create_synthetic_catalogue(count, seed=0):
+    add_products(Product.objects.bulk_create(synthetic_products(count, seed), batch_size=2000))
+
+
+def measure(func, repeat=50):
+    """Call ``func`` ``repeat`` times and return the durations in seconds."""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def summarize(durations):
+    ordered = sorted(durations)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return {
+        'median_ms': statistics.median(ordered) * 1000,
+        'p95_ms': p95 * 1000,
+    }
+
+
+def format_line(label, durations):
+    stats = summarize(durations)
+    return f"{label:<40} median {stats['median_ms']:9.3f} ms   p95 {stats['p95_ms']:9.3f} ms"
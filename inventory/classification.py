@@ -0,0 +1,175 @@
+"""Inventory turnover and ABC/XYZ classification.
+
+Every night, :func:`classify_products` computes for each active product,
+over the last ``CLASSIFICATION_WINDOW_DAYS`` complete days:
+
+* its daily demand (mean, standard deviation and coefficient of variation),
+  from ``DailyProductSalesRollup``. Days without sales count as zero demand,
+  so the sums of units and of squared units per product are all that is
+  needed: they come from one grouped query, not from per-day arrays;
+* its average stock, from the current stock and the stock movements of the
+  window (one grouped query per product and day);
+* its annual turnover (units sold over average stock) and its days of cover
+  (current stock over daily demand);
+* its ABC class by revenue (A: the products making the first 80 % of the
+  revenue, B: the next 15 %, C: the rest) and its XYZ class by demand
+  variability (X: CV up to 0.5, Y: up to 1, Z: above, or no sales).
+
+The results are stored as ``ProductClassification`` rows, which the
+analytics dashboard and the reorder suggestions read instantly.
+The computation runs every night as a background job, enqueued by the jobs
+worker when the day changes (see ``jobs.schedule_nightly``), or from
+``manage.py classify_products``.
+"""
+import math
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+
+from sales.dates import day_start
+from sales.models import DailyProductSalesRollup
+
+from .models import Product, ProductClassification, StockMovement
+from .stock import run_with_retry
+from .summary import today
+
+CLASSIFICATION_WINDOW_DAYS = 90
+ABC_THRESHOLDS = (('A', Decimal('0.80')), ('B', Decimal('0.95')))
+XYZ_THRESHOLDS = (('X', 0.5), ('Y', 1.0))
+WRITE_CHUNK_SIZE = 2000
+COMPARED_FIELDS = (
+    'window_days', 'units_sold', 'revenue', 'average_daily_demand', 'demand_std', 'demand_cv', 'average_stock',
+    'turnover', 'days_of_cover', 'abc_class', 'xyz_class',
+)
+
+
+def xyz_class(cv):
+    if cv is None:
+        return 'Z'
+    for label, limit in XYZ_THRESHOLDS:
+        if cv <= limit:
+            return label
+    return 'Z'
+
+
+def abc_classes(revenues):
+    """``{product_id: 'A' | 'B' | 'C'}`` from ``{product_id: revenue}``."""
+    total = sum(revenues.values())
+    classes = {}
+    cumulated = Decimal(0)
+    for product_id, revenue in sorted(revenues.items(), key=lambda item: (-item[1], item[0])):
+        label = 'C'
+        if revenue > 0:
+            # A product belongs to the class its revenue starts in
+            share = cumulated / total
+            label = next((label for label, limit in ABC_THRESHOLDS if share < limit), 'C')
+        classes[product_id] = label
+        cumulated += revenue
+    return classes
+
+
+def _demand(start, end):
+    rows = DailyProductSalesRollup.objects.filter(date__gte=start, date__lte=end).values('product_id').annotate(
+        units=Sum('quantity'), squares=Sum(F('quantity') * F('quantity')), revenue=Sum('revenue'),
+    ).order_by()
+    return {row['product_id']: row for row in rows}
+
+
+def _stock_weights(start, days):
+    """``{product_id: Σ units × days}``: what the movements of the window add to the daily closing stocks.
+
+    The closing stock of day ``i`` of the window is the current stock minus
+    the movements made after that day, so a movement made on day ``k`` is
+    missing from the closings of the ``k`` days before it (all ``days`` for
+    today's movements).
+    """
+    rows = StockMovement.objects.filter(created_at__gte=day_start(start)).annotate(
+        day=TruncDate('created_at')
+    ).values('product_id', 'day').annotate(units=Sum('quantity')).order_by()
+    weights = {}
+    for row in rows:
+        offset = min((row['day'] - start).days, days)
+        weights[row['product_id']] = weights.get(row['product_id'], 0) + row['units'] * offset
+    return weights
+
+
+def compute_classifications(day=None, window_days=CLASSIFICATION_WINDOW_DAYS):
+    """Unsaved ``ProductClassification`` rows for the active products, on ``day``."""
+    day = day or today()
+    start, end = day - timedelta(days=window_days), day - timedelta(days=1)
+    demand = _demand(start, end)
+    weights = _stock_weights(start, window_days)
+    products = Product.objects.filter(is_active=True).values_list('pk', 'current_stock')
+
+    stocks = dict(products.iterator(chunk_size=5000))
+    revenues = {pk: (demand[pk]['revenue'] if pk in demand else Decimal(0)) for pk in stocks}
+    abc = abc_classes(revenues)
+
+    classifications = []
+    for pk, stock in stocks.items():
+        row = demand.get(pk)
+        units = row['units'] if row else 0
+        mean = units / window_days
+        variance = max((row['squares'] if row else 0) / window_days - mean * mean, 0)
+        std = math.sqrt(variance)
+        cv = std / mean if mean else None
+        average_stock = max(stock - weights.get(pk, 0) / window_days, 0)
+        classifications.append(ProductClassification(
+            product_id=pk,
+            computed_on=day,
+            window_days=window_days,
+            units_sold=units,
+            revenue=revenues[pk],
+            average_daily_demand=mean,
+            demand_std=std,
+            demand_cv=cv,
+            average_stock=average_stock,
+            turnover=units * 365 / window_days / average_stock if average_stock else None,
+            days_of_cover=stock / mean if mean else None,
+            abc_class=abc[pk],
+            xyz_class=xyz_class(cv),
+        ))
+    return classifications
+
+
+def _values(classification):
+    return tuple(getattr(classification, field) for field in COMPARED_FIELDS)
+
+
+def classify_products(day=None, window_days=CLASSIFICATION_WINDOW_DAYS):
+    """Recompute the classification of every active product; return the number of rows written.
+
+    Only the rows whose values changed are rewritten, in small transactions:
+    a nightly run touches the products that sold or moved, and never holds
+    the database write lock for long while the tills are selling.
+    """
+    classifications = compute_classifications(day, window_days)
+    existing = {
+        row[0]: row[1:]
+        for row in ProductClassification.objects.values_list('product_id', *COMPARED_FIELDS).iterator(chunk_size=5000)
+    }
+    changed = [c for c in classifications if existing.pop(c.product_id, None) != _values(c)]
+
+    def write(chunk):
+        ProductClassification.objects.filter(pk__in=[c.product_id for c in chunk]).delete()
+        ProductClassification.objects.bulk_create(chunk)
+
+    for start in range(0, len(changed), WRITE_CHUNK_SIZE):
+        run_with_retry(write, changed[start:start + WRITE_CHUNK_SIZE])
+    # What is left belongs to products deactivated or deleted since
+    stale = list(existing)
+    for start in range(0, len(stale), WRITE_CHUNK_SIZE):
+        run_with_retry(ProductClassification.objects.filter(pk__in=stale[start:start + WRITE_CHUNK_SIZE]).delete)
+    return len(changed)
+
+
+def matrix():
+    """Number of products per ABC and XYZ class, and the day of the last change."""
+    counts = {abc: {xyz: 0 for xyz, _ in ProductClassification.XYZ_CLASSES} for abc, _ in ProductClassification.ABC_CLASSES}
+    rows = ProductClassification.objects.values('abc_class', 'xyz_class').annotate(count=Count('pk')).order_by()
+    for row in rows:
+        counts[row['abc_class']][row['xyz_class']] = row['count']
+    latest = ProductClassification.objects.order_by('-computed_on').values_list('computed_on', flat=True).first()
+    return {'updated_on': latest.isoformat() if latest else None, 'counts': counts}
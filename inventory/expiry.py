@@ -0,0 +1,145 @@
+"""Expiry buckets and the nightly write-off of expired batches.
+
+Open batches (quantity left, active product) fall into four buckets by
+expiry date, as in ``ProductBatch.expiry_status``: expired, critical (30 days
+or less), warning (90 days or less) and good. :func:`expiry_buckets` counts
+them with one grouped query and keeps the result in memory until the day
+changes or a batch changes; batch changes bump the global ``InventorySummary``
+version, which is part of the cache key.
+
+:func:`write_off_expired` takes the remaining units of expired batches out of
+stock with ``expiry`` stock movements. It runs every night as a background
+job, enqueued by the jobs worker when the day changes (see
+``jobs.schedule_nightly``), or from ``manage.py expire_batches``.
+"""
+import threading
+from datetime import timedelta
+
+from django.db.models import Case, CharField, Count, DecimalField, ExpressionWrapper, F, Sum, Value, When
+
+from .models import ProductBatch
+from .stock import apply_stock_changes, run_with_retry
+from .summary import CRITICAL_EXPIRY_DAYS, SummaryDelta, current_summary, today
+
+WARNING_EXPIRY_DAYS = 90
+BUCKETS = [
+    ('expired', 'Expiré'),
+    ('critical', 'Critique'),
+    ('warning', 'Avertissement'),
+    ('good', 'Bon'),
+]
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+
+
+def bucket_of(expiry_date, day):
+    days = (expiry_date - day).days
+    if days < 0:
+        return 'expired'
+    if days <= CRITICAL_EXPIRY_DAYS:
+        return 'critical'
+    if days <= WARNING_EXPIRY_DAYS:
+        return 'warning'
+    return 'good'
+
+
+def bucket_expression(day):
+    """SQL equivalent of :func:`bucket_of`."""
+    return Case(
+        When(expiry_date__lt=day, then=Value('expired')),
+        When(expiry_date__lte=day + timedelta(days=CRITICAL_EXPIRY_DAYS), then=Value('critical')),
+        When(expiry_date__lte=day + timedelta(days=WARNING_EXPIRY_DAYS), then=Value('warning')),
+        default=Value('good'),
+        output_field=CharField(),
+    )
+
+
+def bucket_range(bucket, day):
+    """Lookups selecting the batches of ``bucket`` on ``day``."""
+    critical = day + timedelta(days=CRITICAL_EXPIRY_DAYS)
+    warning = day + timedelta(days=WARNING_EXPIRY_DAYS)
+    return {
+        'expired': {'expiry_date__lt': day},
+        'critical': {'expiry_date__gte': day, 'expiry_date__lte': critical},
+        'warning': {'expiry_date__gt': critical, 'expiry_date__lte': warning},
+        'good': {'expiry_date__gt': warning},
+        'soon': {'expiry_date__gte': day, 'expiry_date__lte': warning},
+    }[bucket]
+
+
+def open_batches():
+    return ProductBatch.objects.filter(quantity__gt=0, product__is_active=True)
+
+
+def compute_buckets(day):
+    """Batches, units and purchase value per bucket, in one grouped query."""
+    buckets = {key: {'label': label, 'batches': 0, 'units': 0, 'value': 0.0} for key, label in BUCKETS}
+    rows = open_batches().annotate(bucket=bucket_expression(day)).values('bucket').annotate(
+        batches=Count('id'),
+        units=Sum('quantity'),
+        value=Sum(ExpressionWrapper(F('quantity') * F('purchase_price'), output_field=MONEY)),
+    ).order_by()
+    for row in rows:
+        buckets[row['bucket']].update(batches=row['batches'], units=row['units'], value=float(row['value'] or 0))
+    return buckets
+
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def expiry_buckets():
+    """:func:`compute_buckets` for today, cached until the day or the batches change."""
+    summary = current_summary()
+    key = (summary.expiry_as_of, summary.version, summary.updated_at)
+    with _cache_lock:
+        if _cache.get('key') == key:
+            return _cache['buckets']
+    buckets = compute_buckets(summary.expiry_as_of)
+    with _cache_lock:
+        _cache.update(key=key, buckets=buckets)
+    return buckets
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def write_off_expired(day=None, created_by="Système"):
+    """Take expired batches out of stock; return the number of batches written off.
+
+    Each batch is emptied with a conditional update, so running this twice,
+    or from two processes, writes each batch off once. The units are removed
+    from the product's stock (never below zero) with ``expiry`` movements.
+    """
+    day = day or today()
+    expired = list(
+        ProductBatch.objects.filter(quantity__gt=0, expiry_date__lt=day).select_related('product').order_by('product_id', 'id')
+    )
+
+    def write_off(batches):
+        summary = SummaryDelta()
+        written_off = {}
+        for batch in batches:
+            if not ProductBatch.objects.filter(pk=batch.pk, quantity=batch.quantity).update(quantity=0):
+                continue  # changed since it was read; picked up next time
+            state = (batch.product.therapeutic_class, batch.product.is_active)
+            summary.batch(state + (batch.quantity, batch.expiry_date), state + (0, batch.expiry_date), day)
+            written_off.setdefault(batch.product_id, []).append(batch)
+        summary.apply(day)
+        for product_id, product_batches in written_off.items():
+            numbers = ', '.join(batch.batch_number for batch in product_batches)
+            apply_stock_changes(
+                {product_id: -sum(batch.quantity for batch in product_batches)},
+                movement_type='expiry',
+                reference=f"Lots {numbers}"[:100],
+                reason=f"Péremption au {day:%d/%m/%Y}",
+                created_by=created_by,
+                clamp=True,
+            )
+        return sum(len(product_batches) for product_batches in written_off.values())
+
+    count = 0
+    for start in range(0, len(expired), 500):
+        count += run_with_retry(write_off, expired[start:start + 500])
+    return count
@@ -0,0 +1,388 @@
+"""Background jobs for long back-office tasks.
+
+Imports, exports, PDF reports, stock reconciliations, reorder suggestions,
+and the nightly write-off of expired batches, product classification and
+stock snapshots are recorded as ``Job`` rows and run by a worker, so the
+request that starts them returns at once with the job id and the POS keeps
+its request threads. By default the worker is a daemon thread of the web
+process, started by the first job; with ``JOBS_RUN_IN_PROCESS`` off,
+``manage.py run_jobs`` runs it as a separate process instead.
+
+The nightly jobs (``NIGHTLY_KINDS``) are enqueued by the worker itself,
+once per day, when it sees the day change (:func:`schedule_nightly`); they
+never depend on someone opening a page. Where no worker runs all the time,
+schedule ``manage.py run_jobs --once`` every night (cron, or the Windows Task
+Scheduler): it enqueues them too before running the pending jobs.
+
+Jobs are claimed with a conditional ``UPDATE``, so several workers can share
+the table. A running job's row is touched every ``HEARTBEAT_INTERVAL`` from
+a thread of its own, even while the job works inside a transaction; jobs
+whose row is left untouched for ``STALE_AFTER`` are failed as interrupted.
+Input and result files live in ``JOBS_ROOT/<job id>/`` and are
+removed with the job after ``JOBS_RETENTION_DAYS``.
+"""
+import logging
+import shutil
+import threading
+import time
+from datetime import date, timedelta
+from pathlib import Path
+from zipfile import BadZipFile
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.utils import timezone
+from openpyxl.utils.exceptions import InvalidFileException
+
+from .classification import classify_products
+from .expiry import write_off_expired
+from .ledger import take_snapshots
+from .models import Job, Product
+from .reconcile import RECONCILE_REPORT_LIMIT, reconcile
+from .reorder import suggest_reorders
+from .reports import cached_inventory_pdf
+from .spreadsheets import XLSX_CONTENT_TYPE, export_rows, import_products, iter_csv, write_xlsx
+from .summary import today
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5  # seconds between checks for jobs enqueued by other processes
+PROGRESS_INTERVAL = 1  # minimum seconds between two progress writes
+HEARTBEAT_INTERVAL = 60  # seconds between two touches of a running job's row
+STALE_AFTER = timedelta(hours=2)
+PURGE_INTERVAL = timedelta(hours=1)
+NIGHTLY_KINDS = ['expire_batches', 'classify_products', 'take_snapshots']  # enqueued once a day with the day as ``day`` parameter
+
+HANDLERS = {}
+
+
+class JobError(Exception):
+    """A failure whose message is meant for the user."""
+
+
+# Progress of the jobs running in this process, for jobs whose work happens
+# inside a transaction and therefore cannot be written to their row
+_live_progress = {}
+
+
+def handler(kind):
+    """Register the function that runs jobs of ``kind``."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def jobs_root():
+    return Path(getattr(settings, 'JOBS_ROOT', settings.BASE_DIR / 'job_files'))
+
+
+def job_dir(job):
+    path = jobs_root() / str(job.pk)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def enqueue(kind, params=None, upload=None, created_by="Système"):
+    """Record a job and return it; ``upload`` is saved as the job's input file."""
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    job = Job.objects.create(kind=kind, params=params or {}, created_by=created_by)
+    if upload is not None:
+        path = job_dir(job) / ('input' + Path(upload.name).suffix.lower())
+        with open(path, 'wb') as f:
+            for chunk in upload.chunks():
+                f.write(chunk)
+        job.params = {**job.params, 'path': str(path), 'filename': upload.name}
+        job.save(update_fields=['params', 'updated_at'])
+    transaction.on_commit(wake)
+    return job
+
+
+class JobContext:
+    """What a handler gets to report progress and write its result."""
+
+    def __init__(self, job):
+        self.job = job
+        self._written_at = 0
+
+    def progress(self, done, total=None):
+        _live_progress[self.job.pk] = (done, total)
+        if connection.in_atomic_block:
+            # Not visible to other connections before the commit anyway
+            return
+        now = time.monotonic()
+        if now - self._written_at >= PROGRESS_INTERVAL:
+            self._written_at = now
+            Job.objects.filter(pk=self.job.pk).update(progress=done, total=total, updated_at=timezone.now())
+
+    def output_path(self, name):
+        return job_dir(self.job) / name
+
+
+def live_progress(job):
+    """``(done, total)`` for ``job``, including progress not yet written to its row."""
+    return _live_progress.get(job.pk, (job.progress, job.total))
+
+
+def claim_next():
+    """Mark the oldest pending job as running and return it, or ``None``."""
+    for job_id in Job.objects.filter(status='pending').order_by('created_at', 'id').values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        if Job.objects.filter(pk=job_id, status='pending').update(status='running', started_at=now, updated_at=now):
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+class Heartbeat(threading.Thread):
+    """Touches a running job's row until stopped, on a connection of its own.
+
+    A job may go a long time without writing its progress (a PDF render, a
+    classification, progress reported inside a transaction); the heartbeat
+    keeps it from looking stale to :func:`fail_stale` meanwhile.
+    """
+
+    def __init__(self, job):
+        super().__init__(name=f'jobs-heartbeat-{job.pk}', daemon=True)
+        self.job = job
+        self.stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self.stopped.wait(HEARTBEAT_INTERVAL):
+                try:
+                    Job.objects.filter(pk=self.job.pk, status='running').update(updated_at=timezone.now())
+                except Exception:
+                    # e.g. SQLite locked by another writer: try again later
+                    logger.warning('Could not touch job %s', self.job.pk, exc_info=True)
+        finally:
+            connection.close()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def run(job):
+    """Run a claimed job and record its outcome.
+
+    The outcome is only written while the job is still ``running``: a job
+    already failed as stale by another worker stays failed.
+    """
+    ctx = JobContext(job)
+    running = Job.objects.filter(pk=job.pk, status='running')
+    heartbeat = Heartbeat(job)
+    heartbeat.start()
+    try:
+        outcome = HANDLERS[job.kind](ctx, **job.params) or {}
+    except JobError as e:
+        running.update(status='failed', error=str(e), finished_at=timezone.now())
+    except Exception as e:
+        logger.exception('Job %s failed', job.pk)
+        running.update(
+            status='failed', error=f'Erreur inattendue: {e.__class__.__name__}: {e}', finished_at=timezone.now()
+        )
+    else:
+        done, total = _live_progress.get(job.pk, (job.progress, job.total))
+        running.update(
+            status='done',
+            progress=done,
+            total=total,
+            result=outcome.get('result'),
+            result_file=str(outcome.get('file', '')),
+            result_name=outcome.get('filename', ''),
+            result_content_type=outcome.get('content_type', ''),
+            finished_at=timezone.now(),
+        )
+    finally:
+        heartbeat.stop()
+        _live_progress.pop(job.pk, None)
+    job.refresh_from_db()
+    return job
+
+
+def run_pending(limit=None):
+    """Run pending jobs until none is left (or ``limit`` ran); return how many ran."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run(job)
+        count += 1
+    return count
+
+
+def schedule_nightly(day=None):
+    """Enqueue the nightly jobs of ``day`` (default today) not enqueued yet; return the new jobs.
+
+    Running them twice for a day is harmless, should two workers schedule
+    them at once: every nightly job only writes what is still to be done.
+    """
+    day = day or today()
+    return [
+        enqueue(kind, {'day': day.isoformat()})
+        for kind in NIGHTLY_KINDS
+        if not Job.objects.filter(kind=kind, params__day=day.isoformat()).exists()
+    ]
+
+
+def fail_stale():
+    """Mark as failed the running jobs whose worker stopped (e.g. a server restart)."""
+    return Job.objects.filter(status='running', updated_at__lt=timezone.now() - STALE_AFTER).update(
+        status='failed', error='Interrompue', finished_at=timezone.now()
+    )
+
+
+def purge(days=None):
+    """Delete finished jobs older than ``days`` (``JOBS_RETENTION_DAYS``) and their files."""
+    days = getattr(settings, 'JOBS_RETENTION_DAYS', 7) if days is None else days
+    old = Job.objects.filter(status__in=['done', 'failed'], finished_at__lt=timezone.now() - timedelta(days=days))
+    ids = list(old.values_list('id', flat=True))
+    for job_id in ids:
+        shutil.rmtree(jobs_root() / str(job_id), ignore_errors=True)
+    Job.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+class Worker(threading.Thread):
+    """Runs pending jobs, waking up when one is enqueued or every ``POLL_INTERVAL``."""
+
+    def __init__(self):
+        super().__init__(name='jobs-worker', daemon=True)
+        self.wakeup = threading.Event()
+        self.stopping = False
+        self._purged_at = None
+        self._scheduled_on = None
+
+    def run(self):
+        while not self.stopping:
+            self.wakeup.clear()
+            try:
+                self.maintain()
+                run_pending()
+            except Exception:
+                logger.exception('Jobs worker error')
+            finally:
+                close_old_connections()
+            self.wakeup.wait(POLL_INTERVAL)
+        connection.close()
+
+    def maintain(self):
+        now = timezone.now()
+        if self._purged_at is None or now - self._purged_at >= PURGE_INTERVAL:
+            self._purged_at = now
+            fail_stale()
+            purge()
+        day = today()
+        if self._scheduled_on != day:
+            schedule_nightly(day)
+            self._scheduled_on = day
+
+    def stop(self):
+        self.stopping = True
+        self.wakeup.set()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def wake():
+    """Start this process's worker thread if needed and tell it a job is waiting."""
+    global _worker
+    if not getattr(settings, 'JOBS_RUN_IN_PROCESS', True):
+        return
+    with _worker_lock:
+        if _worker is None or not _worker.is_alive():
+            _worker = Worker()
+            _worker.start()
+    _worker.wakeup.set()
+
+
+# Handlers
+
+@handler('import_products')
+def import_products_job(ctx, path, filename=''):
+    try:
+        with open(path, 'rb') as f:
+            result = import_products(f, progress=ctx.progress)
+    except (InvalidFileException, BadZipFile):
+        raise JobError('Fichier invalide. Veuillez sélectionner un fichier Excel (.xlsx).')
+    return {'result': {
+        'created': result.created,
+        'updated': result.updated,
+        'error_count': len(result.errors),
+        'errors': result.errors[:100],
+    }}
+
+
+@handler('export_products')
+def export_products_job(ctx, format='xlsx'):
+    total = Product.objects.count()
+
+    def rows():
+        for done, row in enumerate(export_rows(), start=1):
+            if done % 1000 == 0:
+                ctx.progress(done, total)
+            yield row
+        ctx.progress(total, total)
+
+    if format == 'csv':
+        path = ctx.output_path('products_export.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(iter_csv(rows()))
+        content_type = 'text/csv; charset=utf-8'
+    else:
+        path = ctx.output_path('products_export.xlsx')
+        with open(path, 'wb') as f:
+            write_xlsx(rows(), f)
+        content_type = XLSX_CONTENT_TYPE
+    return {'file': path, 'filename': path.name, 'content_type': content_type, 'result': {'rows': total}}
+
+
+@handler('inventory_pdf')
+def inventory_pdf_job(ctx):
+    # Copied, as the cached report is replaced when the stock changes
+    path = ctx.output_path('inventory_analytics.pdf')
+    shutil.copyfile(cached_inventory_pdf(), path)
+    return {'file': path, 'filename': path.name, 'content_type': 'application/pdf'}
+
+
+@handler('expire_batches')
+def expire_batches_job(ctx, day):
+    return {'result': {'written_off': write_off_expired(date.fromisoformat(day))}}
+
+
+@handler('classify_products')
+def classify_products_job(ctx, day):
+    return {'result': {'updated': classify_products(date.fromisoformat(day))}}
+
+
+@handler('take_snapshots')
+def take_snapshots_job(ctx, day):
+    return {'result': {'snapshots': take_snapshots()}}
+
+
+@handler('reconcile_stock')
+def reconcile_stock_job(ctx, fix=False, created_by="Système"):
+    result = reconcile(fix=fix, limit=RECONCILE_REPORT_LIMIT, created_by=created_by, progress=ctx.progress)
+    return {'result': {
+        'checked': result.checked,
+        'corrected': result.corrected,
+        'counts': result.counts,
+        'discrepancies': result.discrepancies,
+    }}
+
+
+@handler('suggest_reorders')
+def suggest_reorders_job(ctx, dry_run=False):
+    result = suggest_reorders(dry_run=dry_run)
+    return {'result': {
+        'orders': result.orders,
+        'lines': result.lines,
+        'total_amount': float(result.total_amount),
+        'without_supplier': result.without_supplier,
+        'replaced_drafts': result.replaced_drafts,
+        'suggestions': result.suggestions,
+    }}
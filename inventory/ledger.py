@@ -0,0 +1,130 @@
+"""Point-in-time stock from the movement ledger.
+
+Every change to ``Product.current_stock`` leaves a ``StockMovement``: sales,
+receipts, adjustments and write-offs through :func:`stock.apply_stock_changes`,
+edits of the product form or the admin through the ``post_save`` signal, and
+spreadsheet imports explicitly. :func:`take_snapshots` records the stock of
+the products that moved since their last ``StockSnapshot``, so the stock of a
+product at any time is its latest snapshot before that time plus the few
+movements after it (:func:`stock_at`).
+
+:func:`archive_movements` moves old movements to ``StockMovementArchive``
+to keep ``StockMovement`` small. Replays read both tables, so archiving
+never changes an answer; the snapshots keep the replays short.
+"""
+from datetime import timedelta
+
+from django.db.models import Exists, OuterRef, Q, Subquery, Sum
+from django.utils import timezone
+
+from .models import Product, StockMovement, StockMovementArchive, StockSnapshot
+from .stock import run_with_retry
+
+SNAPSHOT_CHUNK_SIZE = 2000
+ARCHIVE_CHUNK_SIZE = 5000
+ARCHIVE_FIELDS = (
+    'id', 'product_id', 'movement_type', 'quantity', 'previous_stock', 'new_stock', 'reference', 'reason',
+    'created_by', 'created_at',
+)
+
+
+def _moved(product_ids, after=None, until=None):
+    """``{product_id: units}`` moved in ``(after, until]``, live and archived movements."""
+    lookups = {'product_id__in': product_ids}
+    if after is not None:
+        lookups['created_at__gt'] = after
+    if until is not None:
+        lookups['created_at__lte'] = until
+    moved = {}
+    for model in (StockMovement, StockMovementArchive):
+        rows = model.objects.filter(**lookups).values('product_id').annotate(units=Sum('quantity')).order_by()
+        for row in rows:
+            moved[row['product_id']] = moved.get(row['product_id'], 0) + row['units']
+    return moved
+
+
+def stock_at(product, when):
+    """Stock of ``product`` (a ``Product`` or its id) at the aware datetime ``when``.
+
+    Replays the movements from the latest snapshot taken at or before
+    ``when``. Without one, the replay goes backwards from the next snapshot,
+    or from the current stock for products never snapshotted.
+    """
+    if not isinstance(product, Product):
+        product = Product.objects.only('current_stock', 'created_at').get(pk=product)
+    if when < product.created_at:
+        return 0
+
+    snapshots = StockSnapshot.objects.filter(product=product)
+    before = snapshots.filter(taken_at__lte=when).order_by('-taken_at').values_list('taken_at', 'stock').first()
+    if before is not None:
+        taken_at, stock = before
+        return stock + _moved([product.pk], after=taken_at, until=when).get(product.pk, 0)
+
+    after = snapshots.filter(taken_at__gt=when).order_by('taken_at').values_list('taken_at', 'stock').first()
+    taken_at, stock = after if after is not None else (None, product.current_stock)
+    return stock - _moved([product.pk], after=when, until=taken_at).get(product.pk, 0)
+
+
+def take_snapshots(at=None):
+    """Snapshot, at ``at`` (default now), the products whose stock moved since their last snapshot.
+
+    Products never snapshotted are all included, so the first run covers the
+    whole catalogue. Stocks are the current stock minus the movements after
+    ``at``, read in one transaction per chunk of products (replayed if
+    SQLite reports a lock). Returns the number of snapshots written.
+    """
+    at = at or timezone.now()
+    last_snapshot = StockSnapshot.objects.filter(product=OuterRef('pk'), taken_at__lte=at).order_by('-taken_at')
+    moved_since = StockMovement.objects.filter(
+        product=OuterRef('pk'), created_at__gt=OuterRef('last_snapshot'), created_at__lte=at
+    )
+    products = Product.objects.filter(created_at__lte=at).annotate(
+        last_snapshot=Subquery(last_snapshot.values('taken_at')[:1])
+    ).filter(Q(last_snapshot__isnull=True) | Q(Exists(moved_since)))
+
+    def snapshot_chunk(last_pk):
+        rows = list(products.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'current_stock')[:SNAPSHOT_CHUNK_SIZE])
+        moved = _moved([pk for pk, _ in rows], after=at)
+        StockSnapshot.objects.bulk_create(
+            [StockSnapshot(product_id=pk, taken_at=at, stock=stock - moved.get(pk, 0)) for pk, stock in rows],
+            ignore_conflicts=True,
+        )
+        return rows
+
+    count, last_pk = 0, 0
+    while True:
+        rows = run_with_retry(snapshot_chunk, last_pk)
+        if not rows:
+            return count
+        count += len(rows)
+        last_pk = rows[-1][0]
+
+
+def archive_movements(before):
+    """Move the movements made up to ``before`` to ``StockMovementArchive``; return how many.
+
+    The products concerned are snapshotted at ``before`` first, so replays
+    after it start from a snapshot instead of reading the archive. Rows are
+    moved in chunks, each in its own transaction.
+    """
+    take_snapshots(before)
+    old = StockMovement.objects.filter(created_at__lte=before).order_by('id')
+
+    def move_chunk():
+        rows = list(old.values(*ARCHIVE_FIELDS)[:ARCHIVE_CHUNK_SIZE])
+        StockMovementArchive.objects.bulk_create([StockMovementArchive(**row) for row in rows], ignore_conflicts=True)
+        StockMovement.objects.filter(pk__in=[row['id'] for row in rows]).delete()
+        return len(rows)
+
+    count = 0
+    while True:
+        moved = run_with_retry(move_chunk)
+        count += moved
+        if moved < ARCHIVE_CHUNK_SIZE:
+            return count
+
+
+def archive_older_than(days):
+    """:func:`archive_movements` for the movements more than ``days`` days old."""
+    return archive_movements(timezone.now() - timedelta(days=days))
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import ledger
+
+
+class Command(BaseCommand):
+    help = ("Move old stock movements to the archive table, after snapshotting the products concerned, "
+            "so the movement table stays small")
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'STOCK_MOVEMENTS_RETENTION_DAYS', 365),
+            help="Archive the movements older than this many days (default STOCK_MOVEMENTS_RETENTION_DAYS)",
+        )
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError("--days doit être au moins 1")
+        count = ledger.archive_older_than(options['days'])
+        self.stdout.write(self.style.SUCCESS(f"{count} mouvement(s) de stock archivé(s)"))
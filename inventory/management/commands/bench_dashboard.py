@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from inventory.benchmarks import create_synthetic_catalogue, format_line, measure, rolled_back
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = "Time the inventory dashboard API at growing catalogue sizes (synthetic data, rolled back)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=10)
+
+    def handle(self, *args, **options):
+        client = Client()
+        with rolled_back():
+            for seed, size in enumerate(sorted(options['sizes'])):
+                missing = size - Product.objects.count()
+                if missing > 0:
+                    create_synthetic_catalogue(missing, seed=seed)
+
+                def fetch():
+                    resp = client.get('/inventory/api/dashboard/')
+                    assert resp.status_code == 200
+
+                self.stdout.write(format_line(f'dashboard @ {size} products', measure(fetch, options['repeat'])))
@@ -0,0 +1,81 @@
+import gc
+import resource
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections
+from django.test import Client
+
+from inventory.benchmarks import create_synthetic_catalogue, rolled_back
+from inventory.models import Product
+
+
+def reset_peak_rss():
+    """Reset the kernel's peak RSS counter (Linux only); return whether it worked."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = ("Time the product export (CSV and XLSX) and report time to first byte, "
+            "total time and peak memory (synthetic data, rolled back)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000,
+                            help="Catalogue size to export; synthetic products are added to reach it")
+        parser.add_argument('--trace-allocations', action='store_true',
+                            help="Also report peak Python allocations (tracemalloc, much slower)")
+
+    def handle(self, *args, **options):
+        client = Client()
+        # Streaming responses finish the request when closed; keep the
+        # rolled-back transaction's connection open, as the test runner does
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        with rolled_back():
+            missing = options['products'] - Product.objects.count()
+            while missing > 0:
+                create_synthetic_catalogue(min(missing, 10000), seed=50 + missing // 10000)
+                missing -= 10000
+            self.stdout.write(f"Catalogue: {Product.objects.count()} products")
+            for label, params in (('csv', {'format': 'csv'}), ('xlsx', {})):
+                self.run(client, label, params, options['trace_allocations'])
+
+    def run(self, client, label, params, trace):
+        gc.collect()
+        baseline = peak_rss_mb() if reset_peak_rss() else None
+        if trace:
+            tracemalloc.start()
+        start = time.perf_counter()
+        response = client.get('/inventory/products/export_excel/', params)
+        content = iter(response.streaming_content)
+        size = len(next(content))
+        first_byte = time.perf_counter() - start
+        for chunk in content:
+            size += len(chunk)
+        total = time.perf_counter() - start
+
+        line = f"{label:<5} first byte {first_byte * 1000:9.1f} ms   total {total:6.2f} s   {size / 1e6:5.1f} MB"
+        if baseline is not None:
+            line += f"   peak RSS +{peak_rss_mb() - baseline:5.1f} MB"
+        if trace:
+            line += f"   peak Python allocations {tracemalloc.get_traced_memory()[1] / 1e6:5.1f} MB"
+            tracemalloc.stop()
+        self.stdout.write(line)
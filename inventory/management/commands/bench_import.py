@@ -0,0 +1,52 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from inventory.benchmarks import create_synthetic_catalogue, rolled_back, synthetic_products
+from inventory.models import Product
+from inventory.spreadsheets import export_rows, import_products, write_xlsx
+
+
+class Command(BaseCommand):
+    help = ("Time the product import on a synthetic supplier price list that updates "
+            "existing products and adds new ones (synthetic data, rolled back)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=20000, help="Rows in the imported file")
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        with rolled_back():
+            # Half of the file updates existing products, half creates new ones
+            create_synthetic_catalogue(rows // 2, seed=70)
+            existing = list(export_rows(Product.objects.filter(barcode__isnull=False)))[:rows // 2]
+            for row in existing:
+                row[4] = round(row[4] * 1.05, 2)
+            new = [
+                [''] + row[1:]
+                for row in export_rows_of(synthetic_products(rows - len(existing), seed=71))
+            ]
+            with tempfile.TemporaryFile() as file:
+                write_xlsx(existing + new, file)
+                file.seek(0)
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    result = import_products(file)
+                elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            f"{rows} rows: {result.created} created, {result.updated} updated, {len(result.errors)} errors   "
+            f"{elapsed:6.2f} s   {rows / elapsed:8.0f} rows/s   {len(ctx.captured_queries)} queries"
+        )
+
+
+def export_rows_of(products):
+    therapeutic_classes = dict(Product.THERAPEUTIC_CLASSES)
+    for p in products:
+        yield [
+            None, p.name, p.dci, therapeutic_classes[p.therapeutic_class], float(p.cost_price),
+            float(p.selling_price), p.is_active, p.barcode, p.current_stock, p.minimum_stock_level,
+        ]
@@ -0,0 +1,49 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventory.benchmarks import create_synthetic_catalogue, rolled_back
+from inventory.models import Product, PurchaseOrder, PurchaseOrderItem, Supplier
+from inventory.receiving import ReceiptLine, receive_purchase_order
+
+
+class Command(BaseCommand):
+    help = ("Time the receipt of a large wholesale delivery against a purchase order "
+            "(synthetic data, rolled back)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=20000, help="Catalogue size")
+        parser.add_argument('--lines', type=int, default=500, help="Products on the order")
+        parser.add_argument('--batches', type=int, default=2, help="Batches delivered per product")
+
+    def handle(self, *args, **options):
+        rng = random.Random(100)
+        expiry = timezone.localdate() + timedelta(days=365)
+        with rolled_back():
+            create_synthetic_catalogue(options['products'], seed=100)
+            supplier = Supplier.objects.create(name='Grossiste')
+            pks = rng.sample(list(Product.objects.values_list('pk', flat=True)), options['lines'])
+            order = PurchaseOrder.objects.create(supplier=supplier, status='ordered')
+            PurchaseOrderItem.objects.bulk_create(
+                [PurchaseOrderItem(purchase_order=order, product_id=pk, quantity=100 * options['batches'], unit_price=2)
+                 for pk in pks]
+            )
+            # Delivered in two parts: half of the batches, then the rest
+            for part in range(2):
+                lines = [
+                    ReceiptLine(pk, f'L{pk}-{part}-{n}', expiry, 50)
+                    for pk in pks for n in range(options['batches'])
+                ]
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    result = receive_purchase_order(order.pk, lines)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"receipt {part + 1}: {len(lines)} lines, {result.units} units, order {result.status}   "
+                    f"{elapsed:6.2f} s   {len(ctx.captured_queries)} queries"
+                )
@@ -0,0 +1,53 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventory.benchmarks import create_synthetic_catalogue, rolled_back
+from inventory.models import Product, ProductBatch, StockMovement
+from inventory.reconcile import reconcile
+
+
+class Command(BaseCommand):
+    help = ("Time the stock reconciliation on a synthetic catalogue with batches and movements "
+            "(synthetic data, rolled back)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100000)
+        parser.add_argument('--movements', type=int, default=3, help="Movements per product")
+
+    def handle(self, *args, **options):
+        rng = random.Random(80)
+        with rolled_back():
+            create_synthetic_catalogue(options['products'], seed=80)
+            products = list(Product.objects.values_list('pk', 'current_stock'))
+            expiry = timezone.localdate() + timedelta(days=365)
+            ProductBatch.objects.bulk_create(
+                [ProductBatch(product_id=pk, batch_number=f'B{pk}', expiry_date=expiry, quantity=stock, purchase_price=1)
+                 for pk, stock in products if stock],
+                batch_size=5000,
+            )
+            # Movements add up to the stock, except for one product in ten
+            movements = []
+            for pk, stock in products:
+                split = [rng.randint(0, stock) for _ in range(options['movements'] - 1)]
+                quantities = [stock - sum(split)] + split if rng.random() > 0.1 else split
+                movements.extend(
+                    StockMovement(product_id=pk, movement_type='adjustment', quantity=q, previous_stock=0, new_stock=0)
+                    for q in quantities
+                )
+            StockMovement.objects.bulk_create(movements, batch_size=5000)
+
+            for fix in (False, True, False):
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    result = reconcile(fix=fix, limit=100)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{'fix   ' if fix else 'report'} {result.checked} products   {result.counts}   "
+                    f"{result.corrected} corrected   {elapsed:6.2f} s   {len(ctx.captured_queries)} queries"
+                )
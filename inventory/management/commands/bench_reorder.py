@@ -0,0 +1,57 @@
+import random
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from inventory.benchmarks import create_synthetic_catalogue, rolled_back
+from inventory.models import Product, ProductBatch, Supplier
+from inventory.reorder import REORDER_HISTORY_DAYS, forecasts, suggest_reorders
+from sales.models import DailyProductSalesRollup
+
+
+class Command(BaseCommand):
+    help = ("Time the reorder suggestions on a synthetic catalogue with suppliers and sales history "
+            "(synthetic data, rolled back)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=50000)
+        parser.add_argument('--suppliers', type=int, default=20)
+        parser.add_argument('--selling', type=float, default=0.2, help="Share of the products with daily sales")
+
+    def handle(self, *args, **options):
+        rng = random.Random(90)
+        today = timezone.localdate()
+        with rolled_back():
+            create_synthetic_catalogue(options['products'], seed=90)
+            suppliers = Supplier.objects.bulk_create(
+                [Supplier(name=f'Fournisseur {i}') for i in range(options['suppliers'])]
+            )
+            pks = list(Product.objects.values_list('pk', flat=True))
+            ProductBatch.objects.bulk_create(
+                [ProductBatch(product_id=pk, batch_number=f'B{pk}', expiry_date=today + timedelta(days=365),
+                              quantity=0, purchase_price=1, supplier=rng.choice(suppliers)) for pk in pks],
+                batch_size=5000,
+            )
+            selling = rng.sample(pks, int(len(pks) * options['selling']))
+            DailyProductSalesRollup.objects.bulk_create(
+                [DailyProductSalesRollup(date=today - timedelta(days=d), product_id=pk, quantity=q, revenue=q, cost=q)
+                 for pk in selling for d in range(1, REORDER_HISTORY_DAYS + 1) for q in [rng.randint(0, 6)] if q],
+                batch_size=5000,
+            )
+
+            start = time.perf_counter()
+            forecasts(today)
+            self.stdout.write(f"forecasts only   {time.perf_counter() - start:6.2f} s")
+            for dry_run in (True, False, False):
+                start = time.perf_counter()
+                with CaptureQueriesContext(connection) as ctx:
+                    result = suggest_reorders(dry_run=dry_run)
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"{'preview' if dry_run else 'write  '} {len(pks)} products: {result.orders} orders, "
+                    f"{result.lines} lines   {elapsed:6.2f} s   {len(ctx.captured_queries)} queries"
+                )
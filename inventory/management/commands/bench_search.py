@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from inventory.benchmarks import create_synthetic_catalogue, format_line, measure, rolled_back
+from inventory.models import Product
+from inventory.search import CatalogueIndex
+
+QUERIES = [
+    'amox', 'para', 'ibuprof', '500mg', 'sirop', 'cipro', '6111234', 'zzz',
+    # accent-less, typo and multi-word queries only the ranked index answers
+    'paracetamol', 'amoxiciline', 'metronidazol', 'amoxicilline 500', 'ciprofloxacinne sirop',
+]
+
+
+class Command(BaseCommand):
+    help = "Compare POS product search through the catalogue index with the ORM icontains query"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=0,
+                            help="Create this many synthetic products (rolled back afterwards)")
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            if options['products']:
+                create_synthetic_catalogue(options['products'])
+            self.run(options['repeat'])
+
+    def run(self, repeat):
+        total = Product.objects.count()
+        self.stdout.write(f"Catalogue: {total} products")
+
+        index = CatalogueIndex()
+        build = measure(index.build, repeat=1)
+        self.stdout.write(format_line('index build', build))
+
+        for query in QUERIES:
+            def orm():
+                return list(Product.objects.filter(
+                    Q(name__icontains=query) | Q(barcode__icontains=query),
+                    is_active=True
+                )[:10])
+
+            self.stdout.write(format_line(f"orm   '{query}'", measure(orm, repeat)))
+            self.stdout.write(format_line(
+                f"index '{query}'", measure(lambda: index.search(query, limit=10), repeat)
+            ))
@@ -0,0 +1,30 @@
+import time
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import classification
+
+
+class Command(BaseCommand):
+    help = ("Recompute the turnover, days of cover and ABC/XYZ class of every active product; "
+            "meant to run every night (the jobs worker also enqueues it when the day changes)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Day to classify on (YYYY-MM-DD, default today): the window ends the day before")
+        parser.add_argument('--days', type=int, default=classification.CLASSIFICATION_WINDOW_DAYS,
+                            help="Length of the sales window in days")
+
+    def handle(self, *args, **options):
+        try:
+            day = date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError as exc:
+            raise CommandError(f"Date invalide: {exc}")
+        if options['days'] < 1:
+            raise CommandError("--days doit être au moins 1")
+
+        start = time.perf_counter()
+        count = classification.classify_products(day, options['days'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{count} classification(s) mise(s) à jour en {time.perf_counter() - start:.2f} s"
+        ))
@@ -0,0 +1,22 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import expiry
+
+
+class Command(BaseCommand):
+    help = ("Take the remaining units of expired batches out of stock with 'expiry' stock movements; "
+            "meant to run every night (the jobs worker also enqueues it when the day changes)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Day to write off for (YYYY-MM-DD, default today): batches expired before it")
+
+    def handle(self, *args, **options):
+        try:
+            day = date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError as exc:
+            raise CommandError(f"Date invalide: {exc}")
+
+        count = expiry.write_off_expired(day)
+        self.stdout.write(self.style.SUCCESS(f"{count} lot(s) expiré(s) retiré(s) du stock"))
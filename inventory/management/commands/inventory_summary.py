@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from inventory import summary
+
+
+class Command(BaseCommand):
+    help = "Rebuild the inventory summary rows from the catalogue, or check them with --verify"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help="Only compare the stored counters with the catalogue; fail on drift")
+
+    def handle(self, *args, **options):
+        drift = summary.verify()
+        for therapeutic_class, field, stored, expected in drift:
+            self.stdout.write(f"{therapeutic_class or 'global'}.{field}: stored {stored}, expected {expected}")
+
+        if options['verify']:
+            if drift:
+                raise CommandError(f"{len(drift)} compteur(s) incorrect(s) dans la synthèse du stock")
+            self.stdout.write(self.style.SUCCESS("Synthèse du stock à jour"))
+            return
+
+        summary.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f"Synthèse du stock reconstruite ({len(drift)} compteur(s) corrigé(s))"
+        ))
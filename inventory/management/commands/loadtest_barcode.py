@@ -0,0 +1,85 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+
+from inventory.barcode_cache import barcode_cache
+from inventory.benchmarks import create_synthetic_catalogue, summarize, throwaway_database
+from inventory.models import Product
+
+
+class Command(BaseCommand):
+    help = ("Simulate several tills scanning barcodes through the POS API and report "
+            "latency and barcode cache hit rates")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tills', type=int, default=4)
+        parser.add_argument('--rate', type=float, default=100,
+                            help="Scans per second for each till")
+        parser.add_argument('--duration', type=float, default=10, help="Seconds")
+        parser.add_argument('--products', type=int, default=0,
+                            help="Scan this many synthetic products in a throwaway database")
+
+    def handle(self, *args, **options):
+        if options['products']:
+            with throwaway_database():
+                create_synthetic_catalogue(options['products'], seed=99)
+                self.scan(options)
+        else:
+            self.scan(options)
+
+    def scan(self, options):
+        barcodes = list(
+            Product.objects.filter(is_active=True).exclude(barcode=None).exclude(barcode='')
+            .values_list('barcode', flat=True)
+        )
+        if not barcodes:
+            self.stderr.write("No product with a barcode; use --products")
+            return
+        self.run(barcodes, options['tills'], options['rate'], options['duration'])
+
+    def run(self, barcodes, tills, rate, duration):
+        barcode_cache.clear()
+        barcode_cache.reset_stats()
+        # A shelf is not scanned uniformly: a few products make most scans
+        weights = [1 / rank for rank in range(1, len(barcodes) + 1)]
+        latencies = []
+        errors = []
+
+        def till(seed):
+            rng = random.Random(seed)
+            client = Client()
+            interval = 1 / rate
+            deadline = time.perf_counter() + duration
+            next_scan = time.perf_counter()
+            try:
+                while next_scan < deadline:
+                    barcode = rng.choices(barcodes, weights)[0]
+                    start = time.perf_counter()
+                    resp = client.get('/api/products/barcode-search/', {'barcode': barcode})
+                    latencies.append(time.perf_counter() - start)
+                    if resp.status_code != 200 or not resp.json()['success']:
+                        errors.append(barcode)
+                    next_scan += interval
+                    time.sleep(max(0, next_scan - time.perf_counter()))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=till, args=(seed,)) for seed in range(tills)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        stats = summarize(latencies)
+        self.stdout.write(f"{len(latencies)} scans from {tills} tills in {elapsed:.1f} s "
+                          f"({len(latencies) / elapsed:.0f} scans/s, target {tills * rate:.0f})")
+        self.stdout.write(f"latency median {stats['median_ms']:.3f} ms, p95 {stats['p95_ms']:.3f} ms, "
+                          f"max {max(latencies) * 1000:.3f} ms")
+        self.stdout.write(f"errors: {len(errors)}")
+        self.stdout.write(f"cache: {barcode_cache.stats()}")
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.reconcile import DISCREPANCY_KINDS, reconcile
+
+
+class Command(BaseCommand):
+    help = ("Compare every product's current stock with the sum of its batches and of its stock movements, "
+            "and optionally correct the movements with 'adjustment' movements")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', help="Correct the movement differences")
+        parser.add_argument('--limit', type=int, default=50, help="Products listed (all are counted)")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        result = reconcile(fix=options['fix'], limit=options['limit'])
+        elapsed = time.perf_counter() - start
+
+        labels = dict(DISCREPANCY_KINDS)
+        for row in result.discrepancies:
+            self.stdout.write(
+                f"#{row['product_id']} {row['product_name']}: stock {row['current_stock']}, "
+                f"lots {row['batch_stock']}, mouvements {row['ledger_stock']}"
+            )
+        for kind, count in result.counts.items():
+            self.stdout.write(f"{labels[kind]}: {count}")
+        if options['fix']:
+            self.stdout.write(f"{result.corrected} mouvement(s) de correction enregistré(s)")
+        self.stdout.write(self.style.SUCCESS(f"{result.checked} produit(s) vérifié(s) en {elapsed:.2f} s"))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from inventory import jobs
+
+
+class Command(BaseCommand):
+    help = ("Run the background jobs (imports, exports, PDF reports) in this process; "
+            "use with JOBS_RUN_IN_PROCESS=0 in the web server's environment")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Enqueue today's nightly jobs if needed, run the pending jobs and exit instead of "
+                                 "waiting for new ones (schedule it every night where no worker runs all the time)")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            jobs.fail_stale()
+            jobs.schedule_nightly()
+            count = jobs.run_pending()
+            self.stdout.write(self.style.SUCCESS(f"{count} tâche(s) exécutée(s)"))
+            return
+
+        self.stdout.write(f"En attente de tâches (vérification toutes les {jobs.POLL_INTERVAL} s)...")
+        worker = jobs.Worker()
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from inventory import ledger
+
+
+class Command(BaseCommand):
+    help = ("Record the stock of the products whose stock moved since their last snapshot; "
+            "the nightly jobs do it every night, so point-in-time stock only replays a day of movements")
+
+    def handle(self, *args, **options):
+        count = ledger.take_snapshots()
+        self.stdout.write(self.style.SUCCESS(f"{count} instantané(s) de stock enregistré(s)"))
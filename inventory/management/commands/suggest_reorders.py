@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from inventory.reorder import suggest_reorders
+
+
+class Command(BaseCommand):
+    help = ("Forecast the demand of every active product and write the products to reorder as draft "
+            "purchase orders, one per supplier (replacing the drafts of the previous run)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="List the suggestions without writing them")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        result = suggest_reorders(dry_run=options['dry_run'], limit=20 if options['dry_run'] else 0)
+        elapsed = time.perf_counter() - start
+
+        for row in result.suggestions:
+            self.stdout.write(
+                f"#{row['product_id']} {row['product_name']}: stock {row['current_stock']}, "
+                f"en commande {row['on_order']}, prévision {row['forecast']}/j -> {row['quantity']}"
+            )
+        if result.without_supplier:
+            self.stdout.write(self.style.WARNING(
+                f"{result.without_supplier} produit(s) à commander sans fournisseur connu"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"{result.orders} bon(s) de commande, {result.lines} ligne(s), {result.total_amount:.2f} "
+            f"{'(simulation) ' if options['dry_run'] else ''}en {elapsed:.2f} s"
+        ))
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0006_alter_product_barcode'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('therapeutic_class', models.CharField(blank=True, max_length=50, unique=True, verbose_name='Classe thérapeutique')),
+                ('product_count', models.IntegerField(default=0, verbose_name='Produits actifs')),
+                ('total_units', models.BigIntegerField(default=0, verbose_name='Unités en stock')),
+                ('stock_value', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Valeur du stock')),
+                ('potential_revenue', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name="Chiffre d'affaires potentiel")),
+                ('low_stock_count', models.IntegerField(default=0, verbose_name='Produits en stock faible')),
+                ('out_of_stock_count', models.IntegerField(default=0, verbose_name='Produits en rupture')),
+                ('critical_expiry_count', models.IntegerField(default=0, verbose_name='Lots expirant sous 30 jours')),
+                ('expired_count', models.IntegerField(default=0, verbose_name='Lots expirés')),
+                ('expiry_as_of', models.DateField(verbose_name='Date de calcul des expirations')),
+                ('version', models.PositiveBigIntegerField(default=0, verbose_name='Version')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Synthèse du stock',
+                'verbose_name_plural': 'Synthèses du stock',
+                'ordering': ['therapeutic_class'],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_date_range_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('import_products', 'Import de produits'), ('export_products', 'Export de produits'), ('inventory_pdf', "Rapport d'inventaire PDF")], max_length=30, verbose_name='Type')),
+                ('status', models.CharField(choices=[('pending', 'En attente'), ('running', 'En cours'), ('done', 'Terminée'), ('failed', 'Échouée')], default='pending', max_length=10, verbose_name='Statut')),
+                ('params', models.JSONField(blank=True, default=dict, verbose_name='Paramètres')),
+                ('progress', models.PositiveIntegerField(default=0, verbose_name='Progression')),
+                ('total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Total')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='Résultat')),
+                ('result_file', models.CharField(blank=True, max_length=255, verbose_name='Fichier résultat')),
+                ('result_name', models.CharField(blank=True, max_length=100, verbose_name='Nom du fichier')),
+                ('result_content_type', models.CharField(blank=True, max_length=100)),
+                ('error', models.TextField(blank=True, verbose_name='Erreur')),
+                ('created_by', models.CharField(default='Système', max_length=100, verbose_name='Lancée par')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Tâche de fond',
+                'verbose_name_plural': 'Tâches de fond',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='job_status_created_idx')],
+            },
+        ),
+    ]
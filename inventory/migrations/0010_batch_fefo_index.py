@@ -0,0 +1,17 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0009_job'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['product', 'expiry_date'], name='batch_open_fefo_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_batch_fefo_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_products', 'Import de produits'), ('export_products', 'Export de produits'), ('inventory_pdf', "Rapport d'inventaire PDF"), ('expire_batches', 'Retrait des lots expirés')], max_length=30, verbose_name='Type'),
+        ),
+        migrations.AddIndex(
+            model_name='productbatch',
+            index=models.Index(condition=models.Q(('quantity__gt', 0)), fields=['expiry_date'], name='batch_open_expiry_idx'),
+        ),
+    ]
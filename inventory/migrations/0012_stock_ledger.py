@@ -0,0 +1,53 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0011_expiry_buckets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('taken_at', models.DateTimeField(verbose_name='Date')),
+                ('stock', models.IntegerField(verbose_name='Stock')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='inventory.product')),
+            ],
+            options={
+                'verbose_name': 'Instantané de stock',
+                'verbose_name_plural': 'Instantanés de stock',
+                'ordering': ['-taken_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockMovementArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('movement_type', models.CharField(choices=[('sale', 'Vente'), ('receipt', 'Réception'), ('adjustment', 'Ajustement'), ('return', 'Retour'), ('damage', 'Produit endommagé'), ('expiry', 'Produit expiré')], max_length=20)),
+                ('quantity', models.IntegerField(verbose_name='Quantité')),
+                ('previous_stock', models.IntegerField(verbose_name='Stock précédent')),
+                ('new_stock', models.IntegerField(verbose_name='Nouveau stock')),
+                ('reference', models.CharField(blank=True, max_length=100, verbose_name='Référence')),
+                ('reason', models.TextField(blank=True, verbose_name='Raison')),
+                ('created_by', models.CharField(default='Système', max_length=100, verbose_name='Effectué par')),
+                ('created_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_stock_movements', to='inventory.product')),
+            ],
+            options={
+                'verbose_name': 'Mouvement de stock archivé',
+                'verbose_name_plural': 'Mouvements de stock archivés',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['product', 'created_at'], name='stockarch_product_created_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='stocksnapshot',
+            constraint=models.UniqueConstraint(fields=('product', 'taken_at'), name='stocksnapshot_product_taken_uniq'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0012_stock_ledger'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_products', 'Import de produits'), ('export_products', 'Export de produits'), ('inventory_pdf', "Rapport d'inventaire PDF"), ('expire_batches', 'Retrait des lots expirés'), ('reconcile_stock', 'Rapprochement des stocks')], max_length=30, verbose_name='Type'),
+        ),
+    ]
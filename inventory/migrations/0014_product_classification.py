@@ -0,0 +1,42 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0013_reconcile_stock_job'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_products', 'Import de produits'), ('export_products', 'Export de produits'), ('inventory_pdf', "Rapport d'inventaire PDF"), ('expire_batches', 'Retrait des lots expirés'), ('reconcile_stock', 'Rapprochement des stocks'), ('classify_products', 'Classification ABC/XYZ')], max_length=30, verbose_name='Type'),
+        ),
+        migrations.CreateModel(
+            name='ProductClassification',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='classification', serialize=False, to='inventory.product')),
+                ('computed_on', models.DateField(verbose_name='Mis à jour le')),
+                ('window_days', models.PositiveIntegerField(verbose_name='Période (jours)')),
+                ('units_sold', models.IntegerField(verbose_name='Unités vendues')),
+                ('revenue', models.DecimalField(decimal_places=2, max_digits=14, verbose_name="Chiffre d'affaires")),
+                ('average_daily_demand', models.FloatField(verbose_name='Demande journalière moyenne')),
+                ('demand_std', models.FloatField(verbose_name='Écart-type de la demande')),
+                ('demand_cv', models.FloatField(blank=True, null=True, verbose_name='Coefficient de variation')),
+                ('average_stock', models.FloatField(verbose_name='Stock moyen')),
+                ('turnover', models.FloatField(blank=True, null=True, verbose_name='Rotation annuelle')),
+                ('days_of_cover', models.FloatField(blank=True, null=True, verbose_name='Jours de couverture')),
+                ('abc_class', models.CharField(choices=[('A', "A - 80 % du chiffre d'affaires"), ('B', 'B - 15 % suivants'), ('C', 'C - 5 % restants')], max_length=1, verbose_name='Classe ABC')),
+                ('xyz_class', models.CharField(choices=[('X', 'X - Demande régulière'), ('Y', 'Y - Demande variable'), ('Z', 'Z - Demande irrégulière')], max_length=1, verbose_name='Classe XYZ')),
+            ],
+            options={
+                'verbose_name': 'Classification de produit',
+                'verbose_name_plural': 'Classifications de produits',
+                'indexes': [models.Index(fields=['abc_class', 'xyz_class'], name='classification_abc_xyz_idx')],
+            },
+        ),
+    ]
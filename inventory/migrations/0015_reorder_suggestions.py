@@ -0,0 +1,23 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0014_product_classification'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_products', 'Import de produits'), ('export_products', 'Export de produits'), ('inventory_pdf', "Rapport d'inventaire PDF"), ('expire_batches', 'Retrait des lots expirés'), ('reconcile_stock', 'Rapprochement des stocks'), ('classify_products', 'Classification ABC/XYZ'), ('suggest_reorders', 'Suggestions de réapprovisionnement')], max_length=30, verbose_name='Type'),
+        ),
+        migrations.AlterField(
+            model_name='purchaseorder',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Montant total'),
+        ),
+    ]
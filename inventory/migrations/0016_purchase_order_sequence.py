@@ -0,0 +1,45 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:02
+
+import datetime
+
+from django.db import migrations, models
+
+
+def seed_sequences(apps, schema_editor):
+    """Start each day's counter after the numbers already given out that day."""
+    PurchaseOrder = apps.get_model('inventory', 'PurchaseOrder')
+    PurchaseOrderSequence = apps.get_model('inventory', 'PurchaseOrderSequence')
+
+    last_numbers = {}
+    for number in PurchaseOrder.objects.filter(order_number__startswith='BC-').values_list('order_number', flat=True):
+        try:
+            _, day, sequence = number.split('-')
+            day, sequence = datetime.datetime.strptime(day, '%Y%m%d').date(), int(sequence)
+        except ValueError:
+            continue
+        last_numbers[day] = max(last_numbers.get(day, 0), sequence)
+    PurchaseOrderSequence.objects.bulk_create(
+        [PurchaseOrderSequence(day=day, last_number=last) for day, last in last_numbers.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0015_reorder_suggestions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PurchaseOrderSequence',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False, verbose_name='Jour')),
+                ('last_number', models.PositiveIntegerField(default=0, verbose_name='Dernier numéro')),
+            ],
+            options={
+                'verbose_name': 'Compteur de bons de commande',
+                'verbose_name_plural': 'Compteurs de bons de commande',
+            },
+        ),
+        migrations.RunPython(seed_sequences, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.2 on 2026-10-18 17:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0016_purchase_order_sequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='job',
+            name='kind',
+            field=models.CharField(choices=[('import_products', 'Import de produits'), ('export_products', 'Export de produits'), ('inventory_pdf', "Rapport d'inventaire PDF"), ('expire_batches', 'Retrait des lots expirés'), ('reconcile_stock', 'Rapprochement des stocks'), ('classify_products', 'Classification ABC/XYZ'), ('suggest_reorders', 'Suggestions de réapprovisionnement'), ('take_snapshots', 'Instantanés de stock')], max_length=30, verbose_name='Type'),
+        ),
+    ]
@@ -1,4 +1,5 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Sum
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 
@@ -162,13 +163,19 @@ class ProductBatch(models.Model):
         verbose_name = "Lot de produit"
         verbose_name_plural = "Lots de produits"
         ordering = ['expiry_date']
+        indexes = [
+            # Open batches of a product, earliest expiry first (FEFO allocation)
+            models.Index(fields=['product', 'expiry_date'], condition=Q(quantity__gt=0), name='batch_open_fefo_idx'),
+            # Open batches of all products by expiry date (expiry buckets and alerts)
+            models.Index(fields=['expiry_date'], condition=Q(quantity__gt=0), name='batch_open_expiry_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - Lot: {self.batch_number}"
 
     @property
     def days_until_expiry(self):
-        today = timezone.now().date()
+        today = timezone.localdate()
         delta = self.expiry_date - today
         return delta.days
 
@@ -220,11 +227,86 @@ class StockMovement(models.Model):
         verbose_name = "Mouvement de stock"
         verbose_name_plural = "Mouvements de stock"
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='stockmove_product_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} - {self.get_movement_type_display()} - {self.quantity} unités"
 
 
+class StockMovementArchive(models.Model):
+    """Stock movements moved out of ``StockMovement`` by ``manage.py archive_stock_movements``."""
+    id = models.BigIntegerField(primary_key=True)  # the id the movement had in StockMovement
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='archived_stock_movements')
+    movement_type = models.CharField(max_length=20, choices=StockMovement.MOVEMENT_TYPES)
+    quantity = models.IntegerField(verbose_name="Quantité")
+    previous_stock = models.IntegerField(verbose_name="Stock précédent")
+    new_stock = models.IntegerField(verbose_name="Nouveau stock")
+    reference = models.CharField(max_length=100, blank=True, verbose_name="Référence")
+    reason = models.TextField(blank=True, verbose_name="Raison")
+    created_by = models.CharField(max_length=100, default="Système", verbose_name="Effectué par")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Mouvement de stock archivé"
+        verbose_name_plural = "Mouvements de stock archivés"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['product', 'created_at'], name='stockarch_product_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} - {self.get_movement_type_display()} - {self.quantity} unités"
+
+
+class StockSnapshot(models.Model):
+    """A product's stock at ``taken_at``, the starting point for replaying its movements."""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_snapshots')
+    taken_at = models.DateTimeField(verbose_name="Date")
+    stock = models.IntegerField(verbose_name="Stock")
+
+    class Meta:
+        verbose_name = "Instantané de stock"
+        verbose_name_plural = "Instantanés de stock"
+        ordering = ['-taken_at']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'taken_at'], name='stocksnapshot_product_taken_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} - {self.taken_at:%d/%m/%Y %H:%M} - {self.stock} unités"
+
+
+class PurchaseOrderSequence(models.Model):
+    """Last purchase order number given out on a day (numbers are ``BC-YYYYMMDD-XXXX``)."""
+    day = models.DateField(primary_key=True, verbose_name="Jour")
+    last_number = models.PositiveIntegerField(default=0, verbose_name="Dernier numéro")
+
+    class Meta:
+        verbose_name = "Compteur de bons de commande"
+        verbose_name_plural = "Compteurs de bons de commande"
+
+    def __str__(self):
+        return f"{self.day:%d/%m/%Y} - {self.last_number}"
+
+    @classmethod
+    def next_numbers(cls, count=1, day=None):
+        """Reserve ``count`` order numbers for ``day`` (default today) and return them.
+
+        The counter row is incremented with an ``F()`` update, so concurrent
+        callers always get distinct numbers. The insert comes first: on SQLite
+        the transaction takes the write lock at once and waits its turn,
+        instead of failing to upgrade a read lock.
+        """
+        day = day or timezone.localdate()
+        with transaction.atomic():
+            cls.objects.bulk_create([cls(day=day)], ignore_conflicts=True)
+            cls.objects.filter(day=day).update(last_number=F('last_number') + count)
+            last = cls.objects.filter(day=day).values_list('last_number', flat=True).get()
+        return [f"BC-{day:%Y%m%d}-{number:04d}" for number in range(last - count + 1, last + 1)]
+
+
 class PurchaseOrder(models.Model):
     STATUS_CHOICES = [
         ('draft', 'Brouillon'),
@@ -238,7 +320,8 @@ class PurchaseOrder(models.Model):
     order_date = models.DateField(auto_now_add=True, verbose_name="Date de commande")
     expected_delivery = models.DateField(null=True, blank=True, verbose_name="Livraison prévue")
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='draft')
-    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Montant total")
+    # Kept up to date by PurchaseOrderItem.save() and delete()
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Montant total")
     notes = models.TextField(blank=True, verbose_name="Notes")
     created_by = models.CharField(max_length=100, default="Système", verbose_name="Créé par")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -254,23 +337,21 @@ class PurchaseOrder(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.order_number:
-            # Generate order number: BC-YYYYMMDD-XXXX
-            from datetime import datetime
-            date_part = datetime.now().strftime('%Y%m%d')
-            last_order = PurchaseOrder.objects.filter(order_number__startswith=f'BC-{date_part}').order_by('order_number').last()
-            if last_order:
-                last_num = int(last_order.order_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            self.order_number = f"BC-{date_part}-{new_num:04d}"
-
-        # Calculate total amount from items
-        if self.id:
-            self.total_amount = sum(item.total_price for item in self.items.all())
-
+            self.order_number = PurchaseOrderSequence.next_numbers()[0]
         super().save(*args, **kwargs)
 
+    def recalculate_total(self):
+        """Recompute ``total_amount`` from the items with one aggregate query.
+
+        Only needed after items were written with queryset methods
+        (``bulk_create``, ``update``, ``delete``), which bypass the items' own
+        bookkeeping.
+        """
+        total = self.items.aggregate(total=Sum(F('quantity') * F('unit_price')))['total'] or 0
+        PurchaseOrder.objects.filter(pk=self.pk).update(total_amount=total)
+        self.total_amount = total
+
+
 class PurchaseOrderItem(models.Model):
     purchase_order = models.ForeignKey(PurchaseOrder, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE, verbose_name="Produit")
@@ -289,6 +370,153 @@ class PurchaseOrderItem(models.Model):
     def total_price(self):
         return self.quantity * self.unit_price
 
+    def _add_to_order(self, order_id, amount):
+        if not amount:
+            return
+        PurchaseOrder.objects.filter(pk=order_id).update(total_amount=F('total_amount') + amount)
+        # Keep a loaded order in step, so saving it does not write back its old total
+        order = self._state.fields_cache.get('purchase_order')
+        if order is not None and order.pk == order_id:
+            order.total_amount += amount
+
+    def save(self, *args, **kwargs):
+        # The order's total moves by the difference with the saved line
+        with transaction.atomic():
+            old = None
+            if self.pk is not None:
+                old = PurchaseOrderItem.objects.filter(pk=self.pk).values_list(
+                    'purchase_order_id', 'quantity', 'unit_price'
+                ).first()
+            super().save(*args, **kwargs)
+            if old is not None and old[0] == self.purchase_order_id:
+                self._add_to_order(self.purchase_order_id, self.total_price - old[1] * old[2])
+                return
+            if old is not None:
+                self._add_to_order(old[0], -old[1] * old[2])
+            self._add_to_order(self.purchase_order_id, self.total_price)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            old = PurchaseOrderItem.objects.filter(pk=self.pk).values_list('quantity', 'unit_price').first()
+            result = super().delete(*args, **kwargs)
+            if old is not None:
+                self._add_to_order(self.purchase_order_id, -old[0] * old[1])
+        return result
+
     @property
     def pending_quantity(self):
         return self.quantity - self.received_quantity
+
+
+class InventorySummary(models.Model):
+    """Stock counters kept up to date by ``inventory.summary``.
+
+    One row per therapeutic class plus a global row (``therapeutic_class``
+    empty). Only active products and their batches with remaining quantity are
+    counted, as on the inventory dashboard.
+    """
+    therapeutic_class = models.CharField(max_length=50, blank=True, unique=True, verbose_name="Classe thérapeutique")
+    product_count = models.IntegerField(default=0, verbose_name="Produits actifs")
+    total_units = models.BigIntegerField(default=0, verbose_name="Unités en stock")
+    stock_value = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name="Valeur du stock")
+    potential_revenue = models.DecimalField(max_digits=16, decimal_places=2, default=0, verbose_name="Chiffre d'affaires potentiel")
+    low_stock_count = models.IntegerField(default=0, verbose_name="Produits en stock faible")
+    out_of_stock_count = models.IntegerField(default=0, verbose_name="Produits en rupture")
+    critical_expiry_count = models.IntegerField(default=0, verbose_name="Lots expirant sous 30 jours")
+    expired_count = models.IntegerField(default=0, verbose_name="Lots expirés")
+    expiry_as_of = models.DateField(verbose_name="Date de calcul des expirations")
+    version = models.PositiveBigIntegerField(default=0, verbose_name="Version")
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Synthèse du stock"
+        verbose_name_plural = "Synthèses du stock"
+        ordering = ['therapeutic_class']
+
+    def __str__(self):
+        return f"Synthèse {self.therapeutic_class or 'globale'}"
+
+
+class ProductClassification(models.Model):
+    """Turnover and ABC/XYZ class of a product, recomputed every night by ``inventory.classification``."""
+    ABC_CLASSES = [
+        ('A', 'A - 80 % du chiffre d\'affaires'),
+        ('B', 'B - 15 % suivants'),
+        ('C', 'C - 5 % restants'),
+    ]
+    XYZ_CLASSES = [
+        ('X', 'X - Demande régulière'),
+        ('Y', 'Y - Demande variable'),
+        ('Z', 'Z - Demande irrégulière'),
+    ]
+
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='classification')
+    computed_on = models.DateField(verbose_name="Mis à jour le")  # last run that changed the row
+    window_days = models.PositiveIntegerField(verbose_name="Période (jours)")
+    units_sold = models.IntegerField(verbose_name="Unités vendues")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="Chiffre d'affaires")
+    average_daily_demand = models.FloatField(verbose_name="Demande journalière moyenne")
+    demand_std = models.FloatField(verbose_name="Écart-type de la demande")
+    demand_cv = models.FloatField(null=True, blank=True, verbose_name="Coefficient de variation")
+    average_stock = models.FloatField(verbose_name="Stock moyen")
+    turnover = models.FloatField(null=True, blank=True, verbose_name="Rotation annuelle")
+    days_of_cover = models.FloatField(null=True, blank=True, verbose_name="Jours de couverture")
+    abc_class = models.CharField(max_length=1, choices=ABC_CLASSES, verbose_name="Classe ABC")
+    xyz_class = models.CharField(max_length=1, choices=XYZ_CLASSES, verbose_name="Classe XYZ")
+
+    class Meta:
+        verbose_name = "Classification de produit"
+        verbose_name_plural = "Classifications de produits"
+        indexes = [
+            models.Index(fields=['abc_class', 'xyz_class'], name='classification_abc_xyz_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.product.name} - {self.abc_class}{self.xyz_class}"
+
+
+class Job(models.Model):
+    """A long back-office task run by the worker of ``inventory.jobs``."""
+    KINDS = [
+        ('import_products', 'Import de produits'),
+        ('export_products', 'Export de produits'),
+        ('inventory_pdf', "Rapport d'inventaire PDF"),
+        ('expire_batches', 'Retrait des lots expirés'),
+        ('reconcile_stock', 'Rapprochement des stocks'),
+        ('classify_products', 'Classification ABC/XYZ'),
+        ('suggest_reorders', 'Suggestions de réapprovisionnement'),
+        ('take_snapshots', 'Instantanés de stock'),
+    ]
+    STATUSES = [
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Terminée'),
+        ('failed', 'Échouée'),
+    ]
+
+    kind = models.CharField(max_length=30, choices=KINDS, verbose_name="Type")
+    status = models.CharField(max_length=10, choices=STATUSES, default='pending', verbose_name="Statut")
+    params = models.JSONField(default=dict, blank=True, verbose_name="Paramètres")
+    progress = models.PositiveIntegerField(default=0, verbose_name="Progression")
+    total = models.PositiveIntegerField(null=True, blank=True, verbose_name="Total")
+    result = models.JSONField(null=True, blank=True, verbose_name="Résultat")
+    result_file = models.CharField(max_length=255, blank=True, verbose_name="Fichier résultat")
+    result_name = models.CharField(max_length=100, blank=True, verbose_name="Nom du fichier")
+    result_content_type = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True, verbose_name="Erreur")
+    created_by = models.CharField(max_length=100, default="Système", verbose_name="Lancée par")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Tâche de fond"
+        verbose_name_plural = "Tâches de fond"
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='job_status_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
@@ -0,0 +1,265 @@
+"""Receiving a delivery against a purchase order.
+
+:func:`receive_purchase_order` books a whole delivery, however many lines,
+in one transaction: the batches are written with one ``bulk_create``, the
+stock is raised with ``F()`` updates through :func:`stock.apply_stock_changes`
+(which logs the ``receipt`` movements with one ``bulk_create``), and the
+received quantities of the order lines with one ``UPDATE``. The order becomes
+``received`` once every line is complete, ``ordered`` while some are pending.
+
+The lines come from the receiving form or from an uploaded ``.xlsx`` or
+``.csv`` file laid out like ``RECEIPT_HEADERS``; :func:`parse_lines` checks
+them all before anything is written.
+"""
+import csv
+import io
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+import openpyxl
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from .models import Product, ProductBatch, PurchaseOrder, PurchaseOrderItem
+from .stock import apply_stock_changes, run_with_retry
+from .summary import SummaryDelta, today
+
+RECEIPT_HEADERS = ["Product ID", "Batch Number", "Expiry Date", "Quantity", "Purchase Price"]
+RECEIPT_FIELDS = ('product_id', 'batch_number', 'expiry_date', 'quantity', 'purchase_price')  # form field names
+RECEIVABLE_STATUSES = ('draft', 'ordered')
+BATCH_NUMBER_MAX_LENGTH = ProductBatch._meta.get_field('batch_number').max_length
+WRITE_BATCH_SIZE = 500
+CSV_ENCODINGS = ('utf-8-sig', 'cp1252')
+
+
+class ReceiptError(Exception):
+    """The delivery cannot be booked; ``errors`` lists the faulty lines."""
+
+    def __init__(self, message, errors=()):
+        super().__init__(message)
+        self.errors = list(errors)  # [{'line': n, 'errors': [...]}]
+
+
+@dataclass
+class ReceiptLine:
+    product_id: int
+    batch_number: str
+    expiry_date: date
+    quantity: int
+    purchase_price: Decimal = None  # the order line's unit price when not given
+    line: int = None  # row of the form or file, for error messages
+
+
+@dataclass
+class ReceiptResult:
+    order_number: str
+    status: str
+    batches: int = 0
+    units: int = 0
+    pending: dict = field(default_factory=dict)  # {product_id: units still expected}
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for layout in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(text, layout).date()
+        except ValueError:
+            pass
+    raise ValueError(value)
+
+
+def _whole_number(value):
+    """``value`` as an ``int``; ``ValueError`` unless it is a whole number (``4``, ``4.0`` or ``"4"``)."""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(value)
+    return int(value)
+
+
+def parse_lines(rows, first_line=1):
+    """``ReceiptLine``s from rows laid out like ``RECEIPT_HEADERS``.
+
+    Blank rows are skipped. Raises ``ReceiptError`` listing every invalid
+    line, numbered from ``first_line``.
+    """
+    lines, errors = [], []
+    for number, row in enumerate(rows, start=first_line):
+        cells = list(row)[:5] + [None] * (5 - len(row))
+        if all(cell in (None, '') for cell in cells):
+            continue
+        product_id, batch_number, expiry_date, quantity, purchase_price = cells
+        problems = []
+        try:
+            # Spreadsheet cells come as floats: 12.7 is no product id
+            product_id = _whole_number(product_id)
+        except (TypeError, ValueError, OverflowError):
+            problems.append('Produit invalide')
+        batch_number = str(batch_number or '').strip()
+        if not batch_number:
+            problems.append('Numéro de lot obligatoire')
+        elif len(batch_number) > BATCH_NUMBER_MAX_LENGTH:
+            problems.append('Numéro de lot trop long')
+        try:
+            expiry_date = _parse_date(expiry_date)
+        except (TypeError, ValueError):
+            problems.append("Date d'expiration invalide, format attendu: AAAA-MM-JJ")
+        try:
+            quantity = _whole_number(quantity)
+            if quantity <= 0:
+                raise ValueError(quantity)
+        except (TypeError, ValueError, OverflowError):
+            problems.append('Quantité invalide')
+        if purchase_price in (None, ''):
+            purchase_price = None
+        else:
+            try:
+                purchase_price = Decimal(str(purchase_price).replace(',', '.')).quantize(Decimal('0.01'))
+                if purchase_price < 0:
+                    raise ValueError(purchase_price)
+            except (ValueError, InvalidOperation):
+                problems.append("Prix d'achat invalide")
+        if problems:
+            errors.append({'line': number, 'errors': problems})
+        else:
+            lines.append(ReceiptLine(product_id, batch_number, expiry_date, quantity, purchase_price, number))
+    if errors:
+        raise ReceiptError('Lignes de livraison invalides', errors)
+    if not lines:
+        raise ReceiptError('Aucune ligne de livraison')
+    return lines
+
+
+def read_delivery_file(file):
+    """``ReceiptLine``s from an uploaded ``.xlsx`` or ``.csv`` file, after its header row."""
+    if getattr(file, 'name', '').lower().endswith('.csv'):
+        content = file.read()
+        # UTF-8, or the ANSI code page Excel uses on French Windows
+        for encoding in CSV_ENCODINGS:
+            try:
+                text = io.StringIO(content.decode(encoding), newline='')
+                break
+            except UnicodeDecodeError:
+                pass
+        else:
+            raise ReceiptError('Fichier illisible, encodage non reconnu (UTF-8 ou Windows-1252 attendu)')
+        try:
+            sample = text.read(4096)
+            text.seek(0)
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t') if sample else csv.excel
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(text, dialect)
+        next(rows, None)
+        return parse_lines(rows, first_line=2)
+
+    try:
+        wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    except Exception:
+        raise ReceiptError('Fichier illisible, formats acceptés: .xlsx ou .csv')
+    try:
+        return parse_lines(wb.active.iter_rows(min_row=2, values_only=True), first_line=2)
+    finally:
+        wb.close()
+
+
+def receive_purchase_order(order_id, lines, created_by="Système"):
+    """Book the delivery ``lines`` against the purchase order; return a ``ReceiptResult``.
+
+    Every product must be on the order, and no line may receive more than
+    is still pending; otherwise ``ReceiptError`` is raised and nothing is
+    written.
+    """
+    def receive():
+        order = PurchaseOrder.objects.select_for_update().select_related('supplier').filter(pk=order_id).first()
+        if order is None:
+            raise PurchaseOrder.DoesNotExist
+        if order.status not in RECEIVABLE_STATUSES:
+            raise ReceiptError(f'Le bon de commande {order.order_number} est {order.get_status_display().lower()}')
+
+        # A product may be on several lines of the order: they are received in order
+        items = {}
+        for item in PurchaseOrderItem.objects.filter(purchase_order=order).order_by('pk'):
+            items.setdefault(item.product_id, []).append(item)
+        expected = {product_id: sum(item.pending_quantity for item in group) for product_id, group in items.items()}
+        received, errors = {}, []
+        for number, line in enumerate(lines, start=1):
+            number = line.line or number
+            if line.product_id not in items:
+                errors.append({'line': number, 'errors': ['Produit absent du bon de commande']})
+                continue
+            received[line.product_id] = received.get(line.product_id, 0) + line.quantity
+            if received[line.product_id] > expected[line.product_id]:
+                errors.append({'line': number, 'errors': [f'Quantité supérieure au reste à recevoir ({expected[line.product_id]})']})
+        if errors:
+            raise ReceiptError('Livraison non conforme au bon de commande', errors)
+
+        batches = ProductBatch.objects.bulk_create(
+            [
+                ProductBatch(
+                    product_id=line.product_id,
+                    batch_number=line.batch_number,
+                    expiry_date=line.expiry_date,
+                    quantity=line.quantity,
+                    purchase_price=items[line.product_id][0].unit_price if line.purchase_price is None else line.purchase_price,
+                    supplier=order.supplier,
+                )
+                for line in lines
+            ],
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        # bulk_create sends no signals: count the new batches in the expiry counters
+        states = {
+            pk: (therapeutic_class, is_active)
+            for pk, therapeutic_class, is_active in Product.objects.filter(pk__in=received).values_list(
+                'pk', 'therapeutic_class', 'is_active'
+            )
+        }
+        day = today()
+        summary = SummaryDelta()
+        for batch in batches:
+            summary.batch(None, states[batch.product_id] + (batch.quantity, batch.expiry_date), day)
+        summary.apply(day)
+
+        apply_stock_changes(
+            received,
+            movement_type='receipt',
+            reference=order.order_number,
+            reason=f"Réception du bon de commande {order.order_number}",
+            created_by=created_by,
+        )
+        # Spread each product's units over its order lines, filling the first ones first
+        item_units = {}
+        for product_id, units in received.items():
+            for item in items[product_id]:
+                part = min(units, item.pending_quantity)
+                if part:
+                    item_units[item.pk] = part
+                    units -= part
+        PurchaseOrderItem.objects.filter(pk__in=item_units).update(
+            received_quantity=F('received_quantity') + Case(
+                *[When(pk=pk, then=Value(units)) for pk, units in item_units.items()],
+                output_field=IntegerField(),
+            )
+        )
+
+        pending = {
+            product_id: units - received.get(product_id, 0)
+            for product_id, units in expected.items()
+            if units > received.get(product_id, 0)
+        }
+        order.status = 'ordered' if pending else 'received'
+        PurchaseOrder.objects.filter(pk=order.pk).update(status=order.status, updated_at=timezone.now())
+        return ReceiptResult(
+            order_number=order.order_number,
+            status=order.status,
+            batches=len(batches),
+            units=sum(received.values()),
+            pending=pending,
+        )
+
+    return run_with_retry(receive)
@@ -0,0 +1,120 @@
+"""Stock reconciliation.
+
+A product's stock can be read three ways: ``Product.current_stock``, the
+units left in its batches, and the sum of its stock movements (live and
+archived). They drift apart when stock is changed behind the application's
+back, or was entered before every change was logged. :func:`reconcile`
+compares the three for the whole catalogue, in chunks of products, with one
+grouped query per table and chunk.
+
+Stock entered without a batch is allowed, so batch differences are only
+reported. Ledger differences can be fixed: the movements are then completed
+with an ``adjustment`` that brings them to ``current_stock``, the stock on
+the shelves, and the product is snapshotted at the correction so replays
+of later dates do not count it as a real change.
+"""
+from dataclasses import dataclass, field
+
+from django.db.models import Sum
+
+from .models import Product, ProductBatch, StockMovement, StockMovementArchive, StockSnapshot
+from .stock import run_with_retry
+
+RECONCILE_CHUNK_SIZE = 5000
+RECONCILE_REPORT_LIMIT = 100  # products listed in a report; all are counted
+DISCREPANCY_KINDS = [
+    ('ledger', 'Stock différent de la somme des mouvements'),
+    ('batches', 'Stock différent de la somme des lots'),
+]
+
+
+@dataclass
+class ReconcileResult:
+    checked: int = 0
+    corrected: int = 0
+    counts: dict = field(default_factory=lambda: {kind: 0 for kind, _ in DISCREPANCY_KINDS})
+    discrepancies: list = field(default_factory=list)  # first ``limit`` products with a difference
+
+
+def _totals(model, first_pk, last_pk):
+    rows = model.objects.filter(product_id__gte=first_pk, product_id__lte=last_pk).values('product_id').annotate(
+        total=Sum('quantity')
+    ).order_by()
+    return {row['product_id']: row['total'] for row in rows}
+
+
+def _check_chunk(first_pk, last_pk):
+    """``(product_id, name, current_stock, batch_stock, ledger_stock)`` for the products in the pk range."""
+    batches = _totals(ProductBatch, first_pk, last_pk)
+    ledger = _totals(StockMovement, first_pk, last_pk)
+    for product_id, total in _totals(StockMovementArchive, first_pk, last_pk).items():
+        ledger[product_id] = ledger.get(product_id, 0) + total
+    products = Product.objects.filter(pk__gte=first_pk, pk__lte=last_pk).order_by('pk').values_list(
+        'pk', 'name', 'current_stock'
+    )
+    return [(pk, name, stock, batches.get(pk, 0), ledger.get(pk, 0)) for pk, name, stock in products]
+
+
+def _corrections(rows, created_by):
+    movements = [
+        StockMovement(
+            product_id=pk,
+            movement_type='adjustment',
+            quantity=stock - ledger_stock,
+            previous_stock=ledger_stock,
+            new_stock=stock,
+            reference="Rapprochement",
+            reason="Écart entre le stock et la somme des mouvements",
+            created_by=created_by,
+        )
+        for pk, _, stock, _, ledger_stock in rows if stock != ledger_stock
+    ]
+    StockMovement.objects.bulk_create(movements)
+    StockSnapshot.objects.bulk_create(
+        [StockSnapshot(product_id=m.product_id, taken_at=m.created_at, stock=m.new_stock) for m in movements],
+        ignore_conflicts=True,
+    )
+    return len(movements)
+
+
+def reconcile(fix=False, limit=None, chunk_size=RECONCILE_CHUNK_SIZE, created_by="Système", progress=None):
+    """Compare the three stock views of every product; return a ``ReconcileResult``.
+
+    With ``fix``, ledger differences are corrected as they are found, in the
+    transaction that read them. ``limit`` caps the number of discrepancies
+    listed (all are counted). ``progress``, if given, is called after each
+    chunk with the number of products checked and the catalogue size.
+    """
+    def check(first_pk, last_pk):
+        rows = _check_chunk(first_pk, last_pk)
+        return rows, _corrections(rows, created_by) if fix else 0
+
+    result = ReconcileResult()
+    total = Product.objects.count()
+    last_pk = 0
+    while True:
+        pks = list(Product.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return result
+        # One transaction per chunk: the four reads see the same state
+        rows, corrected = run_with_retry(check, pks[0], pks[-1])
+        result.corrected += corrected
+        for pk, name, stock, batch_stock, ledger_stock in rows:
+            kinds = [kind for kind, value in (('ledger', ledger_stock), ('batches', batch_stock)) if value != stock]
+            if not kinds:
+                continue
+            for kind in kinds:
+                result.counts[kind] += 1
+            if limit is None or len(result.discrepancies) < limit:
+                result.discrepancies.append({
+                    'product_id': pk,
+                    'product_name': name,
+                    'current_stock': stock,
+                    'batch_stock': batch_stock,
+                    'ledger_stock': ledger_stock,
+                    'kinds': kinds,
+                })
+        result.checked += len(rows)
+        last_pk = pks[-1]
+        if progress is not None:
+            progress(result.checked, total)
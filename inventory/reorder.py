@@ -0,0 +1,168 @@
+"""Reorder suggestions as draft purchase orders.
+
+:func:`suggest_reorders` forecasts each active product's daily demand by
+exponential smoothing of its daily sales over the last
+``REORDER_HISTORY_DAYS`` days (from ``DailyProductSalesRollup``; days without
+sales count as zero, so only the days with sales are read). With a lead time
+of ``REORDER_LEAD_TIME_DAYS`` and a review period of ``REORDER_REVIEW_DAYS``:
+
+* reorder point = forecast × lead time + safety stock, and at least the
+  product's ``minimum_stock_level``;
+* safety stock = z × standard deviation of the daily demand × √(lead time);
+* when the stock plus the quantity already on order is at or below the
+  reorder point, the product is ordered up to what covers the lead time and
+  the review period (with its own safety stock).
+
+A product is ordered from the supplier of its latest batch that had one.
+The suggestions are written as draft ``PurchaseOrder``s, one per supplier,
+with ``bulk_create``. Each run replaces the drafts of the previous run that
+are still drafts; orders placed, or drafted by hand, count as on order.
+"""
+import math
+from dataclasses import dataclass, field
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db.models import F, OuterRef, Subquery, Sum
+
+from sales.models import DailyProductSalesRollup
+
+from .models import Product, ProductBatch, PurchaseOrder, PurchaseOrderItem, PurchaseOrderSequence
+from .stock import run_with_retry
+from .summary import today
+
+REORDER_HISTORY_DAYS = 90
+REORDER_LEAD_TIME_DAYS = 7
+REORDER_REVIEW_DAYS = 7
+SMOOTHING = 0.1  # weight of the most recent day in the forecast
+SERVICE_LEVEL_Z = 1.65  # about 95 % of lead times without a stock-out
+REORDER_AUTHOR = "Réapprovisionnement automatique"
+WRITE_BATCH_SIZE = 500
+
+
+@dataclass
+class ReorderResult:
+    orders: int = 0
+    lines: int = 0
+    total_amount: Decimal = Decimal(0)
+    without_supplier: int = 0  # products to reorder with no known supplier
+    replaced_drafts: int = 0
+    suggestions: list = field(default_factory=list)
+
+
+def forecasts(day, history_days=REORDER_HISTORY_DAYS, alpha=SMOOTHING):
+    """``{product_id: (forecast, standard deviation)}`` of daily demand, for the products that sold.
+
+    The smoothed level after the last day is a weighted sum of the daily
+    sales, the weight of a day ``k`` days before the last being
+    ``alpha × (1 - alpha)^k``; the level starts from the mean demand of the
+    period, which keeps the remaining weight.
+    """
+    start, end = day - timedelta(days=history_days), day - timedelta(days=1)
+    weights = {end - timedelta(days=k): alpha * (1 - alpha) ** k for k in range(history_days)}
+    initial_weight = (1 - alpha) ** history_days
+    totals = {}
+    rows = DailyProductSalesRollup.objects.filter(date__gte=start, date__lte=end).values_list(
+        'product_id', 'date', 'quantity'
+    )
+    for product_id, date, quantity in rows.iterator(chunk_size=5000):
+        total = totals.get(product_id)
+        if total is None:
+            total = totals[product_id] = [0.0, 0, 0]
+        total[0] += weights[date] * quantity
+        total[1] += quantity
+        total[2] += quantity * quantity
+
+    result = {}
+    for product_id, (smoothed, units, squares) in totals.items():
+        mean = units / history_days
+        std = math.sqrt(max(squares / history_days - mean * mean, 0))
+        result[product_id] = (smoothed + initial_weight * mean, std)
+    return result
+
+
+def reorder_quantity(stock, on_order, minimum, forecast, std,
+                     lead_time=REORDER_LEAD_TIME_DAYS, review=REORDER_REVIEW_DAYS, z=SERVICE_LEVEL_Z):
+    """Units to order, or 0 when the product is above its reorder point."""
+    reorder_point = max(forecast * lead_time + z * std * math.sqrt(lead_time), minimum)
+    if stock + on_order > reorder_point:
+        return 0
+    target = max(forecast * (lead_time + review) + z * std * math.sqrt(lead_time + review), minimum + 1)
+    # Rounded first so that float noise never orders one unit more
+    return max(math.ceil(round(target - stock - on_order, 6)), 0)
+
+
+def _on_order(exclude_ids):
+    rows = PurchaseOrderItem.objects.filter(purchase_order__status__in=['draft', 'ordered']).exclude(
+        purchase_order_id__in=exclude_ids
+    ).values('product_id').annotate(pending=Sum(F('quantity') - F('received_quantity'))).order_by()
+    return {row['product_id']: max(row['pending'], 0) for row in rows}
+
+
+def suggest_reorders(day=None, dry_run=False, limit=100):
+    """Create the draft purchase orders for the products to reorder; return a ``ReorderResult``.
+
+    With ``dry_run`` nothing is written. ``limit`` caps the number of
+    suggestions listed in the result (all are counted).
+    """
+    day = day or today()
+    demand = forecasts(day)
+    latest_supplier = ProductBatch.objects.filter(
+        product=OuterRef('pk'), supplier__isnull=False, supplier__is_active=True
+    ).order_by('-date_received', '-id').values('supplier_id')[:1]
+    products = Product.objects.filter(is_active=True).annotate(supplier_id=Subquery(latest_supplier)).values_list(
+        'pk', 'name', 'current_stock', 'minimum_stock_level', 'cost_price', 'supplier_id'
+    )
+
+    def write():
+        old_drafts = list(PurchaseOrder.objects.filter(status='draft', created_by=REORDER_AUTHOR).values_list('pk', flat=True))
+        on_order = _on_order(old_drafts)
+        result = ReorderResult(replaced_drafts=len(old_drafts))
+        by_supplier = {}
+        for pk, name, stock, minimum, cost, supplier_id in products.iterator(chunk_size=5000):
+            forecast, std = demand.get(pk, (0.0, 0.0))
+            quantity = reorder_quantity(stock, on_order.get(pk, 0), minimum, forecast, std)
+            if not quantity:
+                continue
+            if supplier_id is None:
+                result.without_supplier += 1
+                continue
+            by_supplier.setdefault(supplier_id, []).append((pk, quantity, cost))
+            if len(result.suggestions) < limit:
+                result.suggestions.append({
+                    'product_id': pk, 'product_name': name, 'current_stock': stock,
+                    'on_order': on_order.get(pk, 0), 'forecast': round(forecast, 2), 'quantity': quantity,
+                    'supplier_id': supplier_id,
+                })
+
+        orders = [
+            PurchaseOrder(
+                supplier_id=supplier_id,
+                expected_delivery=day + timedelta(days=REORDER_LEAD_TIME_DAYS),
+                total_amount=sum(quantity * cost for _, quantity, cost in by_supplier[supplier_id]),
+                notes=f"Suggestion de réapprovisionnement du {day:%d/%m/%Y}",
+                created_by=REORDER_AUTHOR,
+            )
+            for supplier_id in sorted(by_supplier)
+        ]
+        result.orders = len(orders)
+        result.lines = sum(len(lines) for lines in by_supplier.values())
+        result.total_amount = sum((order.total_amount for order in orders), Decimal(0))
+        if dry_run:
+            return result
+
+        for order, number in zip(orders, PurchaseOrderSequence.next_numbers(len(orders))):
+            order.order_number = number
+        PurchaseOrder.objects.filter(pk__in=old_drafts).delete()
+        PurchaseOrder.objects.bulk_create(orders, batch_size=WRITE_BATCH_SIZE)
+        PurchaseOrderItem.objects.bulk_create(
+            [
+                PurchaseOrderItem(purchase_order=order, product_id=pk, quantity=quantity, unit_price=cost)
+                for order in orders
+                for pk, quantity, cost in by_supplier[order.supplier_id]
+            ],
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        return result
+
+    return run_with_retry(write)
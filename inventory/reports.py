@@ -0,0 +1,304 @@
+"""PDF reports.
+
+The inventory report lists the whole catalogue, the stock alerts and the
+batches close to expiry. Rows are read with ``values_list(...).iterator()``
+and turned into page-sized platypus tables as the document is laid out, so
+the story never holds more than a few pages of rows.
+
+Rendered reports are kept in ``REPORTS_ROOT``, named after the global
+``InventorySummary`` version and the day: any product or batch change bumps
+the version, so a report is only rendered again once the stock has changed.
+Reports are only rendered by the jobs worker; downloads serve the last one
+rendered while a newer one is on its way.
+"""
+import os
+import tempfile
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .models import Product, ProductBatch
+from .summary import CRITICAL_EXPIRY_DAYS, current_summaries, current_summary, today
+
+ROWS_PER_TABLE = 32  # fits a landscape A4 page under the section title
+PAGE_SIZE = landscape(A4)
+
+STYLES = getSampleStyleSheet()
+TABLE_STYLE = TableStyle([
+    ('FONT', (0, 0), (-1, -1), 'Helvetica', 8),
+    ('FONT', (0, 0), (-1, 0), 'Helvetica-Bold', 8),
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1f3b57')),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f2f5f8')]),
+    ('GRID', (0, 0), (-1, -1), 0.25, colors.HexColor('#c8d0d8')),
+    ('ALIGN', (2, 1), (-1, -1), 'RIGHT'),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('TOPPADDING', (0, 0), (-1, -1), 2),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 2),
+])
+
+
+def _money(value):
+    return f"{value or 0:,.0f}".replace(',', ' ')
+
+
+def _clip(text, length):
+    text = text or ''
+    return text if len(text) <= length else text[:length - 1] + '…'
+
+
+def stock_status(is_active, current_stock, minimum_stock_level):
+    if not is_active:
+        return 'Inactif'
+    if current_stock == 0:
+        return 'Rupture'
+    if current_stock <= minimum_stock_level:
+        return 'Stock faible'
+    return 'Normal'
+
+
+def _tables(header, rows, col_widths):
+    """Split ``rows`` into tables of ``ROWS_PER_TABLE`` rows, each with the header."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == ROWS_PER_TABLE:
+            yield _table(header, chunk, col_widths)
+            chunk = []
+    if chunk:
+        yield _table(header, chunk, col_widths)
+
+
+def _table(header, rows, col_widths):
+    # Fixed column widths spare reportlab measuring every cell
+    table = Table([header] + rows, colWidths=col_widths, repeatRows=1)
+    table.setStyle(TABLE_STYLE)
+    return table
+
+
+def _section(title, header, rows, col_widths, empty):
+    yield Paragraph(title, STYLES['Heading2'])
+    found = False
+    for table in _tables(header, rows, col_widths):
+        found = True
+        yield table
+    if not found:
+        yield Paragraph(empty, STYLES['Normal'])
+    yield Spacer(1, 6 * mm)
+
+
+def _summary_flowables(day):
+    summaries = current_summaries()
+    labels = dict(Product.THERAPEUTIC_CLASSES)
+    header = ['Classe', 'Produits', 'Unités', 'Valeur du stock', 'CA potentiel', 'Stock faible', 'Ruptures',
+              f'Expire < {CRITICAL_EXPIRY_DAYS} j', 'Expirés']
+    rows = []
+    for therapeutic_class in [''] + [code for code, _ in Product.THERAPEUTIC_CLASSES]:
+        s = summaries.get(therapeutic_class)
+        if s is None or (therapeutic_class and not s.product_count):
+            continue
+        rows.append([
+            labels.get(therapeutic_class, 'Total'), s.product_count, s.total_units, _money(s.stock_value),
+            _money(s.potential_revenue), s.low_stock_count, s.out_of_stock_count, s.critical_expiry_count,
+            s.expired_count,
+        ])
+    yield Paragraph("Rapport d'inventaire", STYLES['Title'])
+    yield Paragraph(f"Généré le {timezone.localtime():%d/%m/%Y à %H:%M}", STYLES['Normal'])
+    yield Spacer(1, 4 * mm)
+    yield from _section('Synthèse', header, rows, [55 * mm] + [26 * mm] * 8, 'Aucun produit.')
+
+
+def _catalogue_rows():
+    labels = dict(Product.THERAPEUTIC_CLASSES)
+    products = Product.objects.order_by('name', 'id').values_list(
+        'name', 'therapeutic_class', 'current_stock', 'minimum_stock_level', 'cost_price', 'selling_price',
+        'is_active', 'barcode',
+    )
+    for name, therapeutic_class, stock, minimum, cost, price, is_active, barcode in products.iterator(chunk_size=2000):
+        yield [
+            _clip(name, 48), _clip(labels.get(therapeutic_class, therapeutic_class), 24), stock, minimum,
+            _money(cost), _money(price), _money(stock * (cost or 0)), stock_status(is_active, stock, minimum),
+            barcode or '',
+        ]
+
+
+def _alert_rows():
+    labels = dict(Product.THERAPEUTIC_CLASSES)
+    products = Product.objects.filter(is_active=True, current_stock__lte=F('minimum_stock_level')).order_by(
+        'current_stock', 'name'
+    ).values_list('name', 'therapeutic_class', 'current_stock', 'minimum_stock_level')
+    for name, therapeutic_class, stock, minimum in products.iterator(chunk_size=2000):
+        yield [
+            _clip(name, 60), _clip(labels.get(therapeutic_class, therapeutic_class), 30), stock, minimum,
+            max(minimum - stock, 0), stock_status(True, stock, minimum),
+        ]
+
+
+def _expiry_rows(day):
+    batches = ProductBatch.objects.filter(
+        quantity__gt=0, product__is_active=True, expiry_date__lte=day + timedelta(days=CRITICAL_EXPIRY_DAYS)
+    ).order_by('expiry_date', 'product__name').values_list(
+        'product__name', 'batch_number', 'expiry_date', 'quantity', 'purchase_price'
+    )
+    for name, batch_number, expiry_date, quantity, purchase_price in batches.iterator(chunk_size=2000):
+        days = (expiry_date - day).days
+        yield [
+            _clip(name, 60), _clip(batch_number, 24), f"{expiry_date:%d/%m/%Y}", days, quantity,
+            _money(quantity * (purchase_price or 0)), 'Expiré' if days < 0 else 'Expire bientôt',
+        ]
+
+
+def inventory_story(day):
+    """The flowables of the inventory report, generated lazily."""
+    yield from _summary_flowables(day)
+    yield from _section(
+        'Catalogue',
+        ['Produit', 'Classe', 'Stock', 'Minimum', "Prix d'achat", 'Prix de vente', 'Valeur', 'Statut', 'Code-barres'],
+        _catalogue_rows(),
+        [70 * mm, 40 * mm, 16 * mm, 16 * mm, 22 * mm, 22 * mm, 26 * mm, 22 * mm, 34 * mm],
+        'Aucun produit.',
+    )
+    yield from _section(
+        'Alertes de stock',
+        ['Produit', 'Classe', 'Stock', 'Minimum', 'À commander', 'Statut'],
+        _alert_rows(),
+        [90 * mm, 50 * mm, 22 * mm, 22 * mm, 26 * mm, 30 * mm],
+        'Aucune alerte de stock.',
+    )
+    yield from _section(
+        f'Lots expirés ou expirant sous {CRITICAL_EXPIRY_DAYS} jours',
+        ['Produit', 'Lot', 'Expiration', 'Jours', 'Quantité', "Valeur d'achat", 'Statut'],
+        _expiry_rows(day),
+        [90 * mm, 40 * mm, 26 * mm, 18 * mm, 22 * mm, 28 * mm, 30 * mm],
+        'Aucun lot concerné.',
+    )
+
+
+class _LazyStory(list):
+    """A story list that pulls flowables from a generator as the layout consumes them.
+
+    ``SimpleDocTemplate.build`` loops on ``len(flowables)`` and works on the
+    front of the list; keeping a few flowables ahead is enough for it.
+    """
+
+    AHEAD = 4
+
+    def __init__(self, flowables):
+        super().__init__()
+        self._source = iter(flowables)
+        self._fill()
+
+    def _fill(self):
+        while self._source is not None and super().__len__() < self.AHEAD:
+            try:
+                self.append(next(self._source))
+            except StopIteration:
+                self._source = None
+
+    def __len__(self):
+        self._fill()
+        return super().__len__()
+
+
+def _footer(canvas, doc):
+    canvas.saveState()
+    canvas.setFont('Helvetica', 7)
+    canvas.drawString(doc.leftMargin, 8 * mm, "PharmaGestion - Rapport d'inventaire")
+    canvas.drawRightString(PAGE_SIZE[0] - doc.rightMargin, 8 * mm, f"Page {doc.page}")
+    canvas.restoreState()
+
+
+def write_inventory_pdf(file, day=None):
+    """Render the inventory report to ``file`` (a path or a writable file object)."""
+    day = day or today()
+    doc = SimpleDocTemplate(
+        file, pagesize=PAGE_SIZE, title="Rapport d'inventaire",
+        leftMargin=10 * mm, rightMargin=10 * mm, topMargin=10 * mm, bottomMargin=14 * mm,
+    )
+    doc.build(_LazyStory(inventory_story(day)), onFirstPage=_footer, onLaterPages=_footer)
+
+
+def reports_root():
+    return Path(getattr(settings, 'REPORTS_ROOT', settings.BASE_DIR / 'report_files'))
+
+
+def inventory_report_key():
+    """Identifies the inventory state a report shows: the day and the summary version."""
+    summary = current_summary()
+    return f"{summary.expiry_as_of:%Y%m%d}-{summary.version}"
+
+
+def inventory_pdf_path():
+    """Where the inventory report for the current stock is, or will be, rendered."""
+    return reports_root() / f"inventory_{inventory_report_key()}.pdf"
+
+
+def _inventory_pdfs(root):
+    """The inventory reports in ``root``, most recently rendered first."""
+    reports = []
+    for path in root.glob('inventory_*.pdf'):
+        try:
+            reports.append((path.stat().st_mtime, path))
+        except FileNotFoundError:
+            # Removed by a render in another process meanwhile
+            continue
+    return [path for _, path in sorted(reports, reverse=True)]
+
+
+def latest_inventory_pdf():
+    """Path to the last inventory report rendered, current or not, or ``None``."""
+    return next(iter(_inventory_pdfs(reports_root())), None)
+
+
+def open_latest_inventory_pdf():
+    """``(path, open file)`` of the last inventory report rendered, or ``(None, None)``.
+
+    A render may replace the reports in the meantime: a report removed
+    between the listing and the opening is looked for again.
+    """
+    for _ in range(3):
+        path = latest_inventory_pdf()
+        if path is None:
+            break
+        try:
+            return path, open(path, 'rb')
+        except FileNotFoundError:
+            continue
+    return None, None
+
+
+def cached_inventory_pdf():
+    """Path to the inventory report for the current stock, rendered if needed."""
+    root = reports_root()
+    root.mkdir(parents=True, exist_ok=True)
+    path = inventory_pdf_path()
+    if path.exists():
+        return path
+
+    # Render next to the final file and rename, so readers never see a partial report
+    fd, tmp = tempfile.mkstemp(dir=root, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_inventory_pdf(f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    # The previous report is kept until the next render, as it may be
+    # listed by a download that has not opened it yet
+    older = [old for old in _inventory_pdfs(root) if old != path]
+    for old in older[1:]:
+        try:
+            old.unlink(missing_ok=True)
+        except OSError:
+            # Still being downloaded (Windows); removed next time
+            pass
+    return path
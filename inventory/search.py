@@ -0,0 +1,426 @@
+"""In-memory product catalogue index used by the POS search box.
+
+Each process keeps a prefix trie over the words of ``name`` and ``dci``,
+sorted arrays for name and barcode prefixes, a trigram inverted index over
+all three fields and a trigram index over the word vocabulary for typo
+tolerance, so a keystroke never scans the ``Product`` table. Text is
+lower-cased and accent-folded ("Paracétamol" matches "paracetamol").
+
+The index is built lazily on the first search, patched by the receivers in
+``inventory.signals`` and, to pick up changes made by other worker processes,
+re-synced from ``Product.updated_at`` every ``CATALOGUE_INDEX_SYNC_INTERVAL``
+seconds.
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Sum
+from django.utils import timezone
+
+from sales.models import SaleItem
+from .models import Product
+
+NGRAM = 3
+SYNC_INTERVAL = getattr(settings, 'CATALOGUE_INDEX_SYNC_INTERVAL', 30)
+VELOCITY_DAYS = 30
+VELOCITY_REFRESH = 3600  # seconds between sales velocity recomputations
+
+# Tier weights: a better tier always outranks a worse one; the in-stock and
+# sales velocity boosts (< 4) and fuzzy similarity (< 5) only order results
+# within a tier.
+TIER_EXACT_BARCODE = 50
+TIER_BARCODE_PREFIX = 40
+TIER_NAME_PREFIX = 30
+TIER_WORD_PREFIX = 20
+TIER_SUBSTRING = 10
+TIER_FUZZY = 0
+IN_STOCK_BOOST = 2.0
+VELOCITY_BOOST = 2.0
+
+# Shortest query word that is matched with typos (numbers never are)
+FUZZY_MIN_LENGTH = 4
+
+_WORD_RE = re.compile(r'\w+')
+
+# Fields read from the database to (re)index a product
+INDEX_FIELDS = ('id', 'name', 'dci', 'barcode', 'is_active', 'current_stock')
+
+
+def fold(text):
+    """Lower-case ``text`` and strip accents."""
+    text = unicodedata.normalize('NFKD', (text or '').lower().strip())
+    return ''.join(char for char in text if not unicodedata.combining(char))
+
+
+def ngrams(text, n=NGRAM):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def word_grams(word):
+    """Trigrams of a word padded with spaces, so its first letters weigh more."""
+    return ngrams(f' {word} ')
+
+
+def max_edits(word):
+    return 1 if len(word) <= 6 else 2
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between ``a`` and ``b``, or ``limit + 1`` if larger."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class _TrieNode:
+    __slots__ = ('children', 'ids', 'subtree')
+
+    def __init__(self):
+        self.children = {}
+        self.ids = None  # products having a word that ends at this node
+        self.subtree = None  # cached ids of the whole subtree
+
+
+class CatalogueIndex:
+    """Ranked, typo-tolerant search over the active catalogue.
+
+    Matches are ranked by tier (exact barcode, barcode prefix, name prefix,
+    every query word prefixing a word, substring, fuzzy) and, within a tier,
+    by fuzzy similarity plus in-stock and sales velocity boosts, then name.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}  # product id -> folded (name, dci, barcode)
+            self._stock = {}
+            self._velocity = {}  # units sold over the last VELOCITY_DAYS
+            self._velocity_scale = 1.0
+            self._rank_keys = {}  # product id -> (-boost, name, id)
+            self._names = []  # sorted (name, id), for name-prefix lookups
+            self._barcodes = []  # sorted (barcode, id)
+            self._trie = _TrieNode()
+            self._ngrams = defaultdict(set)
+            self._vocabulary = defaultdict(set)  # word trigram -> words
+            self._built = False
+            self._synced_at = None
+            self._checked_at = 0.0
+            self._velocity_at = 0.0
+
+    # -- maintenance -------------------------------------------------------
+
+    def build(self):
+        """Index the whole active catalogue from one query."""
+        with self._lock:
+            self.clear()
+            synced_at = timezone.now()
+            self._load_velocity()
+            rows = Product.objects.filter(is_active=True).values_list(
+                'id', 'name', 'dci', 'barcode', 'current_stock'
+            )
+            for pid, name, dci, barcode, stock in rows.iterator(chunk_size=2000):
+                self._stock[pid] = stock
+                self._add(pid, (fold(name), fold(dci), fold(barcode)), sort=False)
+            self._names.sort()
+            self._barcodes.sort()
+            self._built = True
+            self._synced_at = synced_at
+            self._checked_at = time.monotonic()
+
+    def sync(self):
+        """Re-index products changed since the last sync (possibly by another process)."""
+        with self._lock:
+            # Small overlap so a save racing with the previous sync is not missed
+            since = self._synced_at - timedelta(seconds=1)
+            self._synced_at = timezone.now()
+            self._checked_at = time.monotonic()
+            if self._checked_at - self._velocity_at >= VELOCITY_REFRESH:
+                self._load_velocity()
+                for pid in self._entries:
+                    self._rerank(pid)
+            for row in Product.objects.filter(updated_at__gte=since).values(*INDEX_FIELDS):
+                self.update(row)
+
+    def _load_velocity(self):
+        since = timezone.now() - timedelta(days=VELOCITY_DAYS)
+        sold = SaleItem.objects.filter(sale__sale_date__gte=since).values('product_id').annotate(
+            units=Sum('quantity')
+        ).values_list('product_id', 'units')
+        self._velocity = dict(sold)
+        self._velocity_scale = math.log1p(max(self._velocity.values(), default=0)) or 1.0
+        self._velocity_at = time.monotonic()
+
+    def update(self, row):
+        """(Re)index a product from a dict holding ``INDEX_FIELDS``."""
+        fields = (fold(row['name']), fold(row['dci']), fold(row['barcode']))
+        with self._lock:
+            if not self._built:
+                return
+            pid = row['id']
+            current = self._entries.get(pid)
+            if row['is_active'] and current == fields:
+                # e.g. a stock-only change: no need to touch the indexes
+                self.update_stock({pid: row['current_stock']})
+                return
+            if current is not None:
+                self._remove(pid)
+            if row['is_active']:
+                self._stock[pid] = row['current_stock']
+                self._add(pid, fields)
+
+    def update_stock(self, changes):
+        """Apply ``{product_id: new_stock}``, as sent by ``stock_changed``."""
+        with self._lock:
+            for pid, stock in changes.items():
+                if pid in self._entries:
+                    self._stock[pid] = stock
+                    self._rerank(pid)
+
+    def remove(self, product_id):
+        with self._lock:
+            if self._built and product_id in self._entries:
+                self._remove(product_id)
+
+    def _boost(self, pid):
+        boost = IN_STOCK_BOOST if self._stock.get(pid, 0) > 0 else 0.0
+        velocity = self._velocity.get(pid)
+        if velocity:
+            boost += VELOCITY_BOOST * math.log1p(velocity) / self._velocity_scale
+        return boost
+
+    def _rerank(self, pid):
+        self._rank_keys[pid] = (-self._boost(pid), self._entries[pid][0], pid)
+
+    @staticmethod
+    def _words(fields):
+        name, dci, _ = fields
+        return set(_WORD_RE.findall(f'{name} {dci}'))
+
+    def _add(self, pid, fields, sort=True):
+        self._entries[pid] = fields
+        self._rerank(pid)
+        key = (fields[0], pid)
+        barcode_key = (fields[2], pid) if fields[2] else None
+        if sort:
+            bisect.insort(self._names, key)
+            if barcode_key:
+                bisect.insort(self._barcodes, barcode_key)
+        else:
+            self._names.append(key)
+            if barcode_key:
+                self._barcodes.append(barcode_key)
+
+        for word in self._words(fields):
+            node = self._trie
+            node.subtree = None
+            for char in word:
+                child = node.children.get(char)
+                if child is None:
+                    child = node.children[char] = _TrieNode()
+                node = child
+                node.subtree = None
+            if not node.ids:
+                node.ids = set()
+                for gram in word_grams(word):
+                    self._vocabulary[gram].add(word)
+            node.ids.add(pid)
+        for gram in ngrams('\x00'.join(fields)):
+            self._ngrams[gram].add(pid)
+
+    def _remove(self, pid):
+        fields = self._entries.pop(pid)
+        del self._rank_keys[pid]
+        self._stock.pop(pid, None)
+        del self._names[bisect.bisect_left(self._names, (fields[0], pid))]
+        if fields[2]:
+            del self._barcodes[bisect.bisect_left(self._barcodes, (fields[2], pid))]
+
+        for word in self._words(fields):
+            node = self._trie
+            node.subtree = None
+            for char in word:
+                node = node.children[char]
+                node.subtree = None
+            node.ids.discard(pid)
+            if not node.ids:
+                for gram in word_grams(word):
+                    self._vocabulary[gram].discard(word)
+        for gram in ngrams('\x00'.join(fields)):
+            postings = self._ngrams[gram]
+            postings.discard(pid)
+            if not postings:
+                del self._ngrams[gram]
+
+    def _ensure_fresh(self):
+        if not self._built:
+            self.build()
+        elif time.monotonic() - self._checked_at >= SYNC_INTERVAL:
+            self.sync()
+
+    # -- candidate lookups -------------------------------------------------
+
+    @staticmethod
+    def _sorted_prefix(keys, prefix):
+        start = bisect.bisect_left(keys, (prefix,))
+        end = bisect.bisect_left(keys, (prefix + '\uffff',), lo=start)
+        return [pid for _, pid in keys[start:end]]
+
+    def _node(self, word):
+        node = self._trie
+        for char in word:
+            node = node.children.get(char)
+            if node is None:
+                return None
+        return node
+
+    def _prefix_ids(self, word):
+        """Ids of products having a word that starts with ``word``."""
+        node = self._node(word)
+        if node is None:
+            return set()
+        if node.subtree is None:
+            ids = set()
+            stack = [node]
+            while stack:
+                current = stack.pop()
+                if current.ids:
+                    ids |= current.ids
+                stack.extend(current.children.values())
+            node.subtree = ids
+        return node.subtree
+
+    def _all_words_prefix(self, tokens):
+        sets = [self._prefix_ids(token) for token in tokens]
+        if not all(sets):
+            return set()
+        sets.sort(key=len)
+        return sets[0].intersection(*sets[1:])
+
+    def _substring(self, query):
+        postings = [self._ngrams.get(gram) for gram in ngrams(query)]
+        if not postings or not all(postings):
+            return set()
+        postings.sort(key=len)
+        entries = self._entries
+        candidates = postings[0].intersection(*postings[1:])
+        return {pid for pid in candidates if any(query in field for field in entries[pid])}
+
+    def _fuzzy_words(self, token):
+        """Vocabulary words within ``max_edits`` of ``token`` or of its prefix.
+
+        Returns ``{word: similarity}`` with a similarity in ]0, 1[.
+        """
+        limit = max_edits(token)
+        grams = word_grams(token)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._vocabulary.get(gram, ()))
+        # Each edit destroys at most three of the padded trigrams
+        needed = max(1, len(grams) - 3 * limit - 1)
+        matches = {}
+        for word, count in shared.items():
+            if count < needed:
+                continue
+            distance = min(
+                edit_distance(token, word, limit),
+                # the token may be the start of a longer word ("amoxicil")
+                edit_distance(token, word[:len(token)], limit),
+            )
+            if distance <= limit:
+                matches[word] = 1.0 - distance / (len(token) + 1)
+        return matches
+
+    def _fuzzy(self, tokens):
+        """``{product_id: similarity}`` for products matching every token, allowing typos."""
+        scores = None
+        for token in tokens:
+            token_scores = dict.fromkeys(self._prefix_ids(token), 1.0)
+            if len(token) >= FUZZY_MIN_LENGTH and not token.isdigit():
+                for word, similarity in self._fuzzy_words(token).items():
+                    for pid in self._node(word).ids:
+                        if token_scores.get(pid, 0) < similarity:
+                            token_scores[pid] = similarity
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {pid: score + token_scores[pid] for pid, score in scores.items() if pid in token_scores}
+            if not scores:
+                return {}
+        return {pid: score / len(tokens) for pid, score in scores.items()}
+
+    # -- queries -----------------------------------------------------------
+
+    def search(self, query, limit=10):
+        """Return up to ``limit`` product ids matching ``query``, best first."""
+        return [pid for pid, _ in self.ranked(query, limit)]
+
+    def ranked(self, query, limit=10):
+        """Return up to ``limit`` ``(product_id, score)`` pairs, best first.
+
+        Lower tiers are only evaluated while the better ones have not filled
+        ``limit`` results, so common queries never reach the fuzzy matcher.
+        """
+        query = fold(query)
+        if not query:
+            return []
+        tokens = _WORD_RE.findall(query)
+        with self._lock:
+            self._ensure_fresh()
+            results = []
+            seen = set()
+            rank_key = self._rank_keys.__getitem__
+
+            def take(tier, candidates):
+                candidates = [pid for pid in candidates if pid not in seen]
+                for pid in heapq.nsmallest(limit - len(results), candidates, key=rank_key):
+                    seen.add(pid)
+                    results.append((pid, tier + 5 - rank_key(pid)[0]))
+                return len(results) >= limit
+
+            if query[0].isdigit():
+                barcode_matches = self._sorted_prefix(self._barcodes, query)
+                exact = [pid for pid in barcode_matches if self._entries[pid][2] == query]
+                if take(TIER_EXACT_BARCODE, exact) or take(TIER_BARCODE_PREFIX, barcode_matches):
+                    return results
+            if take(TIER_NAME_PREFIX, self._sorted_prefix(self._names, query)):
+                return results
+            if tokens and take(TIER_WORD_PREFIX, self._all_words_prefix(tokens)):
+                return results
+            if len(query) >= NGRAM and take(TIER_SUBSTRING, self._substring(query)):
+                return results
+            if tokens:
+                similarities = {pid: s for pid, s in self._fuzzy(tokens).items() if pid not in seen}
+
+                def fuzzy_key(pid):
+                    boost, name, _ = rank_key(pid)
+                    return (boost - 5 * similarities[pid], name, pid)
+
+                for pid in heapq.nsmallest(limit - len(results), similarities, key=fuzzy_key):
+                    results.append((pid, TIER_FUZZY - fuzzy_key(pid)[0]))
+            return results
+
+
+catalogue_index = CatalogueIndex()
@@ -0,0 +1,138 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import summary
+from .barcode_cache import barcode_cache
+from .models import Product, ProductBatch, StockMovement
+from .search import INDEX_FIELDS, catalogue_index
+
+# Sent after a transaction that changed ``Product.current_stock`` commits.
+# ``changes`` maps each product id to its new stock level. Stock updates are
+# done with queryset ``update()`` calls, which do not fire ``post_save``.
+stock_changed = Signal()
+
+
+def refresh_products(products, old_barcodes=()):
+    """Refresh the index and the barcode cache for products written with ``bulk_create``/``bulk_update``."""
+    rows = [{field: getattr(product, field) for field in INDEX_FIELDS} for product in products]
+    old_barcodes = list(old_barcodes)
+
+    def refresh():
+        for row in rows:
+            catalogue_index.update(row)
+            barcode_cache.invalidate(row['id'], row['barcode'])
+        for barcode in old_barcodes:
+            barcode_cache.invalidate(None, barcode)
+
+    transaction.on_commit(refresh)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_state(sender, instance, **kwargs):
+    old = None
+    if instance.pk is not None:
+        old = Product.objects.filter(pk=instance.pk).values(*summary.PRODUCT_STATE_FIELDS).first()
+    instance._summary_state = old
+
+
+@receiver(post_save, sender=Product)
+def log_saved_product_stock(sender, instance, created, raw=False, **kwargs):
+    # Stock typed in the product form or the admin: logged like any other
+    # change, so the movements add up to the stock
+    if raw:
+        return
+    old = getattr(instance, '_summary_state', None)
+    previous = old['current_stock'] if old is not None else 0
+    if instance.current_stock != previous:
+        StockMovement.objects.create(
+            product=instance,
+            movement_type='adjustment',
+            quantity=instance.current_stock - previous,
+            previous_stock=previous,
+            new_stock=instance.current_stock,
+            reason="Stock initial" if created else "Modification de la fiche produit",
+        )
+
+
+@receiver(post_save, sender=Product)
+def summarize_saved_product(sender, instance, **kwargs):
+    old = getattr(instance, '_summary_state', None)
+    new = summary.product_state(instance)
+    delta = summary.SummaryDelta()
+    delta.product(old, new)
+    if old is not None and (old['is_active'], old['therapeutic_class']) != (new['is_active'], new['therapeutic_class']):
+        # The product's batches move with it
+        day = summary.today()
+        batches = summary.product_batch_counters(instance.pk, day)
+        if old['is_active']:
+            delta.add(old['therapeutic_class'], batches, -1)
+        if new['is_active']:
+            delta.add(new['therapeutic_class'], batches)
+    delta.apply()
+    instance._summary_state = new
+
+
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    row = {field: getattr(instance, field) for field in INDEX_FIELDS}
+    transaction.on_commit(lambda: catalogue_index.update(row))
+    transaction.on_commit(lambda: barcode_cache.invalidate(row['id'], row['barcode']))
+
+
+@receiver(post_delete, sender=Product)
+def summarize_deleted_product(sender, instance, **kwargs):
+    delta = summary.SummaryDelta()
+    delta.product(summary.product_state(instance), None)
+    delta.apply()
+
+
+def _batch_state(product_id, quantity, expiry_date):
+    product = Product.objects.filter(pk=product_id).values('therapeutic_class', 'is_active').first()
+    if product is None:
+        return None
+    return (product['therapeutic_class'], product['is_active'], quantity, expiry_date)
+
+
+@receiver(pre_save, sender=ProductBatch)
+def remember_batch_state(sender, instance, **kwargs):
+    old = None
+    if instance.pk is not None:
+        row = ProductBatch.objects.filter(pk=instance.pk).values_list(
+            'product__therapeutic_class', 'product__is_active', 'quantity', 'expiry_date'
+        ).first()
+        old = tuple(row) if row else None
+    instance._summary_state = old
+
+
+@receiver(post_save, sender=ProductBatch)
+def summarize_saved_batch(sender, instance, **kwargs):
+    delta = summary.SummaryDelta()
+    delta.batch(
+        getattr(instance, '_summary_state', None),
+        _batch_state(instance.product_id, instance.quantity, instance.expiry_date),
+        summary.today(),
+    )
+    delta.apply()
+
+
+@receiver(post_delete, sender=ProductBatch)
+def summarize_deleted_batch(sender, instance, **kwargs):
+    delta = summary.SummaryDelta()
+    delta.batch(_batch_state(instance.product_id, instance.quantity, instance.expiry_date), None, summary.today())
+    delta.apply()
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    product_id, barcode = instance.pk, instance.barcode
+    transaction.on_commit(lambda: catalogue_index.remove(product_id))
+    transaction.on_commit(lambda: barcode_cache.invalidate(product_id, barcode))
+
+
+@receiver(stock_changed)
+def refresh_stock_levels(sender, changes, **kwargs):
+    catalogue_index.update_stock(changes)
+    barcode_cache.update_stock(changes)
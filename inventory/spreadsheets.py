@@ -0,0 +1,351 @@
+"""Product spreadsheets: export, import and import template.
+
+Exports read the catalogue with ``values_list(...).iterator()`` and write rows
+as they come, so memory does not grow with the number of products. CSV is
+streamed to the client row by row; XLSX (a zip archive, only complete at the
+end) is written by openpyxl in write-only mode to a temporary file that is
+then streamed.
+
+Imports read the workbook in read-only mode and work in chunks of rows: each
+chunk is validated, matched against the catalogue with one query, and written
+with ``bulk_create``/``bulk_update``; the stock levels it sets are logged as
+``adjustment`` movements. The whole sheet is validated before the first
+write; the chunks are then committed one by one through ``run_with_retry``,
+so the import never holds the SQLite write lock for longer than a chunk and
+checkouts go on meanwhile.
+"""
+import csv
+import tempfile
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+import openpyxl
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Product, StockMovement
+from .signals import refresh_products
+from .stock import run_with_retry
+from .summary import SummaryDelta, product_batch_counters, product_state, today
+
+IMPORT_CHUNK_SIZE = 1000
+IMPORT_FIELDS = (
+    'name', 'dci', 'therapeutic_class', 'cost_price', 'selling_price',
+    'is_active', 'current_stock', 'minimum_stock_level',
+)
+FALSE_VALUES = {'false', 'faux', 'non', 'no', '0'}
+NAME_MAX_LENGTH = Product._meta.get_field('name').max_length
+BARCODE_MAX_LENGTH = Product._meta.get_field('barcode').max_length
+MAX_PRICE = Decimal(10) ** (Product._meta.get_field('selling_price').max_digits - 2)
+
+HEADERS = ["ID", "Name", "DCI", "Therapeutic Class", "Cost Price", "Selling Price", "Is Active", "Barcode", "Current Stock", "Minimum Stock Level"]
+EXPORT_FIELDS = (
+    'id', 'name', 'dci', 'therapeutic_class', 'cost_price', 'selling_price',
+    'is_active', 'barcode', 'current_stock', 'minimum_stock_level',
+)
+EXPORT_CHUNK_SIZE = 2000
+
+XLSX_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def export_rows(queryset=None):
+    """Yield one list per product, in ``HEADERS`` order."""
+    queryset = Product.objects.all() if queryset is None else queryset
+    therapeutic_classes = dict(Product.THERAPEUTIC_CLASSES)
+    for (pk, name, dci, therapeutic_class, cost_price, selling_price,
+         is_active, barcode, current_stock, minimum_stock_level) in queryset.order_by('id').values_list(
+            *EXPORT_FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        yield [
+            pk,
+            name,
+            dci or '',
+            therapeutic_classes.get(therapeutic_class, therapeutic_class),
+            float(cost_price or 0),
+            float(selling_price or 0),
+            bool(is_active),
+            barcode or '',
+            int(current_stock or 0),
+            int(minimum_stock_level or 0),
+        ]
+
+
+class _Echo:
+    """File-like object whose ``write`` returns the line instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    """Encode ``HEADERS`` and ``rows`` as CSV, one line at a time."""
+    writer = csv.writer(_Echo())
+    # Byte order mark so Excel opens the file as UTF-8
+    yield '\ufeff' + writer.writerow(HEADERS)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def write_xlsx(rows, file, title="Products"):
+    """Write ``HEADERS`` and ``rows`` to ``file`` with a write-only workbook."""
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(title)
+    ws.append(HEADERS)
+    for row in rows:
+        ws.append(row)
+    wb.save(file)
+
+
+def xlsx_tempfile(rows, title="Products"):
+    """Write the workbook to a temporary file, rewound and ready to be streamed."""
+    file = tempfile.TemporaryFile()
+    write_xlsx(rows, file, title)
+    file.seek(0)
+    return file
+
+
+def template_workbook(file):
+    """A small Excel template for product imports."""
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "Products Template"
+    ws.append(HEADERS)
+    # example row
+    ws.append(["", "Example Product", "DCI Example", "other", 100.0, 150.0, True, "", 10, 5])
+    wb.save(file)
+
+
+@dataclass
+class ImportResult:
+    created: int = 0
+    updated: int = 0
+    errors: list = field(default_factory=list)  # [{'row': n, 'errors': [...]}]
+
+    @property
+    def successful(self):
+        return self.created + self.updated
+
+
+def _parse_row(row):
+    """Validate one spreadsheet row; return ``(barcode, values, errors)``."""
+    # Ensure we have 10 columns, pad if necessary
+    fields = list(row)[:10] + [None] * (10 - len(row))
+    _id, name, dci, therapeutic_class, cost_price, selling_price, is_active, barcode, current_stock, minimum_stock = fields
+
+    errors = []
+    if not name or str(name).strip() == '':
+        errors.append('Name is required')
+    elif len(str(name).strip()) > NAME_MAX_LENGTH:
+        errors.append('Name is too long')
+    if barcode not in (None, '') and len(str(barcode).strip()) > BARCODE_MAX_LENGTH:
+        errors.append('Barcode is too long')
+
+    def number(value, parse, default, message):
+        if value in (None, ''):
+            return default
+        try:
+            return parse(value)
+        except (TypeError, ValueError, InvalidOperation):
+            errors.append(message)
+            return default
+
+    def decimal(value):
+        amount = Decimal(str(value))
+        if not amount.is_finite() or abs(amount) >= MAX_PRICE:
+            raise ValueError(value)
+        return amount.quantize(Decimal('0.01'))
+
+    cost_price = number(cost_price, decimal, Decimal(0), 'Invalid cost price')
+    selling_price = number(selling_price, decimal, Decimal(0), 'Invalid selling price')
+    current_stock = number(current_stock, int, 0, 'Invalid current stock')
+    minimum_stock = number(minimum_stock, int, 5, 'Invalid minimum stock level')
+
+    # Accept the class code or its label, as written by the export
+    therapeutic_class = str(therapeutic_class or 'other').strip()
+    codes = {code: code for code, _ in Product.THERAPEUTIC_CLASSES}
+    codes.update({label: code for code, label in Product.THERAPEUTIC_CLASSES})
+    if therapeutic_class not in codes:
+        errors.append(f'Invalid therapeutic class: {therapeutic_class}')
+
+    if isinstance(is_active, str):
+        is_active = is_active.strip().lower() not in FALSE_VALUES
+    values = {
+        'name': str(name).strip() if name else '',
+        'dci': str(dci).strip()[:NAME_MAX_LENGTH] if dci else '',
+        'therapeutic_class': codes.get(therapeutic_class),
+        'cost_price': cost_price,
+        'selling_price': selling_price,
+        'is_active': bool(is_active) if is_active not in (None, '') else True,
+        'current_stock': current_stock,
+        'minimum_stock_level': minimum_stock,
+    }
+    barcode = str(barcode).strip() if barcode not in (None, '') else ''
+    return barcode, values, errors
+
+
+def _import_chunk(rows, result):
+    """Validate, match and write one chunk of ``(row number, row)`` pairs."""
+    parsed = []
+    for number, row in rows:
+        barcode, values, errors = _parse_row(row)
+        if errors:
+            result.errors.append({'row': number, 'errors': errors})
+        else:
+            parsed.append((number, barcode, values))
+    if not parsed:
+        return
+
+    # Existing products: by barcode when the row has one, by name otherwise
+    barcodes = {barcode for _, barcode, _ in parsed if barcode}
+    names = {values['name'] for _, barcode, values in parsed if not barcode}
+    by_barcode, by_name, by_pk = {}, {}, {}
+    for product in Product.objects.filter(Q(barcode__in=barcodes) | Q(name__in=names)):
+        by_pk[product.pk] = product
+        if product.barcode in barcodes:
+            by_barcode[product.barcode] = product
+        if product.name in names:
+            by_name.setdefault(product.name, []).append(product)
+
+    now = timezone.now()
+    summary = SummaryDelta()
+    old_states = {}
+    created, changed = {}, {}
+    for number, barcode, values in parsed:
+        if barcode:
+            product = by_barcode.get(barcode)
+        else:
+            matches = by_name.get(values['name'], [])
+            if len(matches) > 1:
+                result.errors.append({'row': number, 'errors': [f"Several products are named {values['name']}"]})
+                continue
+            product = matches[0] if matches else None
+
+        if product is None:
+            # Later rows of the file with the same barcode or name update it
+            product = Product(barcode=barcode or None, created_at=now, updated_at=now, **values)
+            if barcode:
+                by_barcode[barcode] = product
+            else:
+                by_name[values['name']] = [product]
+            created[id(product)] = product
+            result.created += 1
+        else:
+            if product.pk is not None and product.pk not in old_states:
+                old_states[product.pk] = product_state(product)
+            for name, value in values.items():
+                if getattr(product, name) != value:
+                    setattr(product, name, value)
+                    if product.pk is not None:
+                        changed.setdefault(product.pk, set()).add(name)
+            result.updated += 1
+
+    Product.objects.bulk_create(created.values())
+    # Only the products and the columns the file actually changes are
+    # written: a price list usually touches one or two columns, and smaller
+    # CASE expressions make bulk_update much faster
+    updated = {pk: by_pk[pk] for pk in changed}
+    for product in updated.values():
+        product.updated_at = now
+    if updated:
+        fields = sorted(set().union(*changed.values()))
+        Product.objects.bulk_update(updated.values(), fields + ['updated_at'])
+
+    # bulk_create/bulk_update send no signals: keep the summary, the index
+    # and the barcode cache up to date explicitly
+    day = today()
+    for product in created.values():
+        summary.product(None, product_state(product))
+    for product in updated.values():
+        old, new = old_states[product.pk], product_state(product)
+        summary.product(old, new)
+        if (old['is_active'], old['therapeutic_class']) != (new['is_active'], new['therapeutic_class']):
+            batches = product_batch_counters(product.pk, day)
+            if old['is_active']:
+                summary.add(old['therapeutic_class'], batches, -1)
+            if new['is_active']:
+                summary.add(new['therapeutic_class'], batches)
+    summary.apply(day)
+    StockMovement.objects.bulk_create(_import_movements(created.values(), updated.values(), old_states))
+    refresh_products([*created.values(), *updated.values()])
+
+
+def _import_movements(created, updated, old_states):
+    """``adjustment`` movements for the stock levels an import sets."""
+    movements = []
+    for product in created:
+        if product.current_stock:
+            movements.append(StockMovement(
+                product=product, movement_type='adjustment', quantity=product.current_stock,
+                previous_stock=0, new_stock=product.current_stock, reference="Import Excel", reason="Stock initial",
+            ))
+    for product in updated:
+        previous = old_states[product.pk]['current_stock']
+        if product.current_stock != previous:
+            movements.append(StockMovement(
+                product=product, movement_type='adjustment', quantity=product.current_stock - previous,
+                previous_stock=previous, new_stock=product.current_stock, reference="Import Excel",
+                reason="Stock importé",
+            ))
+    return movements
+
+
+def _import_chunk_result(rows):
+    result = ImportResult()
+    _import_chunk(rows, result)
+    return result
+
+
+def _filled(row):
+    return any(cell not in (None, '') for cell in row)
+
+
+def import_products(file, chunk_size=IMPORT_CHUNK_SIZE, progress=None):
+    """Create or update products from an ``.xlsx`` file laid out like ``HEADERS``.
+
+    Rows with a barcode update the product with that barcode, other rows the
+    product with the same name; unmatched rows create products. Invalid rows
+    are skipped and reported in the returned ``ImportResult``. ``progress``,
+    if given, is called after each chunk with the number of rows read and
+    the number of rows in the sheet.
+
+    Every row is validated in a first pass, before anything is written, so
+    a bad cell never leaves a file half imported. Should the database fail
+    while the chunks are written, the chunks before stay imported; importing
+    the same file again completes it, as the rows already imported match the
+    products they wrote.
+    """
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        result = ImportResult()
+        invalid = set()
+        total = 0
+        for number, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2):
+            total += 1
+            if _filled(row):
+                errors = _parse_row(row)[2]
+                if errors:
+                    invalid.add(number)
+                    result.errors.append({'row': number, 'errors': errors})
+
+        rows = enumerate(ws.iter_rows(min_row=2, values_only=True), start=2)
+        done = 0
+        while True:
+            read = list(islice(rows, chunk_size))
+            if not read:
+                break
+            # Blank lines are skipped, not taken for the end of the sheet
+            chunk = [(number, row) for number, row in read if number not in invalid and _filled(row)]
+            if chunk:
+                # Counted apart, as a chunk replayed after a lock must not count twice
+                chunk_result = run_with_retry(_import_chunk_result, chunk)
+                result.created += chunk_result.created
+                result.updated += chunk_result.updated
+                result.errors.extend(chunk_result.errors)
+            done += len(read)
+            if progress is not None:
+                progress(done, total)
+        result.errors.sort(key=lambda error: error['row'])
+        return result
+    finally:
+        wb.close()
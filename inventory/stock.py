@@ -0,0 +1,193 @@
+"""Stock mutations shared by the POS and the inventory screens.
+
+Stock changes go through :func:`apply_stock_changes`: decrements are
+conditional ``F()`` updates, so two tills selling the same product can never
+overwrite each other, and each change is logged as a ``StockMovement`` and
+reflected in the ``InventorySummary`` rows. (Stock typed in the product form
+is logged by a signal, see ``ledger`` for how the movements are used.)
+
+Sales also draw on the product's batches with :func:`consume_batches`,
+earliest expiry first (FEFO), so batch quantities follow what is sold.
+"""
+import logging
+import random
+import time
+
+from django.db import OperationalError, transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When, Window
+from django.utils import timezone
+
+from .models import Product, ProductBatch, StockMovement
+from .signals import stock_changed
+from .summary import SummaryDelta, product_state, today
+
+logger = logging.getLogger(__name__)
+
+LOCK_RETRIES = 20
+LOCK_RETRY_DELAY = 0.02  # seconds, grows with each attempt and is jittered
+INCREMENT_CHUNK_SIZE = 1000
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, available):
+        super().__init__(f'Stock insuffisant pour {product.name}. Stock disponible: {available}')
+        self.product = product
+        self.available = available
+
+
+def is_lock_error(exc):
+    message = str(exc).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def run_with_retry(func, *args, **kwargs):
+    """Run ``func`` in its own transaction, retrying when SQLite reports a lock.
+
+    SQLite only allows one writer at a time; a competing writer gets
+    "database is locked" instead of waiting. The whole transaction is replayed,
+    so ``func`` must not have side effects outside the database.
+    """
+    for attempt in range(1, LOCK_RETRIES + 1):
+        try:
+            with transaction.atomic():
+                return func(*args, **kwargs)
+        except OperationalError as exc:
+            if (attempt == LOCK_RETRIES or not is_lock_error(exc)
+                    or transaction.get_connection().in_atomic_block):
+                raise
+            logger.info('Database locked, retrying (%s/%s)', attempt, LOCK_RETRIES)
+            time.sleep(LOCK_RETRY_DELAY * attempt * random.uniform(0.5, 1.5))
+
+
+def apply_stock_changes(changes, movement_type, reference='', reason='',
+                        created_by='Système', clamp=False):
+    """Apply signed stock deltas ``{product_id: delta}`` and log the movements.
+
+    Must run inside a transaction (see :func:`run_with_retry`). Raises
+    ``InsufficientStock`` when a decrement would take a product below zero,
+    unless ``clamp`` is set, in which case the decrement stops at zero.
+    Returns the created ``StockMovement`` rows.
+    """
+    changes = {product_id: delta for product_id, delta in changes.items() if delta}
+    if not changes:
+        return []
+
+    # Lock rows in primary key order so concurrent transactions cannot deadlock
+    products = {
+        product.pk: product
+        for product in Product.objects.select_for_update().filter(pk__in=changes).order_by('pk')
+    }
+    if len(products) != len(changes):
+        raise Product.DoesNotExist
+
+    now = timezone.now()
+    movements = []
+    increments = {}
+    for product_id in sorted(changes):
+        product = products[product_id]
+        delta = changes[product_id]
+        if clamp:
+            delta = max(delta, -product.current_stock)
+            if not delta:
+                continue
+        if product.current_stock + delta < 0:
+            raise InsufficientStock(product, product.current_stock)
+
+        if delta > 0:
+            increments[product_id] = delta
+        elif not Product.objects.filter(pk=product_id, current_stock__gte=-delta).update(
+                current_stock=F('current_stock') + delta, updated_at=now):
+            product.refresh_from_db(fields=['current_stock'])
+            raise InsufficientStock(product, product.current_stock)
+
+        movements.append(StockMovement(
+            product=product,
+            movement_type=movement_type,
+            quantity=delta,
+            previous_stock=product.current_stock,
+            new_stock=product.current_stock + delta,
+            reference=reference,
+            reason=reason,
+            created_by=created_by,
+        ))
+
+    # Increments cannot fail: large receipts raise all their products with a few updates
+    pks = list(increments)
+    for start in range(0, len(pks), INCREMENT_CHUNK_SIZE):
+        chunk = pks[start:start + INCREMENT_CHUNK_SIZE]
+        Product.objects.filter(pk__in=chunk).update(current_stock=F('current_stock') + Case(
+            *[When(pk=pk, then=Value(increments[pk])) for pk in chunk],
+            output_field=IntegerField(),
+        ), updated_at=now)
+
+    StockMovement.objects.bulk_create(movements)
+
+    summary = SummaryDelta()
+    for movement in movements:
+        summary.product(
+            product_state(movement.product, current_stock=movement.previous_stock),
+            product_state(movement.product, current_stock=movement.new_stock),
+        )
+    summary.apply()
+
+    new_levels = {movement.product_id: movement.new_stock for movement in movements}
+    transaction.on_commit(lambda: stock_changed.send(sender=Product, changes=new_levels))
+    return movements
+
+
+def consume_batches(quantities, products):
+    """Take ``{product_id: units}`` out of open batches, earliest expiry first.
+
+    ``products`` maps the same ids to their ``Product``. Must run in the
+    transaction that decremented the products' stock, which holds their row
+    locks. Only the batches needed are read: a running total over the
+    product's open batches (``batch_open_fefo_idx``) stops at the quantity
+    sold, however many batches are open. Expired batches are never sold from,
+    they are left to the nightly write-off. Units not covered by batches
+    (stock entered without a batch, or only expired batches) are left
+    unallocated.
+
+    Returns ``{product_id: [(batch, units), ...]}`` in allocation order.
+    """
+    quantities = {product_id: units for product_id, units in quantities.items() if units > 0}
+    if not quantities:
+        return {}
+
+    running_total = Window(
+        Sum('quantity'), partition_by=[F('product_id')], order_by=[F('expiry_date').asc(), F('id').asc()]
+    )
+    needed = Case(
+        *[When(product_id=product_id, then=Value(units)) for product_id, units in quantities.items()],
+        output_field=IntegerField(),
+    )
+    day = today()
+    # A batch is needed while the batches before it hold less than the quantity sold
+    batches = ProductBatch.objects.filter(product_id__in=quantities, quantity__gt=0, expiry_date__gte=day).annotate(
+        running_total=running_total, needed=needed,
+    ).filter(running_total__lt=F('quantity') + F('needed')).order_by('product_id', 'expiry_date', 'id')
+
+    allocations = {}
+    left = dict(quantities)
+    for batch in batches:
+        units = min(batch.quantity, left[batch.product_id])
+        left[batch.product_id] -= units
+        allocations.setdefault(batch.product_id, []).append((batch, units))
+    if not allocations:
+        return {}
+
+    taken = {batch.pk: units for lines in allocations.values() for batch, units in lines}
+    ProductBatch.objects.filter(pk__in=taken).update(quantity=F('quantity') - Case(
+        *[When(pk=pk, then=Value(units)) for pk, units in taken.items()],
+        output_field=IntegerField(),
+    ))
+
+    # Queryset updates send no signals: emptied batches leave the expiry counters
+    summary = SummaryDelta()
+    for product_id, lines in allocations.items():
+        product = products[product_id]
+        for batch, units in lines:
+            state = (product.therapeutic_class, product.is_active)
+            summary.batch(state + (batch.quantity, batch.expiry_date), state + (batch.quantity - units, batch.expiry_date), day)
+            batch.quantity -= units
+    summary.apply(day)
+    return allocations
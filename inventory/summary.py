@@ -0,0 +1,272 @@
+"""Incrementally maintained ``InventorySummary`` rows.
+
+Each product and each batch contributes a fixed set of counters to the row of
+its therapeutic class and to the global row. When a product or a batch
+changes, the difference between its old and new contribution is applied with
+``F()`` updates, so the dashboards read a single row instead of aggregating
+the catalogue on every request.
+
+Expiry counters depend on the date as well as on the batches: rows remember
+the day they were computed for (``expiry_as_of``), batch deltas are only
+applied to rows that are current, and :func:`current_summary` recomputes the
+expiry counters the first time it is read on a new day.
+
+``manage.py inventory_summary`` rebuilds the rows from scratch or checks them
+against the catalogue.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Q, Sum, When
+from django.utils import timezone
+
+from .models import InventorySummary, Product, ProductBatch
+
+GLOBAL = ''
+CRITICAL_EXPIRY_DAYS = 30
+
+PRODUCT_COUNTERS = (
+    'product_count', 'total_units', 'stock_value', 'potential_revenue', 'low_stock_count', 'out_of_stock_count',
+)
+EXPIRY_COUNTERS = ('critical_expiry_count', 'expired_count')
+COUNTERS = PRODUCT_COUNTERS + EXPIRY_COUNTERS
+
+PRODUCT_STATE_FIELDS = (
+    'is_active', 'therapeutic_class', 'current_stock', 'minimum_stock_level', 'cost_price', 'selling_price',
+)
+
+CENT = Decimal('0.01')
+MONEY = DecimalField(max_digits=16, decimal_places=2)
+
+
+def today():
+    return timezone.localdate()
+
+
+def _money(value):
+    # Matches the rounding applied when the DecimalField is saved
+    return Decimal(str(value or 0)).quantize(CENT)
+
+
+def product_state(product, **overrides):
+    """The fields of ``product`` that feed the summary, as a dict."""
+    state = {field: getattr(product, field) for field in PRODUCT_STATE_FIELDS}
+    state.update(overrides)
+    return state
+
+
+def product_counters(state):
+    """Counters contributed by a product, or ``None`` when it does not count."""
+    if state is None or not state['is_active']:
+        return None
+    stock = int(state['current_stock'])
+    return {
+        'product_count': 1,
+        'total_units': stock,
+        'stock_value': stock * _money(state['cost_price']),
+        'potential_revenue': stock * _money(state['selling_price']),
+        'low_stock_count': int(0 < stock <= int(state['minimum_stock_level'])),
+        'out_of_stock_count': int(stock == 0),
+    }
+
+
+def expiry_counters(quantity, expiry_date, day):
+    """Counters contributed by one batch of an active product."""
+    if quantity <= 0:
+        return {}
+    if expiry_date < day:
+        return {'expired_count': 1}
+    if expiry_date <= day + timedelta(days=CRITICAL_EXPIRY_DAYS):
+        return {'critical_expiry_count': 1}
+    return {}
+
+
+def _expiry_aggregates(day):
+    return {
+        'critical_expiry_count': Count('id', filter=Q(
+            expiry_date__gte=day, expiry_date__lte=day + timedelta(days=CRITICAL_EXPIRY_DAYS)
+        )),
+        'expired_count': Count('id', filter=Q(expiry_date__lt=day)),
+    }
+
+
+def product_batch_counters(product_id, day):
+    """Expiry counters of all the batches of a product, regardless of its state."""
+    return ProductBatch.objects.filter(product_id=product_id, quantity__gt=0).aggregate(**_expiry_aggregates(day))
+
+
+class SummaryDelta:
+    """Counter differences, per therapeutic class, waiting to be applied."""
+
+    def __init__(self):
+        self.scopes = defaultdict(lambda: defaultdict(int))
+        # Set by any product or batch change, even one that leaves the
+        # counters as they are (a new name, a batch moved to a later date):
+        # the global row's ``version`` then still changes, so caches of
+        # inventory reports can be keyed on it
+        self.touched = False
+
+    def add(self, therapeutic_class, counters, sign=1):
+        if not counters:
+            return
+        for scope in (GLOBAL, therapeutic_class):
+            for field, value in counters.items():
+                self.scopes[scope][field] += sign * value
+
+    def product(self, old, new):
+        """Record a product going from state ``old`` to ``new`` (either may be ``None``)."""
+        self.touched = True
+        if old is not None:
+            self.add(old['therapeutic_class'], product_counters(old), -1)
+        if new is not None:
+            self.add(new['therapeutic_class'], product_counters(new))
+
+    def batch(self, old, new, day):
+        """Record a batch change; states are ``(therapeutic_class, is_active, quantity, expiry_date)``."""
+        self.touched = True
+        for state, sign in ((old, -1), (new, 1)):
+            if state is not None and state[1]:
+                self.add(state[0], expiry_counters(state[2], state[3], day), sign)
+
+    def apply(self, day=None):
+        """Write the recorded differences to the summary rows.
+
+        Rows that have not been built yet are left alone: they will be computed
+        from scratch on first read. Expiry counters are only touched on rows
+        computed for ``day``.
+        """
+        day = day or today()
+        bumped = False
+        for scope, counters in self.scopes.items():
+            changes = {}
+            for field, value in counters.items():
+                if not value:
+                    continue
+                if field in EXPIRY_COUNTERS:
+                    changes[field] = Case(When(expiry_as_of=day, then=F(field) + value), default=F(field))
+                else:
+                    changes[field] = F(field) + value
+            if changes:
+                InventorySummary.objects.filter(therapeutic_class=scope).update(
+                    version=F('version') + 1, updated_at=timezone.now(), **changes
+                )
+                bumped = bumped or scope == GLOBAL
+        if self.touched and not bumped:
+            InventorySummary.objects.filter(therapeutic_class=GLOBAL).update(
+                version=F('version') + 1, updated_at=timezone.now()
+            )
+        self.scopes.clear()
+        self.touched = False
+
+
+def add_products(products):
+    """Count products inserted with ``bulk_create``, which sends no signals."""
+    delta = SummaryDelta()
+    for product in products:
+        delta.product(None, product_state(product))
+    delta.apply()
+
+
+def compute(day=None):
+    """Counters for every summary row, computed from the catalogue."""
+    day = day or today()
+    scopes = [GLOBAL] + [value for value, _ in Product.THERAPEUTIC_CLASSES]
+    result = {scope: dict.fromkeys(COUNTERS, 0) for scope in scopes}
+
+    stock_value = ExpressionWrapper(F('current_stock') * F('cost_price'), output_field=MONEY)
+    potential_revenue = ExpressionWrapper(F('current_stock') * F('selling_price'), output_field=MONEY)
+    products = Product.objects.filter(is_active=True).values('therapeutic_class').annotate(
+        product_count=Count('id'),
+        total_units=Sum('current_stock'),
+        stock_value=Sum(stock_value),
+        potential_revenue=Sum(potential_revenue),
+        low_stock_count=Count('id', filter=Q(current_stock__gt=0, current_stock__lte=F('minimum_stock_level'))),
+        out_of_stock_count=Count('id', filter=Q(current_stock=0)),
+    ).order_by()
+    batches = ProductBatch.objects.filter(quantity__gt=0, product__is_active=True).values(
+        therapeutic_class=F('product__therapeutic_class')
+    ).annotate(**_expiry_aggregates(day)).order_by()
+
+    for row in list(products) + list(batches):
+        therapeutic_class = row.pop('therapeutic_class')
+        for scope in (GLOBAL, therapeutic_class):
+            if scope not in result:
+                continue
+            for field, value in row.items():
+                result[scope][field] += value or 0
+    for counters in result.values():
+        for field in ('stock_value', 'potential_revenue'):
+            counters[field] = _money(counters[field])
+    return result
+
+
+def rebuild(day=None):
+    """Recompute every summary row from scratch."""
+    day = day or today()
+    with transaction.atomic():
+        existing = set(InventorySummary.objects.select_for_update().values_list('therapeutic_class', flat=True))
+        for scope, counters in compute(day).items():
+            if scope in existing:
+                InventorySummary.objects.filter(therapeutic_class=scope).update(
+                    expiry_as_of=day, version=F('version') + 1, updated_at=timezone.now(), **counters
+                )
+            else:
+                InventorySummary.objects.create(therapeutic_class=scope, expiry_as_of=day, **counters)
+
+
+def refresh_expiry(day=None):
+    """Recompute the expiry counters only, e.g. when the date has changed."""
+    day = day or today()
+    with transaction.atomic():
+        list(InventorySummary.objects.select_for_update().values_list('pk'))
+        for scope, counters in compute(day).items():
+            InventorySummary.objects.filter(therapeutic_class=scope).update(
+                expiry_as_of=day, version=F('version') + 1, updated_at=timezone.now(),
+                **{field: counters[field] for field in EXPIRY_COUNTERS}
+            )
+
+
+def verify(day=None):
+    """Return ``(therapeutic_class, field, stored, expected)`` for every counter that has drifted."""
+    day = day or today()
+    stored = {row.therapeutic_class: row for row in InventorySummary.objects.all()}
+    drift = []
+    for scope, counters in compute(day).items():
+        row = stored.get(scope)
+        if row is None:
+            drift.append((scope, 'row', None, 'missing'))
+            continue
+        for field, expected in counters.items():
+            if field in EXPIRY_COUNTERS and row.expiry_as_of != day:
+                continue
+            if getattr(row, field) != expected:
+                drift.append((scope, field, getattr(row, field), expected))
+    return drift
+
+
+def current_summaries():
+    """All summary rows by therapeutic class (global row under ``''``), current for today."""
+    day = today()
+    rows = {row.therapeutic_class: row for row in InventorySummary.objects.all()}
+    if GLOBAL not in rows:
+        rebuild(day)
+    elif rows[GLOBAL].expiry_as_of != day:
+        refresh_expiry(day)
+    else:
+        return rows
+    return {row.therapeutic_class: row for row in InventorySummary.objects.all()}
+
+
+def current_summary():
+    """The global summary row, current for today."""
+    day = today()
+    summary = InventorySummary.objects.filter(therapeutic_class=GLOBAL).first()
+    if summary is None:
+        rebuild(day)
+    elif summary.expiry_as_of != day:
+        refresh_expiry(day)
+    else:
+        return summary
+    return InventorySummary.objects.get(therapeutic_class=GLOBAL)
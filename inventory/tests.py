@@ -1,7 +1,12 @@
-from django.test import TestCase, Client
+import threading
+
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, Client
 from django.utils import timezone
-from datetime import timedelta
-from .models import Product, ProductBatch
+from datetime import datetime, timedelta
+from decimal import Decimal
+from .models import Job, Product, ProductBatch, ProductClassification, StockMovement, StockMovementArchive, StockSnapshot
 
 
 class ExpiryLogicTests(TestCase):
@@ -16,7 +21,7 @@ class ExpiryLogicTests(TestCase):
 		)
 
 	def test_days_until_expiry_and_status(self):
-		today = timezone.now().date()
+		today = timezone.localdate()
 		# batch expires in 10 days -> critical
 		batch = ProductBatch.objects.create(
 			product=self.product,
@@ -58,7 +63,7 @@ class AnalyticsExpiryFilteringTests(TestCase):
 		self.product_inactive = Product.objects.create(
 			name='InactiveMed', selling_price=5, cost_price=2, current_stock=0, minimum_stock_level=5, is_active=False
 		)
-		today = timezone.now().date()
+		today = timezone.localdate()
 		# Active batch with quantity -> should appear
 		ProductBatch.objects.create(
 			product=self.product_active,
@@ -141,7 +146,7 @@ class ProductViewFormTests(TestCase):
 			name='StockMed', selling_price=3.0, cost_price=1.0,
 			current_stock=0, minimum_stock_level=2, is_active=True
 		)
-		today = timezone.now().date()
+		today = timezone.localdate()
 		data = {
 			'product': str(product.id),
 			'batch_number': 'RX123',
@@ -160,3 +165,1216 @@ class ProductViewFormTests(TestCase):
 		batch = ProductBatch.objects.filter(product=product, batch_number='RX123').first()
 		self.assertIsNotNone(batch)
 		self.assertEqual(batch.quantity, 15)
+
+
+class StockServiceTests(TestCase):
+	def setUp(self):
+		self.client = Client()
+		self.product = Product.objects.create(
+			name='ServiceMed', selling_price=5, cost_price=2, current_stock=10, minimum_stock_level=2
+		)
+
+	def test_decrement_below_zero_is_refused(self):
+		from .stock import InsufficientStock, apply_stock_changes, run_with_retry
+		with self.assertRaises(InsufficientStock):
+			run_with_retry(apply_stock_changes, {self.product.id: -11}, movement_type='sale')
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.current_stock, 10)
+		self.assertFalse(StockMovement.objects.filter(movement_type='sale').exists())
+
+	def test_adjust_stock_clamps_at_zero_and_logs_movement(self):
+		resp = self.client.post(f'/inventory/products/{self.product.id}/adjust-stock/', {
+			'adjustment': '-15', 'reason': 'Inventaire'
+		})
+		self.assertIn(resp.status_code, (302, 301))
+		self.product.refresh_from_db()
+		self.assertEqual(self.product.current_stock, 0)
+		movement = StockMovement.objects.filter(product=self.product).exclude(reason='Stock initial').get()
+		self.assertEqual((movement.movement_type, movement.quantity, movement.new_stock), ('adjustment', -10, 0))
+		self.assertEqual(movement.reason, 'Inventaire')
+
+
+class ConcurrentStockTests(TransactionTestCase):
+	THREADS = 8
+	SALES_PER_THREAD = 25
+
+	def _run_tills(self, product, quantity):
+		from .stock import InsufficientStock, apply_stock_changes, run_with_retry
+		sold = []
+		errors = []
+
+		def till():
+			try:
+				for _ in range(self.SALES_PER_THREAD):
+					try:
+						run_with_retry(apply_stock_changes, {product.id: -quantity}, movement_type='sale')
+						sold.append(quantity)
+					except InsufficientStock:
+						pass
+			except Exception as exc:
+				errors.append(exc)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=till) for _ in range(self.THREADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors, [])
+		return sum(sold)
+
+	def test_parallel_sales_lose_no_updates(self):
+		product = Product.objects.create(
+			name='BusyMed', selling_price=5, cost_price=2, current_stock=1000, minimum_stock_level=2
+		)
+		units_sold = self._run_tills(product, 2)
+		product.refresh_from_db()
+		self.assertEqual(units_sold, self.THREADS * self.SALES_PER_THREAD * 2)
+		self.assertEqual(product.current_stock, 1000 - units_sold)
+		movements = StockMovement.objects.filter(product=product, movement_type='sale')
+		self.assertEqual(movements.count(), self.THREADS * self.SALES_PER_THREAD)
+		self.assertEqual(movements.aggregate(total=Sum('quantity'))['total'], -units_sold)
+
+	def test_parallel_sales_never_oversell(self):
+		product = Product.objects.create(
+			name='ScarceMed', selling_price=5, cost_price=2, current_stock=51, minimum_stock_level=2
+		)
+		units_sold = self._run_tills(product, 3)
+		product.refresh_from_db()
+		self.assertEqual(units_sold, 51)
+		self.assertEqual(product.current_stock, 0)
+
+
+class PurchaseOrderTests(TestCase):
+	def setUp(self):
+		from .models import PurchaseOrder, Supplier
+		self.product = Product.objects.create(name='OrderMed', selling_price=5, cost_price=2)
+		self.supplier = Supplier.objects.create(name='Nord Pharma')
+		self.order = PurchaseOrder.objects.create(supplier=self.supplier)
+
+	def test_numbers_follow_the_daily_counter(self):
+		from .models import PurchaseOrder, PurchaseOrderSequence
+		day = timezone.localdate().strftime('%Y%m%d')
+		self.assertEqual(self.order.order_number, f'BC-{day}-0001')
+		self.assertEqual(PurchaseOrderSequence.next_numbers(2), [f'BC-{day}-0002', f'BC-{day}-0003'])
+		self.assertEqual(PurchaseOrder.objects.create(supplier=self.supplier).order_number, f'BC-{day}-0004')
+		other_day = PurchaseOrderSequence.next_numbers(day=datetime(2024, 1, 2).date())
+		self.assertEqual(other_day, ['BC-20240102-0001'])
+
+	def test_items_keep_the_total_up_to_date(self):
+		from .models import PurchaseOrder, PurchaseOrderItem
+		first = PurchaseOrderItem.objects.create(purchase_order=self.order, product=self.product, quantity=3, unit_price=Decimal('2.50'))
+		second = PurchaseOrderItem.objects.create(purchase_order=self.order, product=self.product, quantity=1, unit_price=4)
+		self.assertEqual(PurchaseOrder.objects.get().total_amount, Decimal('11.50'))
+		first.quantity = 5
+		first.save()
+		second.delete()
+		self.assertEqual(PurchaseOrder.objects.get().total_amount, Decimal('12.50'))
+		# The loaded order follows, so saving it keeps the total
+		self.assertEqual(self.order.total_amount, Decimal('12.50'))
+		self.order.notes = 'Urgent'
+		with self.assertNumQueries(1):
+			self.order.save()
+		self.assertEqual(PurchaseOrder.objects.get().total_amount, Decimal('12.50'))
+
+		PurchaseOrderItem.objects.filter(pk=first.pk).update(quantity=2)
+		self.order.recalculate_total()
+		self.assertEqual(PurchaseOrder.objects.get().total_amount, 5)
+
+
+class PurchaseOrderReceivingTests(TestCase):
+	def setUp(self):
+		from .models import PurchaseOrder, PurchaseOrderItem, Supplier
+		self.supplier = Supplier.objects.create(name='Nord Pharma')
+		self.first = Product.objects.create(name='FirstMed', selling_price=5, cost_price=2, current_stock=3)
+		self.second = Product.objects.create(name='SecondMed', selling_price=5, cost_price=2)
+		self.order = PurchaseOrder.objects.create(supplier=self.supplier, status='ordered')
+		PurchaseOrderItem.objects.create(purchase_order=self.order, product=self.first, quantity=10, unit_price=2)
+		PurchaseOrderItem.objects.create(purchase_order=self.order, product=self.second, quantity=5, unit_price=3)
+		self.url = f'/inventory/api/purchase-orders/{self.order.pk}/receive/'
+		self.expiry = (timezone.localdate() + timedelta(days=400)).isoformat()
+
+	def test_partial_delivery_from_the_form(self):
+		# Posted by scanners and scripts, which hold no CSRF token
+		self.client = Client(enforce_csrf_checks=True)
+		resp = self.client.post(self.url, {
+			'product_id': [self.first.pk, self.first.pk, self.second.pk],
+			'batch_number': ['L1', 'L2', 'L3'],
+			'expiry_date': [self.expiry, self.expiry, self.expiry],
+			'quantity': [4, 6, 2],
+			'purchase_price': ['', '1,90', ''],
+		})
+		self.assertEqual(resp.status_code, 200)
+		data = resp.json()
+		self.assertEqual((data['status'], data['batches'], data['units']), ('ordered', 3, 12))
+		self.assertEqual(data['pending'], {str(self.second.pk): 3})
+
+		self.first.refresh_from_db()
+		self.assertEqual(self.first.current_stock, 13)
+		prices = dict(ProductBatch.objects.values_list('batch_number', 'purchase_price'))
+		self.assertEqual(prices, {'L1': 2, 'L2': Decimal('1.90'), 'L3': 3})
+		self.assertEqual(set(ProductBatch.objects.values_list('supplier', flat=True)), {self.supplier.pk})
+		movement = StockMovement.objects.get(product=self.first, movement_type='receipt')
+		self.assertEqual((movement.quantity, movement.previous_stock, movement.new_stock), (10, 3, 13))
+		self.assertEqual(movement.reference, self.order.order_number)
+		received = dict(self.order.items.values_list('product_id', 'received_quantity'))
+		self.assertEqual(received, {self.first.pk: 10, self.second.pk: 2})
+
+	def test_product_on_several_order_lines(self):
+		from .models import PurchaseOrderItem
+		extra = PurchaseOrderItem.objects.create(purchase_order=self.order, product=self.second, quantity=4, unit_price=3)
+		resp = self.client.post(self.url, {
+			'product_id': [self.second.pk], 'batch_number': ['L1'], 'expiry_date': [self.expiry], 'quantity': [7],
+		})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(resp.json()['pending'], {str(self.first.pk): 10, str(self.second.pk): 2})
+		received = list(self.order.items.filter(product=self.second).order_by('pk').values_list('received_quantity', flat=True))
+		self.assertEqual(received, [5, 2])
+
+		resp = self.client.post(self.url, {
+			'product_id': [self.second.pk], 'batch_number': ['L2'], 'expiry_date': [self.expiry], 'quantity': [3],
+		})
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('(2)', resp.json()['errors'][0]['errors'][0])
+		extra.refresh_from_db()
+		self.assertEqual(extra.received_quantity, 2)
+
+	def test_file_upload_completes_the_order(self):
+		from django.core.files.uploadedfile import SimpleUploadedFile
+		from .models import PurchaseOrder
+		content = f"Product ID;Batch Number;Expiry Date;Quantity;Purchase Price\n{self.first.pk};L1;{self.expiry};10;\n\n" \
+			f"{self.second.pk};L2;01/02/2030;5;3.10\n"
+		upload = SimpleUploadedFile('livraison.csv', content.encode('utf-8'), content_type='text/csv')
+		data = self.client.post(self.url, {'file': upload}).json()
+		self.assertEqual((data['status'], data['units'], data['pending']), ('received', 15, {}))
+		self.assertEqual(PurchaseOrder.objects.get().status, 'received')
+		self.assertEqual(ProductBatch.objects.get(batch_number='L2').expiry_date, datetime(2030, 2, 1).date())
+
+		resp = self.client.post(self.url, {'product_id': self.first.pk, 'batch_number': 'L9', 'expiry_date': self.expiry, 'quantity': 1})
+		self.assertEqual(resp.status_code, 400)
+
+	def test_csv_saved_by_excel_in_windows_1252_is_read(self):
+		from django.core.files.uploadedfile import SimpleUploadedFile
+		content = f"Produit;Lot;Expiration;Quantité;Prix\r\n{self.first.pk};Lé-1;{self.expiry};4;\r\n"
+		upload = SimpleUploadedFile('livraison.csv', content.encode('cp1252'), content_type='text/csv')
+		resp = self.client.post(self.url, {'file': upload})
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(ProductBatch.objects.get().batch_number, 'Lé-1')
+
+		upload = SimpleUploadedFile('livraison.csv', b'\x81\x8d\x8f', content_type='text/csv')
+		resp = self.client.post(self.url, {'file': upload})
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn('encodage', resp.json()['error'])
+
+	def test_fractional_xlsx_cells_are_rejected(self):
+		import io
+		import openpyxl
+		from django.core.files.uploadedfile import SimpleUploadedFile
+		wb = openpyxl.Workbook()
+		wb.active.append(["Product ID", "Batch Number", "Expiry Date", "Quantity", "Purchase Price"])
+		wb.active.append([float(self.first.pk), 'L1', self.expiry, 4.0, None])
+		wb.active.append([self.second.pk + 0.7, 'L2', self.expiry, 1, None])
+		wb.active.append([self.second.pk, 'L3', self.expiry, 4.5, None])
+		content = io.BytesIO()
+		wb.save(content)
+		upload = SimpleUploadedFile('livraison.xlsx', content.getvalue())
+		resp = self.client.post(self.url, {'file': upload})
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual(resp.json()['errors'], [
+			{'line': 3, 'errors': ['Produit invalide']},
+			{'line': 4, 'errors': ['Quantité invalide']},
+		])
+		self.assertFalse(ProductBatch.objects.exists())
+
+	def test_invalid_delivery_writes_nothing(self):
+		other = Product.objects.create(name='OtherMed', selling_price=5, cost_price=2)
+		resp = self.client.post(self.url, {
+			'product_id': [self.first.pk, other.pk, self.second.pk],
+			'batch_number': ['L1', 'L2', 'L3'],
+			'expiry_date': [self.expiry, self.expiry, self.expiry],
+			'quantity': [4, 1, 6],
+		})
+		self.assertEqual(resp.status_code, 400)
+		self.assertEqual([error['line'] for error in resp.json()['errors']], [2, 3])
+		resp = self.client.post(self.url, {'product_id': self.first.pk, 'batch_number': '', 'expiry_date': 'demain', 'quantity': 0})
+		self.assertEqual(resp.json()['errors'][0]['errors'], [
+			'Numéro de lot obligatoire', "Date d'expiration invalide, format attendu: AAAA-MM-JJ", 'Quantité invalide',
+		])
+		self.assertFalse(ProductBatch.objects.exists())
+		self.assertFalse(StockMovement.objects.filter(movement_type='receipt').exists())
+		self.assertEqual(self.client.post('/inventory/api/purchase-orders/999/receive/', {}).status_code, 404)
+
+
+class ConcurrentPurchaseOrderTests(TransactionTestCase):
+	THREADS = 8
+	ORDERS_PER_THREAD = 40
+
+	def test_parallel_orders_get_distinct_numbers(self):
+		from .models import PurchaseOrder, Supplier
+		from .stock import run_with_retry
+		supplier = Supplier.objects.create(name='Nord Pharma')
+		errors = []
+
+		def clerk():
+			try:
+				for _ in range(self.ORDERS_PER_THREAD):
+					run_with_retry(PurchaseOrder.objects.create, supplier=supplier)
+			except Exception as exc:
+				errors.append(exc)
+			finally:
+				connection.close()
+
+		threads = [threading.Thread(target=clerk) for _ in range(self.THREADS)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(errors, [])
+		numbers = sorted(PurchaseOrder.objects.values_list('order_number', flat=True))
+		total = self.THREADS * self.ORDERS_PER_THREAD
+		day = timezone.localdate().strftime('%Y%m%d')
+		self.assertEqual(numbers, [f'BC-{day}-{n:04d}' for n in range(1, total + 1)])
+
+
+class CatalogueIndexTests(TestCase):
+	def setUp(self):
+		from .search import catalogue_index
+		self.index = catalogue_index
+		self.index.clear()
+		self.client = Client()
+		self.amox = Product.objects.create(
+			name='Amoxicilline 500mg', dci='amoxicilline', selling_price=5, cost_price=2,
+			current_stock=10, barcode='6111234567890'
+		)
+		self.para = Product.objects.create(
+			name='Doliprane 1g', dci='paracétamol', selling_price=3, cost_price=1, current_stock=4
+		)
+		Product.objects.create(name='Amoxicilline retirée', selling_price=5, cost_price=2, is_active=False)
+
+	def search(self, query):
+		resp = self.client.get('/api/products/search/', {'q': query})
+		self.assertEqual(resp.status_code, 200)
+		return [row['name'] for row in resp.json()]
+
+	def test_matches_name_dci_and_barcode(self):
+		self.assertEqual(self.search('amox'), ['Amoxicilline 500mg'])
+		self.assertEqual(self.search('500'), ['Amoxicilline 500mg'])
+		self.assertEqual(self.search('paracé'), ['Doliprane 1g'])
+		self.assertEqual(self.search('611123'), ['Amoxicilline 500mg'])
+		self.assertEqual(self.search('4567'), ['Amoxicilline 500mg'])
+		self.assertEqual(self.search('zzz'), [])
+
+	def test_name_prefix_ranks_first(self):
+		for name in ['Desirox', 'Amoxicilline sirop', 'Sirop Doliprane']:
+			Product.objects.create(name=name, selling_price=2, cost_price=1)
+		self.assertEqual(self.search('sir'), ['Sirop Doliprane', 'Amoxicilline sirop', 'Desirox'])
+
+	def test_index_follows_saves_and_deletes(self):
+		self.search('amox')  # build the index
+		with self.captureOnCommitCallbacks(execute=True):
+			self.amox.name = 'Clamoxyl 500mg'
+			self.amox.save()
+			Product.objects.create(name='Amoxicilline 1g', selling_price=5, cost_price=2)
+		self.assertEqual(self.search('amoxicilline'), ['Amoxicilline 1g', 'Clamoxyl 500mg'])
+		self.assertEqual(self.search('clamo'), ['Clamoxyl 500mg'])
+		with self.captureOnCommitCallbacks(execute=True):
+			self.para.delete()
+		self.assertEqual(self.search('doli'), [])
+
+	def test_accent_and_typo_tolerant(self):
+		self.assertEqual(self.search('paracetamol'), ['Doliprane 1g'])
+		self.assertEqual(self.search('PARACÉTAMOL'), ['Doliprane 1g'])
+		self.assertEqual(self.search('amoxiciline'), ['Amoxicilline 500mg'])
+		self.assertEqual(self.search('amoxycilline 500'), ['Amoxicilline 500mg'])
+		self.assertEqual(self.search('paracetamlo'), ['Doliprane 1g'])
+
+	def test_exact_barcode_beats_prefix_and_in_stock_ranks_first(self):
+		Product.objects.create(name='Amoxicilline 1g', selling_price=5, cost_price=2, current_stock=0)
+		Product.objects.create(name='Amoxicilline 250mg', selling_price=5, cost_price=2, current_stock=3)
+		self.assertEqual(self.search('amox'), ['Amoxicilline 250mg', 'Amoxicilline 500mg', 'Amoxicilline 1g'])
+		with self.captureOnCommitCallbacks(execute=True):
+			Product.objects.create(name='Zinc', selling_price=1, cost_price=1, barcode='61112345678')
+		self.assertEqual(self.search('61112345678'), ['Zinc', 'Amoxicilline 500mg'])
+
+	def test_sales_velocity_boosts_ranking(self):
+		from sales.models import Sale, SaleItem
+		fast = Product.objects.create(name='Amoxicilline 1g', selling_price=5, cost_price=2, current_stock=10)
+		sale = Sale.objects.create(sale_type='paid', total_amount=50)
+		SaleItem.objects.create(sale=sale, product=fast, quantity=10, unit_price=5)
+		self.assertEqual(self.search('amox'), ['Amoxicilline 1g', 'Amoxicilline 500mg'])
+
+
+class BarcodeCacheTests(TestCase):
+	def setUp(self):
+		from .barcode_cache import barcode_cache
+		self.cache = barcode_cache
+		self.cache.clear()
+		self.cache.reset_stats()
+		self.client = Client()
+		self.product = Product.objects.create(
+			name='ScanMed', selling_price=5, cost_price=2, current_stock=10, barcode='3400930000001'
+		)
+
+	def scan(self, barcode='3400930000001'):
+		resp = self.client.get('/api/products/barcode-search/', {'barcode': barcode})
+		self.assertEqual(resp.status_code, 200)
+		return resp.json()
+
+	def test_repeated_scans_are_served_from_cache(self):
+		self.assertEqual(self.scan()['product']['name'], 'ScanMed')
+		with self.assertNumQueries(0):
+			self.assertEqual(self.scan()['product']['current_stock'], 10)
+		self.assertFalse(self.scan('0000')['success'])
+		stats = self.client.get('/api/products/barcode-cache/stats/').json()
+		self.assertEqual((stats['local_hits'], stats['misses']), (1, 2))
+
+	def test_cache_follows_saves_and_stock_changes(self):
+		from .stock import apply_stock_changes, run_with_retry
+		self.scan()
+		with self.captureOnCommitCallbacks(execute=True):
+			run_with_retry(apply_stock_changes, {self.product.id: -3}, movement_type='sale')
+		with self.assertNumQueries(0):
+			self.assertEqual(self.scan()['product']['current_stock'], 7)
+		with self.captureOnCommitCallbacks(execute=True):
+			self.product.refresh_from_db()
+			self.product.is_active = False
+			self.product.save()
+		self.assertFalse(self.scan()['success'])
+
+
+class DashboardApiTests(TestCase):
+	def setUp(self):
+		self.client = Client()
+		for i, stock in enumerate([0, 3, 10, 50, 0]):
+			Product.objects.create(
+				name=f'Dash{i}', selling_price=5, cost_price=2, current_stock=stock, minimum_stock_level=5
+			)
+		Product.objects.create(name='Hidden', selling_price=5, cost_price=2, current_stock=9, is_active=False)
+
+	def test_metrics_and_alerts(self):
+		data = self.client.get('/inventory/api/dashboard/').json()
+		self.assertEqual(data['metrics']['total_products'], 5)
+		self.assertEqual(data['metrics']['total_stock_value'], 126.0)
+		self.assertEqual(data['metrics']['low_stock_count'], 1)
+		self.assertEqual(data['metrics']['out_of_stock_count'], 2)
+		self.assertEqual([p['name'] for p in data['alerts']['out_of_stock']], ['Dash0', 'Dash4'])
+		self.assertEqual(data['alerts']['low_stock'], [{'name': 'Dash1', 'current_stock': 3, 'minimum_stock': 5}])
+
+	def test_products_are_paginated_by_stock_status(self):
+		first = self.client.get('/inventory/api/dashboard/', {'page_size': 2}).json()
+		self.assertEqual([p['name'] for p in first['products']], ['Dash0', 'Dash4'])
+		self.assertEqual(first['pagination']['total_pages'], 3)
+		second = self.client.get('/inventory/api/dashboard/', {'page_size': 2, 'page': 2}).json()
+		self.assertEqual([p['stock_status'] for p in second['products']], ['low_stock', 'in_stock'])
+		self.assertEqual(second['products'][0]['total_value'], 6.0)
+		self.assertEqual(second['products'][0]['stock_status_display'], 'Stock faible')
+
+
+class InventorySummaryTests(TestCase):
+	def setUp(self):
+		from . import summary
+		self.summary = summary
+		self.product = Product.objects.create(
+			name='SumMed', therapeutic_class='analgesic', selling_price=15, cost_price=10,
+			current_stock=20, minimum_stock_level=5
+		)
+		self.other = Product.objects.create(
+			name='OtherMed', therapeutic_class='antibiotic', selling_price=8, cost_price=4.5,
+			current_stock=0, minimum_stock_level=5
+		)
+		self.today = timezone.localdate()
+		self.batch = ProductBatch.objects.create(
+			product=self.product, batch_number='S1', expiry_date=self.today + timedelta(days=10),
+			quantity=20, purchase_price=10
+		)
+		self.summary.current_summary()
+
+	def assertUpToDate(self):
+		self.assertEqual(self.summary.verify(), [])
+
+	def test_built_on_first_read(self):
+		rows = self.summary.current_summaries()
+		self.assertEqual(rows[''].product_count, 2)
+		self.assertEqual(rows[''].stock_value, 200)
+		self.assertEqual(rows[''].potential_revenue, 300)
+		self.assertEqual(rows[''].out_of_stock_count, 1)
+		self.assertEqual(rows['analgesic'].critical_expiry_count, 1)
+		self.assertEqual(rows['antibiotic'].product_count, 1)
+
+	def test_stock_service_and_edits_are_applied_incrementally(self):
+		from .stock import apply_stock_changes
+		apply_stock_changes({self.product.id: -17, self.other.id: 3}, movement_type='adjustment')
+		self.assertUpToDate()
+		self.assertEqual(self.summary.current_summary().low_stock_count, 2)
+
+		product = Product.objects.get(pk=self.product.pk)
+		product.cost_price = 12.5
+		product.therapeutic_class = 'antibiotic'
+		product.save()
+		self.assertUpToDate()
+		self.assertEqual(self.summary.current_summaries()['antibiotic'].critical_expiry_count, 1)
+
+		product.is_active = False
+		product.save()
+		self.assertUpToDate()
+		self.assertEqual(self.summary.current_summary().critical_expiry_count, 0)
+
+	def test_batch_changes_and_deletes_are_applied_incrementally(self):
+		self.batch.expiry_date = self.today - timedelta(days=1)
+		self.batch.save()
+		self.assertUpToDate()
+		self.assertEqual(self.summary.current_summary().expired_count, 1)
+		ProductBatch.objects.create(
+			product=self.other, batch_number='S2', expiry_date=self.today + timedelta(days=5),
+			quantity=0, purchase_price=4
+		)
+		self.batch.delete()
+		self.assertUpToDate()
+		Product.objects.filter(pk=self.product.pk).delete()
+		self.assertUpToDate()
+		self.assertEqual(self.summary.current_summary().product_count, 1)
+
+	def test_expiry_counters_roll_over_with_the_date(self):
+		from .models import InventorySummary
+		InventorySummary.objects.update(expiry_as_of=self.today - timedelta(days=40), critical_expiry_count=0)
+		self.assertEqual(self.summary.current_summary().critical_expiry_count, 1)
+		with self.assertNumQueries(1):
+			self.summary.current_summary()
+
+	def test_command_verifies_and_rebuilds(self):
+		from django.core.management import call_command
+		from django.core.management.base import CommandError
+		from io import StringIO
+		from .models import InventorySummary
+		InventorySummary.objects.filter(therapeutic_class='').update(stock_value=1)
+		with self.assertRaises(CommandError):
+			call_command('inventory_summary', '--verify', stdout=StringIO())
+		call_command('inventory_summary', stdout=StringIO())
+		self.assertUpToDate()
+
+
+class ProductExportTests(TestCase):
+	def setUp(self):
+		self.client = Client()
+		Product.objects.create(
+			name='Paracétamol 500mg', dci='paracetamol', therapeutic_class='analgesic',
+			selling_price=150, cost_price=100, current_stock=12, minimum_stock_level=5, barcode='6111'
+		)
+		Product.objects.create(name='Sans code', selling_price=10, cost_price=5, current_stock=0)
+
+	def test_csv_export_is_streamed(self):
+		import csv
+		resp = self.client.get('/inventory/products/export_excel/', {'format': 'csv'})
+		self.assertTrue(resp.streaming)
+		rows = list(csv.reader(b''.join(resp.streaming_content).decode('utf-8-sig').splitlines()))
+		self.assertEqual(rows[0][:2], ['ID', 'Name'])
+		self.assertEqual(rows[1][1:5], ['Paracétamol 500mg', 'paracetamol', 'Analgésique', '100.0'])
+		self.assertEqual(rows[2][7], '')
+		self.assertEqual(len(rows), 3)
+
+	def test_xlsx_export_is_a_readable_workbook(self):
+		import io
+		import openpyxl
+		resp = self.client.get('/inventory/products/export_excel/')
+		self.assertTrue(resp.streaming)
+		ws = openpyxl.load_workbook(io.BytesIO(b''.join(resp.streaming_content)), read_only=True).active
+		rows = list(ws.iter_rows(values_only=True))
+		self.assertEqual(len(rows), 3)
+		self.assertEqual(rows[1][1], 'Paracétamol 500mg')
+		self.assertEqual(rows[1][8], 12)
+
+
+class ProductImportTests(TestCase):
+	def setUp(self):
+		from . import summary
+		self.summary = summary
+		self.client = Client()
+		self.coded = Product.objects.create(
+			name='Paracétamol 500mg', therapeutic_class='analgesic', selling_price=150, cost_price=100,
+			current_stock=12, minimum_stock_level=5, barcode='6111'
+		)
+		self.named = Product.objects.create(name='Sans code', selling_price=10, cost_price=5, current_stock=0)
+		self.summary.current_summary()
+
+	def _workbook(self, rows):
+		import io
+		import openpyxl
+		wb = openpyxl.Workbook()
+		ws = wb.active
+		ws.append(["ID", "Name", "DCI", "Therapeutic Class", "Cost Price", "Selling Price", "Is Active", "Barcode", "Current Stock", "Minimum Stock Level"])
+		for row in rows:
+			ws.append(row)
+		file = io.BytesIO()
+		wb.save(file)
+		file.seek(0)
+		file.name = 'products.xlsx'
+		return file
+
+	def test_import_creates_and_updates_by_barcode_then_name(self):
+		from .spreadsheets import import_products
+		file = self._workbook([
+			['', 'Paracétamol 1g', '', 'Analgésique', 110, 160, 'FALSE', '6111', 30, 5],
+			['', 'Sans code', 'dci', 'vitamin', 6, 12, True, '', 4, 2],
+			['', 'Nouveau', '', 'other', 1, 2, True, '7222', 3, 1],
+			['', '', '', 'other', 'abc', 2, True, '', 3, 1],
+		])
+		result = import_products(file)
+		self.assertEqual((result.created, result.updated), (1, 2))
+		self.assertEqual(result.errors, [{'row': 5, 'errors': ['Name is required', 'Invalid cost price']}])
+
+		self.coded.refresh_from_db()
+		self.assertEqual((self.coded.name, self.coded.is_active, self.coded.current_stock), ('Paracétamol 1g', False, 30))
+		self.named.refresh_from_db()
+		self.assertEqual((self.named.therapeutic_class, self.named.current_stock), ('vitamin', 4))
+		self.assertEqual(Product.objects.get(barcode='7222').name, 'Nouveau')
+		self.assertEqual(Product.objects.count(), 3)
+		self.assertEqual(self.summary.verify(), [])
+
+	def test_import_writes_each_chunk_in_constant_queries(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from .spreadsheets import import_products
+
+		def run(count, offset):
+			rows = [['', f'Produit {i}', '', 'other', 1, 2, True, f'B{i}', 1, 1] for i in range(offset, offset + count)]
+			with CaptureQueriesContext(connection) as ctx:
+				result = import_products(self._workbook(rows), chunk_size=100)
+			self.assertEqual(result.created, count)
+			return len(ctx.captured_queries)
+
+		self.assertEqual(run(10, 0), run(90, 100))
+		self.assertEqual(Product.objects.count(), 102)
+		self.assertEqual(self.summary.verify(), [])
+
+	def test_import_reads_past_blank_lines(self):
+		from .spreadsheets import import_products
+		blank = [None] * 10
+		file = self._workbook([
+			['', 'Avant', '', 'other', 1, 2, True, '7001', 1, 1],
+			*[blank] * 4,
+			['', 'Après', '', 'other', 1, 2, True, '7002', 1, 1],
+		])
+		progress = []
+		result = import_products(file, chunk_size=2, progress=lambda done, total: progress.append((done, total)))
+		self.assertEqual((result.created, result.errors), (2, []))
+		self.assertTrue(Product.objects.filter(barcode='7002').exists())
+		self.assertEqual(progress[-1], (6, 6))
+
+	def test_rows_are_validated_before_anything_is_written(self):
+		from unittest import mock
+		from . import spreadsheets
+		file = self._workbook([
+			['', 'Premier', '', 'other', 1, 2, True, 'V1', 1, 1],
+			['', 'Deuxième', '', 'other', 1, 2, True, 'V2', 1, 1],
+			['', 'Dernier', '', 'other', 'abc', 2, True, 'V3', 1, 1],
+		])
+		written = []
+		real = spreadsheets._import_chunk
+
+		def record(rows, result):
+			written.append([number for number, _ in rows])
+			real(rows, result)
+
+		with mock.patch.object(spreadsheets, '_import_chunk', record):
+			result = spreadsheets.import_products(file, chunk_size=2)
+		self.assertEqual(written, [[2, 3]])
+		self.assertEqual(result.created, 2)
+		self.assertEqual(result.errors, [{'row': 4, 'errors': ['Invalid cost price']}])
+
+	def test_failed_import_keeps_committed_chunks_and_can_be_run_again(self):
+		from unittest import mock
+		from . import spreadsheets
+		rows = [['', f'Produit {i}', '', 'other', 1, 2, True, f'B{i}', 1, 1] for i in range(5)]
+		real = spreadsheets._import_chunk
+		calls = []
+
+		def fail_on_second_chunk(rows, result):
+			calls.append(rows)
+			if len(calls) == 2:
+				raise RuntimeError('database unavailable')
+			real(rows, result)
+
+		with mock.patch.object(spreadsheets, '_import_chunk', fail_on_second_chunk):
+			with self.assertRaises(RuntimeError):
+				spreadsheets.import_products(self._workbook(rows), chunk_size=3)
+		# The first chunk is committed, the second left nothing behind
+		self.assertEqual(Product.objects.count(), 5)
+		self.assertEqual(self.summary.verify(), [])
+
+		result = spreadsheets.import_products(self._workbook(rows), chunk_size=3)
+		self.assertEqual((result.created, result.updated), (2, 3))
+		self.assertEqual(Product.objects.count(), 7)
+		self.assertEqual(StockMovement.objects.filter(product__barcode='B0').count(), 1)
+		self.assertEqual(self.summary.verify(), [])
+
+
+class JobTests(TestCase):
+	def setUp(self):
+		import shutil
+		import tempfile
+		from django.test import override_settings
+		from . import jobs
+		self.jobs = jobs
+		self.client = Client()
+		root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+		settings = override_settings(JOBS_ROOT=root)
+		settings.enable()
+		self.addCleanup(settings.disable)
+		Product.objects.create(name='JobMed', selling_price=15, cost_price=10, current_stock=3, barcode='J1')
+
+	def _status(self, job_id):
+		resp = self.client.get(f'/inventory/api/jobs/{job_id}/')
+		self.assertEqual(resp.status_code, 200)
+		return resp.json()
+
+	def test_import_returns_a_job_and_reports_its_result(self):
+		import io
+		import openpyxl
+		wb = openpyxl.Workbook()
+		wb.active.append(["ID", "Name"])
+		wb.active.append(['', 'Importé', '', 'other', 1, 2, True, 'J2', 4, 1])
+		wb.active.append(['', '', '', 'other', 1, 2, True, '', 4, 1])
+		file = io.BytesIO()
+		wb.save(file)
+		file.seek(0)
+		file.name = 'products.xlsx'
+
+		resp = self.client.post('/inventory/products/import_excel/', {'file': file}, HTTP_ACCEPT='application/json')
+		self.assertEqual(resp.status_code, 202)
+		job_id = resp.json()['id']
+		self.assertEqual(self._status(job_id)['status'], 'pending')
+		self.assertFalse(Product.objects.filter(barcode='J2').exists())
+
+		self.assertEqual(self.jobs.run_pending(), 1)
+		data = self._status(job_id)
+		self.assertEqual(data['status'], 'done')
+		self.assertEqual(data['result']['created'], 1)
+		self.assertEqual(data['result']['errors'], [{'row': 3, 'errors': ['Name is required']}])
+		self.assertIsNone(data['download_url'])
+		self.assertTrue(Product.objects.filter(barcode='J2', name='Importé').exists())
+
+	def test_export_job_result_is_downloadable(self):
+		resp = self.client.post('/inventory/products/export_excel/', {'format': 'csv'}, HTTP_ACCEPT='application/json')
+		self.assertEqual(resp.status_code, 202)
+		job_id = resp.json()['id']
+		self.assertEqual(self.client.get(f'/inventory/jobs/{job_id}/download/').status_code, 404)
+
+		self.jobs.run_pending()
+		data = self._status(job_id)
+		self.assertEqual((data['status'], data['progress'], data['total'], data['percent']), ('done', 1, 1, 100))
+		resp = self.client.get(data['download_url'])
+		content = b''.join(resp.streaming_content).decode('utf-8-sig')
+		self.assertIn('JobMed', content)
+		self.assertEqual(resp['Content-Type'], 'text/csv; charset=utf-8')
+
+	def test_invalid_file_fails_the_job_with_a_message(self):
+		from django.core.files.uploadedfile import SimpleUploadedFile
+		upload = SimpleUploadedFile('products.xlsx', b'not a workbook')
+		resp = self.client.post('/inventory/products/import_excel/', {'file': upload})
+		self.assertEqual(resp.status_code, 302)
+		job = Job.objects.get()
+		self.jobs.run_pending()
+		data = self._status(job.pk)
+		self.assertEqual(data['status'], 'failed')
+		self.assertIn('Fichier invalide', data['error'])
+
+	def test_jobs_are_claimed_once_oldest_first(self):
+		first = self.jobs.enqueue('inventory_pdf')
+		second = self.jobs.enqueue('inventory_pdf')
+		self.assertEqual(self.jobs.claim_next().pk, first.pk)
+		self.assertEqual(self.jobs.claim_next().pk, second.pk)
+		self.assertIsNone(self.jobs.claim_next())
+
+
+	def test_claim_refreshes_the_job_so_it_is_not_taken_for_stale(self):
+		job = self.jobs.enqueue('inventory_pdf')
+		Job.objects.filter(pk=job.pk).update(updated_at=timezone.now() - timedelta(hours=3))
+		self.jobs.claim_next()
+		self.assertEqual(self.jobs.fail_stale(), 0)
+		self.assertEqual(Job.objects.get(pk=job.pk).status, 'running')
+
+	def test_job_failed_as_stale_meanwhile_stays_failed(self):
+		from unittest import mock
+		self.jobs.enqueue('take_snapshots', {'day': '2026-01-01'})
+		job = self.jobs.claim_next()
+
+		def reaped(ctx, day):
+			Job.objects.filter(pk=ctx.job.pk).update(status='failed', error='Interrompue')
+			return {'result': {}}
+
+		with mock.patch.dict(self.jobs.HANDLERS, {'take_snapshots': reaped}):
+			job = self.jobs.run(job)
+		self.assertEqual((job.status, job.error), ('failed', 'Interrompue'))
+
+class InventoryReportTests(TestCase):
+	def setUp(self):
+		import shutil
+		import tempfile
+		from django.test import override_settings
+		root = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, root, ignore_errors=True)
+		settings = override_settings(REPORTS_ROOT=root, JOBS_ROOT=root)
+		settings.enable()
+		self.addCleanup(settings.disable)
+		self.client = Client()
+		self.products = [
+			Product.objects.create(
+				name=f'Produit {i:03d}', therapeutic_class='analgesic', selling_price=15, cost_price=10,
+				current_stock=i % 7, minimum_stock_level=3
+			)
+			for i in range(120)
+		]
+		ProductBatch.objects.create(
+			product=self.products[10], batch_number='EXP-1', quantity=5, purchase_price=10,
+			expiry_date=timezone.localdate() + timedelta(days=3)
+		)
+
+	def _tables(self, title):
+		from reportlab.platypus import Paragraph, Table
+		from .reports import inventory_story
+		rows, section = [], None
+		for flowable in inventory_story(timezone.localdate()):
+			if isinstance(flowable, Paragraph):
+				section = flowable.getPlainText()
+			elif isinstance(flowable, Table) and section == title:
+				rows.extend(flowable._cellvalues[1:])
+		return rows
+
+	def test_report_covers_the_whole_catalogue_and_the_alerts(self):
+		catalogue = self._tables('Catalogue')
+		self.assertEqual(len(catalogue), 120)
+		self.assertEqual(catalogue[-1][0], 'Produit 119')
+		self.assertEqual(catalogue[7][7], 'Rupture')
+		self.assertEqual({row[5] for row in self._tables('Alertes de stock')}, {'Rupture', 'Stock faible'})
+		expiring = self._tables('Lots expirés ou expirant sous 30 jours')
+		self.assertEqual([(row[0], row[1], row[3]) for row in expiring], [('Produit 010', 'EXP-1', 3)])
+
+		# Never rendered in the request: the first download starts the job
+		from . import jobs
+		resp = self.client.get('/inventory/api/analytics/inventory/pdf/', HTTP_ACCEPT='application/json')
+		self.assertEqual(resp.status_code, 202)
+		self.assertEqual(Job.objects.get(pk=resp.json()['id']).kind, 'inventory_pdf')
+		self.assertEqual(self.client.get('/inventory/api/analytics/inventory/pdf/').status_code, 302)
+		self.assertEqual(Job.objects.filter(kind='inventory_pdf').count(), 1)
+		jobs.run_pending()
+
+		resp = self.client.get('/inventory/api/analytics/inventory/pdf/')
+		self.assertEqual(resp.status_code, 200)
+		pdf = b''.join(resp.streaming_content)
+		self.assertTrue(pdf.startswith(b'%PDF'))
+		self.assertGreater(pdf.count(b'/Type /Page\n'), 2)
+
+	def test_stale_report_is_served_while_a_new_one_renders(self):
+		from unittest import mock
+		from . import jobs, reports
+		first = reports.cached_inventory_pdf()
+		self.products[0].name = 'Renommé'
+		self.products[0].save()
+		with mock.patch.object(reports, 'write_inventory_pdf') as render:
+			resp = self.client.get('/inventory/api/analytics/inventory/pdf/')
+			render.assert_not_called()
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(b''.join(resp.streaming_content), first.read_bytes())
+		self.assertEqual(Job.objects.filter(kind='inventory_pdf', status='pending').count(), 1)
+		jobs.run_pending()
+		self.assertEqual(reports.latest_inventory_pdf(), reports.inventory_pdf_path())
+
+	def test_report_is_cached_until_the_inventory_changes(self):
+		from unittest import mock
+		from . import reports
+		first = reports.cached_inventory_pdf()
+		with mock.patch.object(reports, 'write_inventory_pdf') as render:
+			self.assertEqual(reports.cached_inventory_pdf(), first)
+			render.assert_not_called()
+
+		# A rename changes no stock counter but still shows in the report
+		self.products[0].name = 'Renommé'
+		self.products[0].save()
+		second = reports.cached_inventory_pdf()
+		self.assertNotEqual(second, first)
+		# Kept for the downloads that listed it before the render
+		self.assertTrue(first.exists())
+		self.products[0].name = 'Renommé encore'
+		self.products[0].save()
+		reports.cached_inventory_pdf()
+		self.assertFalse(first.exists())
+		self.assertTrue(second.exists())
+
+	def test_report_removed_before_its_download_opens_it(self):
+		from unittest import mock
+		from . import reports
+		current = reports.cached_inventory_pdf()
+		removed = current.with_name('inventory_19700101-0.pdf')
+		with mock.patch.object(reports, 'latest_inventory_pdf', side_effect=[removed, current]):
+			resp = self.client.get('/inventory/api/analytics/inventory/pdf/')
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(b''.join(resp.streaming_content), current.read_bytes())
+
+
+class ExpiryBucketTests(TestCase):
+	def setUp(self):
+		from . import expiry, summary
+		self.expiry = expiry
+		self.summary = summary
+		expiry.clear_cache()
+		self.addCleanup(expiry.clear_cache)
+		self.client = Client()
+		self.today = timezone.localdate()
+		self.product = Product.objects.create(name='BucketMed', selling_price=15, cost_price=10, current_stock=30)
+		self.batches = {
+			number: ProductBatch.objects.create(
+				product=self.product, batch_number=number, quantity=5, purchase_price=10,
+				expiry_date=self.today + timedelta(days=days)
+			)
+			for number, days in [('OLD', -3), ('SOON1', 5), ('SOON2', 30), ('LATER', 60), ('FAR', 400)]
+		}
+
+	def test_buckets_are_computed_in_one_query(self):
+		with self.assertNumQueries(1):
+			buckets = self.expiry.compute_buckets(self.today)
+		self.assertEqual(
+			{key: (value['batches'], value['units']) for key, value in buckets.items()},
+			{'expired': (1, 5), 'critical': (2, 10), 'warning': (1, 5), 'good': (1, 5)}
+		)
+		self.assertEqual(buckets['critical']['value'], 100.0)
+		for batch in self.batches.values():
+			self.assertEqual(self.expiry.bucket_of(batch.expiry_date, self.today), batch.expiry_status)
+
+	def test_buckets_are_cached_until_a_batch_changes(self):
+		first = self.expiry.expiry_buckets()
+		with self.assertNumQueries(1):
+			self.assertIs(self.expiry.expiry_buckets(), first)
+		batch = self.batches['FAR']
+		batch.expiry_date = self.today + timedelta(days=10)
+		batch.save()
+		self.assertEqual(self.expiry.expiry_buckets()['critical']['batches'], 3)
+
+	def test_expiring_soon_api_is_paginated(self):
+		resp = self.client.get('/inventory/api/expiry/', {'page_size': 2})
+		data = resp.json()
+		self.assertEqual([b['batch_number'] for b in data['batches']], ['SOON1', 'SOON2'])
+		self.assertEqual(data['pagination']['count'], 3)
+		self.assertTrue(data['pagination']['has_next'])
+		data = self.client.get('/inventory/api/expiry/', {'page_size': 2, 'page': 2}).json()
+		self.assertEqual([(b['batch_number'], b['expiry_status']) for b in data['batches']], [('LATER', 'warning')])
+		data = self.client.get('/inventory/api/expiry/', {'bucket': 'expired'}).json()
+		self.assertEqual([b['days_until_expiry'] for b in data['batches']], [-3])
+		self.assertEqual(self.client.get('/inventory/api/expiry/', {'bucket': 'bogus'}).status_code, 400)
+
+	def test_expired_batches_are_written_off_once(self):
+		from . import jobs
+		# Reading the buckets never writes anything off
+		self.expiry.expiry_buckets()
+		self.assertFalse(Job.objects.filter(kind='expire_batches').exists())
+
+		# The worker schedules the write-off once a day
+		worker = jobs.Worker()
+		worker.maintain()
+		job = Job.objects.get(kind='expire_batches')
+		self.assertEqual(job.params, {'day': self.summary.today().isoformat()})
+		worker.maintain()
+		jobs.Worker().maintain()
+		self.assertEqual(jobs.schedule_nightly(), [])
+		self.assertEqual(Job.objects.filter(kind='expire_batches').count(), 1)
+
+		self.assertEqual(jobs.run(jobs.claim_next()).result, {'written_off': 1})
+		self.batches['OLD'].refresh_from_db()
+		self.assertEqual(self.batches['OLD'].quantity, 0)
+		movement = StockMovement.objects.get(product=self.product, movement_type='expiry')
+		self.assertEqual((movement.quantity, movement.previous_stock, movement.new_stock), (-5, 30, 25))
+		self.assertEqual(self.expiry.write_off_expired(), 0)
+		self.assertEqual(self.summary.current_summary().expired_count, 0)
+		self.assertEqual(self.summary.verify(), [])
+		self.assertEqual(job.pk, Job.objects.get(kind='expire_batches', status='done').pk)
+
+
+class StockLedgerTests(TestCase):
+	def setUp(self):
+		from . import ledger
+		from .stock import apply_stock_changes, run_with_retry
+		self.ledger = ledger
+		self.base = timezone.now() - timedelta(days=10)
+		self.product = Product.objects.create(
+			name='LedgerMed', selling_price=5, cost_price=2, current_stock=10, minimum_stock_level=2
+		)
+		run_with_retry(apply_stock_changes, {self.product.id: -3}, movement_type='sale')
+		run_with_retry(apply_stock_changes, {self.product.id: 5}, movement_type='receipt')
+		# Day 0: created with 10 units, day 2: 3 sold, day 6: 5 received
+		Product.objects.filter(pk=self.product.pk).update(created_at=self.base)
+		self.product.refresh_from_db()
+		for movement, day in zip(StockMovement.objects.filter(product=self.product).order_by('id'), (0, 2, 6)):
+			StockMovement.objects.filter(pk=movement.pk).update(created_at=self.base + timedelta(days=day))
+
+	def at(self, day):
+		return self.base + timedelta(days=day)
+
+	def stock_history(self):
+		return [self.ledger.stock_at(self.product, self.at(day)) for day in (-1, 1, 3, 5, 7)]
+
+	def test_product_form_stock_edits_are_logged(self):
+		data = {
+			'name': 'LedgerMed', 'dci': '', 'therapeutic_class': 'other', 'cost_price': '2', 'selling_price': '5',
+			'current_stock': '20', 'minimum_stock_level': '2', 'barcode': '', 'is_active': 'on',
+		}
+		self.client.post(f'/inventory/products/{self.product.id}/edit/', data)
+		movement = StockMovement.objects.filter(product=self.product).latest('id')
+		self.assertEqual((movement.movement_type, movement.quantity, movement.new_stock), ('adjustment', 8, 20))
+		total = StockMovement.objects.filter(product=self.product).aggregate(total=Sum('quantity'))['total']
+		self.assertEqual(total, 20)
+
+	def test_stock_at_replays_from_snapshots(self):
+		self.assertEqual(self.stock_history(), [0, 10, 7, 7, 12])
+		self.assertEqual(self.ledger.take_snapshots(self.at(4)), 1)
+		self.assertEqual(self.ledger.take_snapshots(self.at(4)), 0)
+		self.assertEqual(StockSnapshot.objects.get(product=self.product).stock, 7)
+		with self.assertNumQueries(3):
+			self.assertEqual(self.ledger.stock_at(self.product, self.at(7)), 12)
+		self.assertEqual(self.stock_history(), [0, 10, 7, 7, 12])
+
+	def test_only_products_that_moved_are_snapshotted_again(self):
+		other = Product.objects.create(name='QuietMed', selling_price=5, cost_price=2, current_stock=4)
+		self.assertEqual(self.ledger.take_snapshots(), 2)
+		self.assertEqual(self.ledger.take_snapshots(), 0)
+		from .stock import apply_stock_changes, run_with_retry
+		run_with_retry(apply_stock_changes, {self.product.id: -1}, movement_type='sale')
+		self.assertEqual(self.ledger.take_snapshots(), 1)
+		self.assertEqual(StockSnapshot.objects.filter(product=other).count(), 1)
+
+	def test_snapshots_are_taken_by_the_nightly_jobs(self):
+		from . import jobs
+		scheduled = jobs.schedule_nightly()
+		job = Job.objects.get(kind='take_snapshots')
+		self.assertIn(job, scheduled)
+		self.assertEqual(job.params, {'day': timezone.localdate().isoformat()})
+		Job.objects.filter(pk=job.pk).update(status='running')
+		self.assertEqual(jobs.run(job).result, {'snapshots': 1})
+		self.assertEqual(StockSnapshot.objects.get(product=self.product).stock, 12)
+
+	def test_archiving_keeps_history(self):
+		self.assertEqual(self.ledger.archive_movements(self.at(4)), 2)
+		self.assertEqual(StockMovement.objects.filter(product=self.product).count(), 1)
+		self.assertEqual(StockMovementArchive.objects.filter(product=self.product).count(), 2)
+		self.assertEqual(StockSnapshot.objects.get(product=self.product).taken_at, self.at(4))
+		self.assertEqual(self.stock_history(), [0, 10, 7, 7, 12])
+
+	def test_stock_at_api(self):
+		day = timezone.localdate(self.at(3))
+		data = self.client.get(f'/inventory/api/products/{self.product.id}/stock-at/', {'date': day.isoformat()}).json()
+		self.assertEqual(data['stock'], 7)
+		resp = self.client.get(f'/inventory/api/products/{self.product.id}/stock-at/', {'date': 'hier'})
+		self.assertEqual(resp.status_code, 400)
+
+
+class StockReconciliationTests(TestCase):
+	def setUp(self):
+		from . import reconcile
+		self.reconcile = reconcile
+		self.good = Product.objects.create(name='GoodMed', selling_price=5, cost_price=2, current_stock=8)
+		self.drifted = Product.objects.create(name='DriftMed', selling_price=5, cost_price=2, current_stock=10)
+		ProductBatch.objects.create(
+			product=self.good, batch_number='G1', expiry_date=timezone.localdate() + timedelta(days=200),
+			quantity=8, purchase_price=1,
+		)
+		# Changed behind the application's back: no movement, no batch
+		Product.objects.filter(pk=self.drifted.pk).update(current_stock=14)
+
+	def test_discrepancies_are_reported(self):
+		result = self.reconcile.reconcile(chunk_size=1)
+		self.assertEqual(result.checked, 2)
+		self.assertEqual(result.counts, {'ledger': 1, 'batches': 1})
+		self.assertEqual(result.discrepancies, [{
+			'product_id': self.drifted.pk, 'product_name': 'DriftMed', 'current_stock': 14, 'batch_stock': 0,
+			'ledger_stock': 10, 'kinds': ['ledger', 'batches'],
+		}])
+
+	def test_fix_completes_the_ledger_without_rewriting_history(self):
+		from .ledger import stock_at
+		before = timezone.now()
+		result = self.reconcile.reconcile(fix=True)
+		self.assertEqual(result.corrected, 1)
+		movement = StockMovement.objects.get(product=self.drifted, reference='Rapprochement')
+		self.assertEqual((movement.quantity, movement.previous_stock, movement.new_stock), (4, 10, 14))
+		self.assertEqual(self.reconcile.reconcile().counts, {'ledger': 0, 'batches': 1})
+		self.drifted.refresh_from_db()
+		self.assertEqual(self.drifted.current_stock, 14)
+		self.assertEqual(stock_at(self.drifted, timezone.now()), 14)
+		self.assertEqual(stock_at(self.drifted, before), 10)
+
+	def test_reconciliation_api(self):
+		from . import jobs
+		# Checked by a job, never in the request
+		resp = self.client.get('/inventory/api/stock/reconciliation/', HTTP_ACCEPT='application/json')
+		self.assertEqual(resp.status_code, 202)
+		self.assertEqual(Job.objects.get(pk=resp.json()['id']).params, {'fix': False})
+		jobs.run_pending()
+
+		data = self.client.get('/inventory/api/stock/reconciliation/').json()
+		self.assertEqual(data['counts'], {'ledger': 1, 'batches': 1})
+		self.assertEqual([row['product_id'] for row in data['discrepancies']], [self.drifted.pk])
+		resp = self.client.post('/inventory/api/stock/reconciliation/', {'fix': '1'}, HTTP_ACCEPT='application/json')
+		self.assertEqual(resp.status_code, 202)
+		self.assertEqual(Job.objects.get(pk=resp.json()['id']).params, {'fix': True})
+
+
+class ProfitabilityAnalyticsTests(TestCase):
+	def test_products_are_ranked_by_margin_in_the_database(self):
+		# Integer prices: the margin must not be computed with integer division
+		Product.objects.create(name='LowMargin', selling_price=3, cost_price=2, current_stock=4)
+		Product.objects.create(name='HighMargin', selling_price=7, cost_price=2, current_stock=3)
+		Product.objects.create(name='FreeSample', selling_price=1, cost_price=0, current_stock=9)
+		Product.objects.create(name='Retired', selling_price=90, cost_price=2, current_stock=1, is_active=False)
+		for i in range(12):
+			Product.objects.create(name=f'Filler{i:02d}', selling_price=2, cost_price=2, current_stock=1)
+
+		data = self.client.get('/inventory/api/analytics/profitability/').json()
+		top = data['most_profitable_products']
+		self.assertEqual(len(top), 10)
+		self.assertEqual([p['name'] for p in top[:3]], ['HighMargin', 'LowMargin', 'Filler00'])
+		self.assertEqual(top[0], {
+			'name': 'HighMargin', 'profit_margin': 250.0, 'total_profit': 15.0,
+			'selling_price': 7.0, 'cost_price': 2.0, 'current_stock': 3,
+		})
+		self.assertEqual(top[1]['profit_margin'], 50.0)
+
+
+class ProductClassificationTests(TestCase):
+	WINDOW = 10
+
+	def setUp(self):
+		from sales.models import DailyProductSalesRollup
+		from . import classification
+		self.classification = classification
+		self.today = timezone.localdate()
+		self.start = self.today - timedelta(days=self.WINDOW)
+		self.steady = Product.objects.create(name='SteadyMed', selling_price=8, cost_price=4, current_stock=20)
+		self.bulk = Product.objects.create(name='BulkMed', selling_price=15, cost_price=10, current_stock=5)
+		self.slow = Product.objects.create(name='SlowMed', selling_price=5, cost_price=2, current_stock=7)
+		self.unsold = Product.objects.create(name='UnsoldMed', selling_price=5, cost_price=2, current_stock=3)
+		# Steady: 10 units a day (revenue 800); bulk: 10 units once (150); slow: 10 units once (50)
+		for i in range(self.WINDOW):
+			DailyProductSalesRollup.objects.create(
+				date=self.start + timedelta(days=i), product=self.steady, quantity=10, revenue=80, cost=40
+			)
+		DailyProductSalesRollup.objects.create(date=self.start, product=self.bulk, quantity=10, revenue=150, cost=100)
+		DailyProductSalesRollup.objects.create(date=self.start, product=self.slow, quantity=10, revenue=50, cost=20)
+		# Sales from before the window are ignored
+		DailyProductSalesRollup.objects.create(
+			date=self.start - timedelta(days=1), product=self.unsold, quantity=99, revenue=999, cost=1
+		)
+		# SteadyMed got its 20 units on day 5 of the window: 10 on average
+		StockMovement.objects.filter(product=self.steady).update(
+			created_at=timezone.make_aware(datetime.combine(self.start + timedelta(days=5), datetime.min.time()))
+		)
+
+	def classify(self, expected=4):
+		self.assertEqual(self.classification.classify_products(self.today, self.WINDOW), expected)
+		return {c.product_id: c for c in ProductClassification.objects.all()}
+
+	def test_abc_xyz_classes_and_turnover(self):
+		from sales.models import DailyProductSalesRollup
+		result = self.classify()
+		classes = {pk: c.abc_class + c.xyz_class for pk, c in result.items()}
+		self.assertEqual(classes, {self.steady.pk: 'AX', self.bulk.pk: 'BZ', self.slow.pk: 'CZ', self.unsold.pk: 'CZ'})
+
+		steady = result[self.steady.pk]
+		self.assertEqual((steady.units_sold, steady.average_daily_demand, steady.demand_cv), (100, 10, 0))
+		self.assertEqual(steady.average_stock, 10)
+		self.assertAlmostEqual(steady.turnover, 100 * 365 / self.WINDOW / 10)
+		self.assertEqual(steady.days_of_cover, 2)
+		self.assertAlmostEqual(result[self.bulk.pk].demand_cv, 3)
+		unsold = result[self.unsold.pk]
+		self.assertEqual((unsold.units_sold, unsold.demand_cv, unsold.days_of_cover), (0, None, None))
+
+		# Only the rows that change are rewritten
+		self.classify(expected=0)
+		self.slow.is_active = False
+		self.slow.save()
+		DailyProductSalesRollup.objects.filter(product=self.steady).update(quantity=12)
+		self.assertEqual(set(self.classify(expected=1)), {self.steady.pk, self.bulk.pk, self.unsold.pk})
+
+	def test_analytics_read_the_stored_classes_and_the_worker_schedules_the_nightly_run(self):
+		from . import jobs
+		self.classify()
+		data = self.client.get('/inventory/api/analytics/inventory/').json()
+		self.assertEqual(data['classification']['counts']['C']['Z'], 2)
+		self.assertFalse(Job.objects.filter(kind='classify_products').exists())
+		jobs.Worker().maintain()
+		jobs.Worker().maintain()
+		self.assertEqual(Job.objects.filter(kind='classify_products').count(), 1)
+
+		data = self.client.get('/inventory/api/analytics/classification/', {'abc': 'C'}).json()
+		self.assertEqual([p['product_name'] for p in data['products']], ['SlowMed', 'UnsoldMed'])
+		resp = self.client.get('/inventory/api/analytics/classification/', {'xyz': 'W'})
+		self.assertEqual(resp.status_code, 400)
+
+
+class ReorderSuggestionTests(TestCase):
+	def setUp(self):
+		from sales.models import DailyProductSalesRollup
+		from .models import Supplier
+		from . import reorder
+		self.reorder = reorder
+		self.today = timezone.localdate()
+		self.north = Supplier.objects.create(name='Nord Pharma')
+		self.south = Supplier.objects.create(name='Sud Pharma')
+		self.fast = Product.objects.create(name='FastMed', selling_price=5, cost_price=2, current_stock=20)
+		self.slow = Product.objects.create(name='SlowMed', selling_price=5, cost_price=3, current_stock=2, minimum_stock_level=5)
+		self.full = Product.objects.create(name='FullMed', selling_price=5, cost_price=2, current_stock=50)
+		self.orphan = Product.objects.create(name='OrphanMed', selling_price=5, cost_price=2, current_stock=0)
+		expiry = self.today + timedelta(days=300)
+		for product, supplier in ((self.fast, self.south), (self.fast, self.north), (self.slow, self.south), (self.full, self.north)):
+			ProductBatch.objects.create(
+				product=product, batch_number=f'{product.name}-{supplier.name}', expiry_date=expiry, quantity=0,
+				purchase_price=1, supplier=supplier,
+			)
+		# FastMed sells 10 units every day: forecast 10 a day, no variability
+		DailyProductSalesRollup.objects.bulk_create([
+			DailyProductSalesRollup(date=self.today - timedelta(days=d), product=self.fast, quantity=10, revenue=50, cost=20)
+			for d in range(1, self.reorder.REORDER_HISTORY_DAYS + 1)
+		])
+
+	def test_forecast_by_exponential_smoothing(self):
+		forecast, std = self.reorder.forecasts(self.today)[self.fast.pk]
+		self.assertAlmostEqual(forecast, 10)
+		self.assertAlmostEqual(std, 0)
+
+	def test_drafts_are_grouped_by_supplier_and_replaced_on_each_run(self):
+		from .models import PurchaseOrder, PurchaseOrderItem
+		result = self.reorder.suggest_reorders()
+		self.assertEqual((result.orders, result.lines, result.without_supplier), (2, 2, 1))
+		# Lead time 7 + review 7 days of 10 units, minus the 20 in stock; up to one above the minimum
+		lines = {(i.purchase_order.supplier.name, i.product.name): i.quantity for i in PurchaseOrderItem.objects.all()}
+		self.assertEqual(lines, {('Nord Pharma', 'FastMed'): 120, ('Sud Pharma', 'SlowMed'): 4})
+		order = PurchaseOrder.objects.get(supplier=self.south)
+		self.assertEqual((order.status, order.total_amount), ('draft', 12))
+
+		self.reorder.suggest_reorders()
+		self.assertEqual(PurchaseOrder.objects.count(), 2)
+		numbers = set(PurchaseOrder.objects.values_list('order_number', flat=True))
+		self.assertEqual(len(numbers), 2)
+
+		# An order placed by hand counts as on order
+		PurchaseOrder.objects.filter(supplier=self.north).update(status='ordered')
+		result = self.reorder.suggest_reorders()
+		self.assertEqual((result.orders, result.lines), (1, 1))
+		self.assertEqual(PurchaseOrder.objects.count(), 2)
+
+	def test_preview_api_writes_nothing(self):
+		from . import jobs
+		from .models import PurchaseOrder
+		# Computed by a job, never in the request
+		resp = self.client.get('/inventory/api/reorder/', HTTP_ACCEPT='application/json')
+		self.assertEqual(resp.status_code, 202)
+		self.assertEqual(Job.objects.get(pk=resp.json()['id']).params, {'dry_run': True})
+		self.client.get('/inventory/api/reorder/', HTTP_ACCEPT='application/json')
+		self.assertEqual(Job.objects.count(), 1)
+		jobs.run_pending()
+
+		data = self.client.get('/inventory/api/reorder/').json()
+		self.assertEqual([s['product_name'] for s in data['suggestions']], ['FastMed', 'SlowMed'])
+		self.assertIsNone(data['job'])
+		self.assertFalse(PurchaseOrder.objects.exists())
+		resp = self.client.post('/inventory/api/reorder/', HTTP_ACCEPT='application/json')
+		self.assertEqual(Job.objects.get(pk=resp.json()['id']).kind, 'suggest_reorders')
@@ -4,6 +4,7 @@ from . import views
 urlpatterns = [
     path('dashboard/', views.inventory_dashboard, name='inventory_dashboard'),
     path('api/dashboard/', views.inventory_dashboard_api, name='inventory_dashboard_api'),
+    path('api/expiry/', views.expiring_batches_api, name='expiring_batches_api'),
 
     # User-facing inventory management
     path('products/', views.product_list, name='product_list'),
@@ -12,20 +13,30 @@ urlpatterns = [
     path('stock/receive/', views.receive_stock, name='receive_stock'),
     path('stock/receive/<int:product_id>/', views.receive_stock, name='receive_stock_product'),
     path('products/<int:product_id>/adjust-stock/', views.adjust_stock, name='adjust_stock'),
+    path('api/products/<int:product_id>/stock-at/', views.product_stock_at_api, name='product_stock_at_api'),
+    path('api/stock/reconciliation/', views.stock_reconciliation_api, name='stock_reconciliation_api'),
 
     # Supplier and PurchaseOrder routes removed
+    path('api/reorder/', views.reorder_suggestions_api, name='reorder_suggestions_api'),
+    path('api/purchase-orders/<int:order_id>/receive/', views.receive_purchase_order_api, name='receive_purchase_order_api'),
 
     # Analytics
     path('analytics/', views.analytics_dashboard, name='analytics_dashboard'),
     path('api/analytics/sales/', views.sales_analytics_api, name='sales_analytics_api'),
     path('api/analytics/profitability/', views.profitability_analytics_api, name='profitability_analytics_api'),
     path('api/analytics/inventory/', views.inventory_analytics_api, name='inventory_analytics_api'),
+    path('api/analytics/classification/', views.product_classification_api, name='product_classification_api'),
     path('api/analytics/inventory/pdf/', views.analytics_inventory_pdf, name='analytics_inventory_pdf'),
 
     # Excel import/export routes
     path('products/export_excel/', views.export_products_excel, name='export_products_excel'),
     path('products/import_excel/', views.import_products_excel, name='import_products_excel'),
     path('products/template_excel/', views.download_products_template, name='download_products_template'),
+
+    # Background jobs (imports, exports, PDF reports)
+    path('api/jobs/', views.job_list_api, name='job_list_api'),
+    path('api/jobs/<int:job_id>/', views.job_status_api, name='job_status_api'),
+    path('jobs/<int:job_id>/download/', views.job_download, name='job_download'),
     
 
 ]
@@ -1,71 +1,125 @@
-from reportlab.pdfgen import canvas
-from django.http import FileResponse
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from . import jobs
+from .models import Job
+from .reports import inventory_pdf_path, open_latest_inventory_pdf
+
+
+def _wants_json(request):
+    return 'application/json' in request.headers.get('Accept', '')
+
+
+def _job_started(request, job, message):
+    """Answer a request that started ``job``: its id as JSON, or a message and a redirect."""
+    if _wants_json(request):
+        return JsonResponse(_job_data(job), status=202)
+    messages.info(request, f'{message} (tâche #{job.pk}).')
+    return redirect('product_list')
+
+
+def _job_data(job):
+    done, total = jobs.live_progress(job)
+    return {
+        'id': job.pk,
+        'kind': job.kind,
+        'status': job.status,
+        'status_display': job.get_status_display(),
+        'progress': done,
+        'total': total,
+        'percent': min(100, round(done * 100 / total)) if total else None,
+        'result': job.result,
+        'error': job.error,
+        'status_url': reverse('job_status_api', args=[job.pk]),
+        'download_url': reverse('job_download', args=[job.pk]) if job.status == 'done' and job.result_file else None,
+        'created_at': job.created_at.isoformat(),
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def _last_result(kind, params, **filters):
+    """``(last done job, job under way)`` of ``kind`` among the jobs matching ``filters``.
+
+    When none finished today and none is under way, a job with ``params``
+    is enqueued, so the next read finds today's result.
+    """
+    done = Job.objects.filter(kind=kind, status='done', **filters).order_by('-finished_at').first()
+    running = Job.objects.filter(kind=kind, status__in=['pending', 'running'], **filters).first()
+    if running is None and (done is None or timezone.localtime(done.finished_at).date() != timezone.localdate()):
+        running = jobs.enqueue(kind, params)
+    return done, running
+
+
+def job_status_api(request, job_id):
+    job = get_object_or_404(Job, pk=job_id)
+    return JsonResponse(_job_data(job))
+
+
+def job_list_api(request):
+    """The most recent jobs, newest first."""
+    return JsonResponse({'jobs': [_job_data(job) for job in Job.objects.all()[:20]]})
+
+
+def job_download(request, job_id):
+    job = get_object_or_404(Job, pk=job_id, status='done')
+    if not job.result_file:
+        raise Http404("Cette tâche n'a pas produit de fichier")
+    try:
+        file = open(job.result_file, 'rb')
+    except FileNotFoundError:
+        raise Http404('Le fichier de cette tâche a été supprimé')
+    return FileResponse(file, as_attachment=True, filename=job.result_name, content_type=job.result_content_type)
+
 
 def analytics_inventory_pdf(request):
-    # Example: generate a simple PDF with product summary
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'attachment; filename=inventory_analytics.pdf'
-    p = canvas.Canvas(response)
-    p.setFont("Helvetica", 14)
-    p.drawString(100, 800, "Inventory Analytics Report")
-    y = 780
-    for prod in Product.objects.all()[:50]:
-        p.setFont("Helvetica", 10)
-        therapeutic = prod.get_therapeutic_class_display() if hasattr(prod, 'get_therapeutic_class_display') else getattr(prod, 'therapeutic_class', '')
-        qty = getattr(prod, 'current_stock', 'N/A')
-        p.drawString(100, y, f"{prod.name} | {therapeutic} | Qty: {qty}")
-        y -= 16
-        if y < 50:
-            p.showPage()
-            y = 800
-    p.save()
-    return response
+    """The inventory PDF report.
+
+    Rendering takes seconds on a large catalogue, so it is left to the jobs
+    worker: GET serves the last report rendered and, when the stock changed
+    since, starts rendering a new one (POST always does, and answers with the
+    job). With no report yet, GET answers like POST.
+    """
+    if request.method == 'POST':
+        return _job_started(request, jobs.enqueue('inventory_pdf'), "Génération du rapport PDF lancée")
+    path, file = open_latest_inventory_pdf()
+    if path != inventory_pdf_path():
+        job = Job.objects.filter(kind='inventory_pdf', status__in=['pending', 'running']).first()
+        job = job or jobs.enqueue('inventory_pdf')
+        if path is None:
+            return _job_started(request, job, "Génération du rapport PDF lancée")
+    return FileResponse(
+        file,
+        as_attachment=True,
+        filename='inventory_analytics.pdf',
+        content_type='application/pdf'
+    )
 # --- Excel Export/Import ---
-import openpyxl
-from django.http import HttpResponse
+from .spreadsheets import XLSX_CONTENT_TYPE, export_rows, iter_csv, template_workbook, xlsx_tempfile
 from .models import Product
 from django.contrib import messages
 from django.shortcuts import redirect
 
 def export_products_excel(request):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Products"
-    ws.append(["ID", "Name", "DCI", "Therapeutic Class", "Cost Price", "Selling Price", "Is Active", "Barcode", "Current Stock", "Minimum Stock Level"])
-    for p in Product.objects.all():
-        # Get human-friendly therapeutic class where possible
-        therapeutic = p.get_therapeutic_class_display() if hasattr(p, 'get_therapeutic_class_display') else getattr(p, 'therapeutic_class', '')
-        ws.append([
-            p.id,
-            p.name,
-            getattr(p, 'dci', ''),
-            therapeutic,
-            float(p.cost_price) if p.cost_price is not None else 0,
-            float(getattr(p, 'selling_price', getattr(p, 'selling_price', 0))) if getattr(p, 'selling_price', None) is not None else 0,
-            bool(p.is_active),
-            p.barcode or '',
-            int(getattr(p, 'current_stock', 0)),
-            int(getattr(p, 'minimum_stock_level', 0)),
-        ])
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = 'attachment; filename=products_export.xlsx'
-    wb.save(response)
-    return response
+    fmt = 'csv' if request.GET.get('format', request.POST.get('format')) == 'csv' else 'xlsx'
+    if request.method == 'POST':
+        # Large catalogues: written by the jobs worker, downloaded when ready
+        return _job_started(request, jobs.enqueue('export_products', {'format': fmt}), "Export lancé en arrière-plan")
+    # Streamed as rows are read: CSV line by line, XLSX from a write-only temporary workbook
+    if fmt == 'csv':
+        response = StreamingHttpResponse(iter_csv(export_rows()), content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename=products_export.csv'
+        return response
+    return FileResponse(
+        xlsx_tempfile(export_rows()),
+        as_attachment=True,
+        filename='products_export.xlsx',
+        content_type=XLSX_CONTENT_TYPE
+    )
 
 
 def download_products_template(request):
     """Return a small Excel template for product imports."""
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Products Template"
-    headers = ["ID", "Name", "DCI", "Therapeutic Class", "Cost Price", "Selling Price", "Is Active", "Barcode", "Current Stock", "Minimum Stock Level"]
-    ws.append(headers)
-    # example row
-    ws.append(["", "Example Product", "DCI Example", "other", 100.0, 150.0, True, "", 10, 5])
-
-    response = HttpResponse(content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+    response = HttpResponse(content_type=XLSX_CONTENT_TYPE)
     response['Content-Disposition'] = 'attachment; filename=products_template.xlsx'
-    wb.save(response)
+    template_workbook(response)
     return response
 
 def import_products_excel(request):
@@ -73,106 +127,33 @@ def import_products_excel(request):
         messages.error(request, 'Aucun fichier envoyé. Veuillez sélectionner un fichier Excel (.xlsx).')
         return redirect('product_list')
 
-    wb = openpyxl.load_workbook(request.FILES['file'])
-    ws = wb.active
-    rows = list(ws.iter_rows(min_row=2, values_only=True))
-
-    successful = 0
-    errors = []
-
-    for idx, row in enumerate(rows, start=2):
-        # Ensure we have 10 columns, pad if necessary
-        fields = list(row)
-        while len(fields) < 10:
-            fields.append(None)
-        _id, name, dci, therapeutic_class, cost_price, selling_price, is_active, barcode, current_stock, minimum_stock = fields
-
-        # Basic validations
-        row_errors = []
-        if not name or str(name).strip() == '':
-            row_errors.append('Name is required')
-
-        # Parse numeric fields
-        try:
-            cost_price_val = float(cost_price) if cost_price not in (None, '') else 0.0
-        except Exception:
-            row_errors.append('Invalid cost price')
-            cost_price_val = 0.0
-
-        try:
-            selling_price_val = float(selling_price) if selling_price not in (None, '') else 0.0
-        except Exception:
-            row_errors.append('Invalid selling price')
-            selling_price_val = 0.0
-
-        try:
-            current_stock_val = int(current_stock) if current_stock not in (None, '') else 0
-        except Exception:
-            row_errors.append('Invalid current stock')
-            current_stock_val = 0
-
-        try:
-            minimum_stock_val = int(minimum_stock) if minimum_stock not in (None, '') else 5
-        except Exception:
-            row_errors.append('Invalid minimum stock level')
-            minimum_stock_val = 5
-
-        # Normalize therapeutic class
-        therapeutic_val = (therapeutic_class or 'other')
-        # Validate therapeutic class against allowed choices
-        allowed_classes = [c[0] for c in Product.THERAPEUTIC_CLASSES]
-        if therapeutic_val not in allowed_classes:
-            row_errors.append(f'Invalid therapeutic class: {therapeutic_val}')
-
-        if row_errors:
-            errors.append({'row': idx, 'errors': row_errors})
-            continue
-
-        defaults = {
-            'name': str(name).strip(),
-            'dci': str(dci).strip() if dci else '',
-            'therapeutic_class': therapeutic_val,
-            'cost_price': cost_price_val,
-            'selling_price': selling_price_val,
-            'is_active': bool(is_active) if is_active not in (None, '') else True,
-            'current_stock': current_stock_val,
-            'minimum_stock_level': minimum_stock_val,
-        }
-
-        try:
-            if barcode and str(barcode).strip() != '':
-                Product.objects.update_or_create(barcode=str(barcode).strip(), defaults=defaults)
-            else:
-                Product.objects.update_or_create(name=defaults['name'], defaults=defaults)
-            successful += 1
-        except Exception as e:
-            errors.append({'row': idx, 'errors': [f'Database error: {e}']})
-
-    # Prepare messages
-    if successful:
-        messages.success(request, f'{successful} produit(s) importé(s) avec succès.')
-    if errors:
-        # attach up to first 10 error summaries
-        for err in errors[:10]:
-            messages.error(request, f"Ligne {err['row']}: {', '.join(err['errors'])}")
-        if len(errors) > 10:
-            messages.error(request, f"...et {len(errors)-10} autres erreurs.")
-
-    return redirect('product_list')
+    # Run by the jobs worker (see spreadsheets.import_products); the result
+    # and the row errors are read from the job status
+    job = jobs.enqueue('import_products', upload=request.FILES['file'])
+    return _job_started(request, job, "Import lancé en arrière-plan")
 
 from django.shortcuts import render, get_object_or_404, redirect
+from django.urls import reverse
 from django.contrib import messages
 from django.http import JsonResponse, Http404
 from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
 from datetime import timedelta
-from .models import Product, ProductBatch
+from .models import Product, ProductClassification, PurchaseOrder
 from .forms import ProductForm, ProductBatchForm
+from .stock import apply_stock_changes, run_with_retry
+from .summary import current_summaries, current_summary
+from . import classification, expiry, ledger
+from .reconcile import DISCREPANCY_KINDS, RECONCILE_REPORT_LIMIT
+from .receiving import RECEIPT_FIELDS, ReceiptError, parse_lines, read_delivery_file, receive_purchase_order
 # Supplier and PurchaseOrder features removed from views (hidden/deleted)
 
-from django.db.models import Sum, Avg, Count, F, Q, ExpressionWrapper, DecimalField
+from django.db.models import Sum, F, Q, Case, When, Value, ExpressionWrapper, DecimalField, FloatField
+from django.db.models.functions import Cast
 from datetime import datetime, timedelta
 import json
-from sales.models import SaleItem, Sale
+from sales.dates import day_start
+from sales.models import DailyProductSalesRollup, DailySalesRollup
 
 def analytics_dashboard(request):
     return render(request, 'inventory/analytics_dashboard.html')
@@ -180,41 +161,44 @@ def analytics_dashboard(request):
 def sales_analytics_api(request):
     # Date range (last 30 days by default)
     days = int(request.GET.get('days', 30))
-    end_date = timezone.now().date()
+    end_date = timezone.localdate()
     start_date = end_date - timedelta(days=days)
 
-    # Sales data
-    sales_data = Sale.objects.filter(
-        sale_date__date__gte=start_date,
-        sale_date__date__lte=end_date
-    )
+    # Daily rollups: one row per day and payment type, one per day and product
+    daily = DailySalesRollup.objects.filter(date__gte=start_date, date__lte=end_date)
 
     # Key metrics
-    total_sales = sales_data.count()
-    total_revenue = sales_data.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-    average_sale = sales_data.aggregate(Avg('total_amount'))['total_amount__avg'] or 0
+    totals = daily.aggregate(total_sales=Sum('sales_count'), total_revenue=Sum('revenue'))
+    total_sales = totals['total_sales'] or 0
+    total_revenue = totals['total_revenue'] or 0
+    average_sale = total_revenue / total_sales if total_sales else 0
 
     # Sales by day for chart
-    sales_by_day = sales_data.extra(
-        {'sale_day': "date(sale_date)"}
-    ).values('sale_day').annotate(
-        daily_sales=Count('id'),
-        daily_revenue=Sum('total_amount')
-    ).order_by('sale_day')
+    sales_by_day = [
+        {
+            'sale_day': row['date'].strftime('%Y-%m-%d'),
+            'daily_sales': row['daily_sales'],
+            'daily_revenue': row['daily_revenue'],
+        }
+        for row in daily.values('date').annotate(
+            daily_sales=Sum('sales_count'),
+            daily_revenue=Sum('revenue')
+        ).filter(daily_sales__gt=0).order_by('date')
+    ]
 
     # Payment type distribution
-    payment_distribution = sales_data.values('sale_type').annotate(
-        count=Count('id'),
-        revenue=Sum('total_amount')
-    )
+    payment_distribution = daily.values('sale_type').annotate(
+        count=Sum('sales_count'),
+        revenue=Sum('revenue')
+    ).filter(count__gt=0).order_by('sale_type')
 
     # Top selling products
-    top_products = SaleItem.objects.filter(
-        sale__sale_date__date__gte=start_date,
-        sale__sale_date__date__lte=end_date
+    top_products = DailyProductSalesRollup.objects.filter(
+        date__gte=start_date,
+        date__lte=end_date
     ).values('product__name').annotate(
         quantity_sold=Sum('quantity'),
-        revenue=Sum(F('quantity') * F('unit_price'))
+        revenue=Sum('revenue')
     ).order_by('-quantity_sold')[:10]
 
     return JsonResponse({
@@ -231,65 +215,48 @@ def sales_analytics_api(request):
             'revenue_per_day': float(total_revenue / days) if days > 0 else 0
         },
         'charts': {
-            'sales_by_day': list(sales_by_day),
+            'sales_by_day': sales_by_day,
             'payment_distribution': list(payment_distribution),
             'top_products': list(top_products)
         }
     })
 
 def profitability_analytics_api(request):
-    # Calculate profitability for products - FIXED VERSION
-    products_with_profit = []
-    for product in Product.objects.filter(is_active=True, cost_price__gt=0):
-        if product.cost_price > 0:
-            profit_margin = ((product.selling_price - product.cost_price) / product.cost_price) * 100
-            total_profit = (product.selling_price - product.cost_price) * product.current_stock
-        else:
-            profit_margin = 0
-            total_profit = 0
-
-        products_with_profit.append({
-            'name': product.name,
-            'profit_margin': float(profit_margin),
-            'total_profit': float(total_profit),
-            'selling_price': float(product.selling_price),
-            'cost_price': float(product.cost_price),
-            'current_stock': product.current_stock
-        })
+    # Top 10 products by margin, ranked by the database: only ten rows are read
+    cost = Cast('cost_price', FloatField())
+    price = Cast('selling_price', FloatField())
+    most_profitable = Product.objects.filter(is_active=True, cost_price__gt=0).annotate(
+        profit_margin=(price - cost) * 100 / cost,
+        total_profit=(price - cost) * F('current_stock'),
+    ).order_by('-profit_margin', 'name').values(
+        'name', 'profit_margin', 'total_profit', 'selling_price', 'cost_price', 'current_stock'
+    )[:10]
+    products_with_profit = [
+        {
+            'name': row['name'],
+            'profit_margin': row['profit_margin'],
+            'total_profit': row['total_profit'],
+            'selling_price': float(row['selling_price']),
+            'cost_price': float(row['cost_price']),
+            'current_stock': row['current_stock'],
+        }
+        for row in most_profitable
+    ]
 
-    # Sort by profit margin (highest first)
-    products_with_profit.sort(key=lambda x: x['profit_margin'], reverse=True)
-
-    # Sales-based profitability (last 30 days)
-    thirty_days_ago = timezone.now().date() - timedelta(days=30)
-    product_profits = SaleItem.objects.filter(
-        sale__sale_date__date__gte=thirty_days_ago
-    ).annotate(
-        product_cost_price=F('product__cost_price')
-    ).annotate(
-        profit_per_item=ExpressionWrapper(
-            F('unit_price') - F('product_cost_price'),
-            output_field=DecimalField()
-        ),
-        total_profit=ExpressionWrapper(
-            (F('unit_price') - F('product_cost_price')) * F('quantity'),
-            output_field=DecimalField()
-        )
+    # Sales-based profitability (last 30 days), from the daily product rollups
+    thirty_days_ago = timezone.localdate() - timedelta(days=30)
+    product_profits = DailyProductSalesRollup.objects.filter(
+        date__gte=thirty_days_ago
     ).values('product__name').annotate(
         total_quantity=Sum('quantity'),
-        total_revenue=Sum(F('quantity') * F('unit_price')),
-        total_profit=Sum('total_profit')
+        total_revenue=Sum('revenue'),
+        total_profit=Sum(F('revenue') - F('cost'))
     ).order_by('-total_profit')[:15]
 
     # Overall profitability metrics
-    total_inventory_value = sum(
-        product.cost_price * product.current_stock
-        for product in Product.objects.filter(is_active=True)
-    )
-    total_potential_revenue = sum(
-        product.selling_price * product.current_stock
-        for product in Product.objects.filter(is_active=True)
-    )
+    summary = current_summary()
+    total_inventory_value = summary.stock_value
+    total_potential_revenue = summary.potential_revenue
     total_potential_profit = total_potential_revenue - total_inventory_value
 
     return JsonResponse({
@@ -302,55 +269,60 @@ def profitability_analytics_api(request):
                 if total_inventory_value > 0 else 0
             )
         },
-        'most_profitable_products': products_with_profit[:10],  # Top 10 by profit margin
+        'most_profitable_products': products_with_profit,
         'sales_based_profits': list(product_profits)
     })
 def inventory_analytics_api(request):
-    # Inventory turnover analysis
-    products = Product.objects.filter(is_active=True)
-
-    # Stock status breakdown
+    # Stock status breakdown and value analysis, from the summary rows
+    summaries = current_summaries()
+    summary = summaries['']
     stock_status = {
-        'out_of_stock': products.filter(current_stock=0).count(),
-        'low_stock': products.filter(current_stock__lte=F('minimum_stock_level'), current_stock__gt=0).count(),
-        'in_stock': products.filter(current_stock__gt=F('minimum_stock_level')).count()
+        'out_of_stock': summary.out_of_stock_count,
+        'low_stock': summary.low_stock_count,
+        'in_stock': summary.product_count - summary.out_of_stock_count - summary.low_stock_count,
     }
-
-    # Value analysis
-    total_inventory_value = sum(p.cost_price * p.current_stock for p in products)
+    therapeutic_classes = [
+        {
+            'therapeutic_class': label,
+            'product_count': summaries[value].product_count,
+            'total_units': summaries[value].total_units,
+            'stock_value': float(summaries[value].stock_value),
+        }
+        for value, label in Product.THERAPEUTIC_CLASSES
+        if value in summaries and summaries[value].product_count
+    ]
 
     # Fast/slow moving analysis (based on recent sales)
-    thirty_days_ago = timezone.now().date() - timedelta(days=30)
-    product_movement = SaleItem.objects.filter(
-        sale__sale_date__date__gte=thirty_days_ago
+    thirty_days_ago = timezone.localdate() - timedelta(days=30)
+    product_movement = DailyProductSalesRollup.objects.filter(
+        date__gte=thirty_days_ago
     ).values('product__name', 'product__current_stock').annotate(
         units_sold=Sum('quantity')
     ).order_by('-units_sold')
 
-    # Expiry analysis - FIXED VERSION
-    today = timezone.now().date()
-    expiry_alerts = []
-    # Only consider batches that actually have quantity and belong to active products
-    for batch in ProductBatch.objects.filter(
-        expiry_date__gte=today,
-        quantity__gt=0,
-        product__is_active=True
-    ).order_by('expiry_date')[:10]:
-        days_until_expiry = (batch.expiry_date - today).days
-        expiry_alerts.append({
-            'product__name': batch.product.name,
-            'expiry_date': batch.expiry_date.strftime('%Y-%m-%d'),
-            'days_until_expiry': days_until_expiry,
-            'quantity': batch.quantity
-        })
+    # Expiry analysis: the next open batches to expire
+    today = summary.expiry_as_of
+    expiry_alerts = [
+        {
+            'product__name': row['product__name'],
+            'expiry_date': row['expiry_date'].strftime('%Y-%m-%d'),
+            'days_until_expiry': (row['expiry_date'] - today).days,
+            'quantity': row['quantity']
+        }
+        for row in expiry.open_batches().filter(expiry_date__gte=today).order_by('expiry_date', 'id').values(
+            'product__name', 'expiry_date', 'quantity'
+        )[:10]
+    ]
 
     return JsonResponse({
         'stock_status': stock_status,
-        'inventory_value': float(total_inventory_value),
-        'total_products': products.count(),
+        'inventory_value': float(summary.stock_value),
+        'total_products': summary.product_count,
         'product_movement': list(product_movement[:15]),
         'expiry_alerts': expiry_alerts,
-        'average_stock_level': float(sum(p.current_stock for p in products) / products.count()) if products.count() > 0 else 0
+        'average_stock_level': summary.total_units / summary.product_count if summary.product_count else 0,
+        'therapeutic_classes': therapeutic_classes,
+        'classification': classification.matrix(),
     })
 # Product List for staff
 def product_list(request):
@@ -387,11 +359,19 @@ def receive_stock(request, product_id=None):
     if request.method == 'POST':
         form = ProductBatchForm(request.POST)
         if form.is_valid():
-            batch = form.save()
-            # Update product stock
+            def save_batch():
+                batch = form.save()
+                # Update product stock
+                apply_stock_changes(
+                    {batch.product_id: batch.quantity},
+                    movement_type='receipt',
+                    reference=f"Lot {batch.batch_number}",
+                    reason="Réception de stock"
+                )
+                return batch
+
+            batch = run_with_retry(save_batch)
             product = batch.product
-            product.current_stock += batch.quantity
-            product.save()
 
             messages.success(request, f'Stock reçu: {batch.quantity} unités de {product.name}')
             return redirect('inventory_dashboard')
@@ -413,12 +393,15 @@ def adjust_stock(request, product_id):
         reason = request.POST.get('reason', '')
 
         if adjustment != 0:
-            product.current_stock += adjustment
-            if product.current_stock < 0:
-                product.current_stock = 0
-            product.save()
+            run_with_retry(
+                apply_stock_changes,
+                {product.id: adjustment},
+                movement_type='adjustment',
+                reason=reason,
+                clamp=True
+            )
+            product.refresh_from_db(fields=['current_stock'])
 
-            # Log the adjustment (we'll create a model for this later)
             messages.success(request, f'Stock ajusté: {adjustment} unités. Stock actuel: {product.current_stock}')
             return redirect('product_list')
 
@@ -427,91 +410,314 @@ def adjust_stock(request, product_id):
 def inventory_dashboard(request):
     return render(request, 'inventory/dashboard.html')
 
+DASHBOARD_PAGE_SIZE = 50
+DASHBOARD_MAX_PAGE_SIZE = 500
+DASHBOARD_ALERTS_LIMIT = 50
+
+STOCK_STATUS_DISPLAY = {
+    'out_of_stock': 'Rupture de stock',
+    'low_stock': 'Stock faible',
+    'in_stock': 'En stock',
+}
+
+
 def inventory_dashboard_api(request):
     # Get all active products
-    products = Product.objects.filter(is_active=True).select_related()
-
-    # Calculate dashboard metrics
-    total_products = products.count()
-    total_stock_value = sum(product.total_value for product in products)
-
-    # Stock alerts
-    low_stock_products = [p for p in products if p.stock_status == 'low_stock']
-    out_of_stock_products = [p for p in products if p.stock_status == 'out_of_stock']
-
-    # Expiry alerts
-    today = timezone.now().date()
-    # Only count batches with remaining quantity and active products
-    critical_expiry = ProductBatch.objects.filter(
-        expiry_date__lte=today + timedelta(days=30),
-        expiry_date__gte=today,
-        quantity__gt=0,
-        product__is_active=True
-    ).count()
-    expired_batches = ProductBatch.objects.filter(
-        expiry_date__lt=today,
-        quantity__gt=0,
-        product__is_active=True
-    ).count()
-
-    # Get critical expiry batches for display
-    critical_batches = ProductBatch.objects.filter(
-        expiry_date__lte=today + timedelta(days=30),
-        expiry_date__gte=today,
-        quantity__gt=0,
-        product__is_active=True
-    ).select_related('product')[:10]
-
-    # Prepare product data for the table
-    product_data = []
-    for product in products:
-        product_data.append({
-            'id': product.id,
-            'name': product.name,
-            'dci': product.dci,
-            'therapeutic_class': product.get_therapeutic_class_display(),
-            'current_stock': product.current_stock,
-            'minimum_stock_level': product.minimum_stock_level,
-            'stock_status': product.stock_status,
-            'stock_status_display': product.get_stock_status_display(),
-            'selling_price': float(product.selling_price),
-            'cost_price': float(product.cost_price),
-            'total_value': float(product.total_value),
-        })
-
-    # Sort products by stock status (out of stock first, then low stock)
-    product_data.sort(key=lambda x: (
-        0 if x['stock_status'] == 'out_of_stock' else
-        1 if x['stock_status'] == 'low_stock' else 2
-    ))
+    products = Product.objects.filter(is_active=True)
+    out_of_stock = Q(current_stock=0)
+    low_stock = Q(current_stock__gt=0, current_stock__lte=F('minimum_stock_level'))
+    stock_value = ExpressionWrapper(F('current_stock') * F('cost_price'), output_field=DecimalField())
+
+    # Dashboard metrics are maintained incrementally in the summary row
+    summary = current_summary()
+
+    # Product table, one page at a time, out of stock first, then low stock
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', DASHBOARD_PAGE_SIZE)), 1), DASHBOARD_MAX_PAGE_SIZE)
+    except ValueError:
+        page, page_size = 1, DASHBOARD_PAGE_SIZE
+    total_pages = max((summary.product_count + page_size - 1) // page_size, 1)
+    page = min(page, total_pages)
+
+    rows = products.annotate(
+        stock_status=Case(
+            When(out_of_stock, then=Value('out_of_stock')),
+            When(low_stock, then=Value('low_stock')),
+            default=Value('in_stock'),
+        ),
+        status_rank=Case(
+            When(out_of_stock, then=Value(0)),
+            When(low_stock, then=Value(1)),
+            default=Value(2),
+        ),
+        total_value=stock_value,
+    ).order_by('status_rank', 'name', 'id').values(
+        'id', 'name', 'dci', 'therapeutic_class', 'current_stock', 'minimum_stock_level',
+        'stock_status', 'selling_price', 'cost_price', 'total_value'
+    )[(page - 1) * page_size:page * page_size]
+
+    therapeutic_classes = dict(Product.THERAPEUTIC_CLASSES)
+    product_data = [
+        {
+            'id': row['id'],
+            'name': row['name'],
+            'dci': row['dci'],
+            'therapeutic_class': therapeutic_classes.get(row['therapeutic_class'], row['therapeutic_class']),
+            'current_stock': row['current_stock'],
+            'minimum_stock_level': row['minimum_stock_level'],
+            'stock_status': row['stock_status'],
+            'stock_status_display': STOCK_STATUS_DISPLAY[row['stock_status']],
+            'selling_price': float(row['selling_price']),
+            'cost_price': float(row['cost_price']),
+            'total_value': float(row['total_value']),
+        }
+        for row in rows
+    ]
 
     return JsonResponse({
         'metrics': {
-            'total_products': total_products,
-            'total_stock_value': float(total_stock_value),
-            'low_stock_count': len(low_stock_products),
-            'out_of_stock_count': len(out_of_stock_products),
-            'critical_expiry_count': critical_expiry,
-            'expired_count': expired_batches,
+            'total_products': summary.product_count,
+            'total_stock_value': float(summary.stock_value),
+            'low_stock_count': summary.low_stock_count,
+            'out_of_stock_count': summary.out_of_stock_count,
+            'critical_expiry_count': summary.critical_expiry_count,
+            'expired_count': summary.expired_count,
         },
+        'expiry_buckets': expiry.expiry_buckets(),
         'alerts': {
             'low_stock': [
                 {
-                    'name': p.name,
-                    'current_stock': p.current_stock,
-                    'minimum_stock': p.minimum_stock_level
+                    'name': p['name'],
+                    'current_stock': p['current_stock'],
+                    'minimum_stock': p['minimum_stock_level']
                 }
-                for p in low_stock_products
+                for p in products.filter(low_stock).order_by('current_stock', 'name').values(
+                    'name', 'current_stock', 'minimum_stock_level'
+                )[:DASHBOARD_ALERTS_LIMIT]
             ],
             'out_of_stock': [
                 {
-                    'name': p.name,
-                    'current_stock': p.current_stock
+                    'name': p['name'],
+                    'current_stock': p['current_stock']
                 }
-                for p in out_of_stock_products
+                for p in products.filter(out_of_stock).order_by('name').values(
+                    'name', 'current_stock'
+                )[:DASHBOARD_ALERTS_LIMIT]
             ]
         },
-        'products': product_data
+        'products': product_data,
+        'pagination': {
+            'page': page,
+            'page_size': page_size,
+            'total_pages': total_pages,
+            'has_previous': page > 1,
+            'has_next': page < total_pages,
+        }
+    })
+
+def expiring_batches_api(request):
+    """Open batches of one expiry bucket, soonest first, one page at a time.
+
+    ``bucket`` is ``expired``, ``critical``, ``warning``, ``good`` or ``soon``
+    (the default: critical and warning). Page counts come from the cached
+    bucket totals.
+    """
+    bucket = request.GET.get('bucket', 'soon')
+    if bucket != 'soon' and bucket not in dict(expiry.BUCKETS):
+        return JsonResponse({'error': f'Catégorie inconnue: {bucket}'}, status=400)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', DASHBOARD_PAGE_SIZE)), 1), DASHBOARD_MAX_PAGE_SIZE)
+    except ValueError:
+        page, page_size = 1, DASHBOARD_PAGE_SIZE
+
+    buckets = expiry.expiry_buckets()
+    count = sum(buckets[key]['batches'] for key in (('critical', 'warning') if bucket == 'soon' else (bucket,)))
+    total_pages = max((count + page_size - 1) // page_size, 1)
+    page = min(page, total_pages)
+
+    today = current_summary().expiry_as_of
+    rows = expiry.open_batches().filter(**expiry.bucket_range(bucket, today)).order_by('expiry_date', 'id').values(
+        'id', 'batch_number', 'expiry_date', 'quantity', 'purchase_price', 'product_id', 'product__name'
+    )[(page - 1) * page_size:page * page_size]
+    labels = dict(expiry.BUCKETS)
+    batches = []
+    for row in rows:
+        status = expiry.bucket_of(row['expiry_date'], today)
+        batches.append({
+            'id': row['id'],
+            'product_id': row['product_id'],
+            'product_name': row['product__name'],
+            'batch_number': row['batch_number'],
+            'expiry_date': row['expiry_date'].isoformat(),
+            'days_until_expiry': (row['expiry_date'] - today).days,
+            'expiry_status': status,
+            'expiry_status_display': labels[status],
+            'quantity': row['quantity'],
+            'value': float(row['quantity'] * row['purchase_price']),
+        })
+
+    return JsonResponse({
+        'buckets': buckets,
+        'batches': batches,
+        'pagination': {
+            'page': page,
+            'page_size': page_size,
+            'count': count,
+            'total_pages': total_pages,
+            'has_previous': page > 1,
+            'has_next': page < total_pages,
+        }
+    })
+
+
+def product_stock_at_api(request, product_id):
+    """Stock of a product at the end of ``date`` (YYYY-MM-DD), from the movement ledger."""
+    product = get_object_or_404(Product, id=product_id)
+    try:
+        day = datetime.strptime(request.GET.get('date', ''), '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'error': 'Date invalide, format attendu: AAAA-MM-JJ'}, status=400)
+
+    end_of_day = day_start(day + timedelta(days=1)) - timedelta(microseconds=1)
+    return JsonResponse({
+        'product_id': product.id,
+        'product_name': product.name,
+        'date': day.isoformat(),
+        'stock': ledger.stock_at(product, end_of_day),
+    })
+
+
+def stock_reconciliation_api(request):
+    """Compare each product's stock with its batches and its movements.
+
+    GET returns the last report (counts per kind of difference and the
+    first ``limit`` products concerned), checked by a background job that is
+    started when none ran today. POST with ``fix=1`` corrects the movement
+    differences in a background job.
+    """
+    if request.method == 'POST':
+        fix = request.POST.get('fix') in ('1', 'true', 'on')
+        job = jobs.enqueue('reconcile_stock', {'fix': fix})
+        return _job_started(request, job, "Rapprochement des stocks lancé en arrière-plan")
+
+    try:
+        limit = min(max(int(request.GET.get('limit', RECONCILE_REPORT_LIMIT)), 0), RECONCILE_REPORT_LIMIT)
+    except ValueError:
+        limit = RECONCILE_REPORT_LIMIT
+    done, running = _last_result('reconcile_stock', {'fix': False})
+    if done is None:
+        return _job_started(request, running, "Rapprochement des stocks lancé en arrière-plan")
+    return JsonResponse({
+        'checked': done.result['checked'],
+        'corrected': done.result['corrected'],
+        'counts': done.result['counts'],
+        'kinds': dict(DISCREPANCY_KINDS),
+        'discrepancies': done.result['discrepancies'][:limit],
+        'checked_at': done.finished_at.isoformat(),
+        'job': _job_data(running) if running else None,
+    })
+
+
+def product_classification_api(request):
+    """Classified products, by decreasing revenue, one page at a time.
+
+    ``abc`` and ``xyz`` filter on the classes (e.g. ``abc=A&xyz=Z`` for the
+    best sellers with irregular demand).
+    """
+    rows = ProductClassification.objects.filter(product__is_active=True)
+    for param, field, choices in (('abc', 'abc_class', ProductClassification.ABC_CLASSES),
+                                  ('xyz', 'xyz_class', ProductClassification.XYZ_CLASSES)):
+        value = request.GET.get(param)
+        if value:
+            if value not in dict(choices):
+                return JsonResponse({'error': f'Classe inconnue: {value}'}, status=400)
+            rows = rows.filter(**{field: value})
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+        page_size = min(max(int(request.GET.get('page_size', DASHBOARD_PAGE_SIZE)), 1), DASHBOARD_MAX_PAGE_SIZE)
+    except ValueError:
+        page, page_size = 1, DASHBOARD_PAGE_SIZE
+
+    products = [
+        {
+            'product_id': row['product_id'],
+            'product_name': row['product__name'],
+            'current_stock': row['product__current_stock'],
+            'units_sold': row['units_sold'],
+            'revenue': float(row['revenue']),
+            'average_daily_demand': round(row['average_daily_demand'], 2),
+            'demand_cv': round(row['demand_cv'], 2) if row['demand_cv'] is not None else None,
+            'turnover': round(row['turnover'], 1) if row['turnover'] is not None else None,
+            'days_of_cover': round(row['days_of_cover'], 1) if row['days_of_cover'] is not None else None,
+            'abc_class': row['abc_class'],
+            'xyz_class': row['xyz_class'],
+        }
+        for row in rows.order_by('-revenue', 'product_id').values(
+            'product_id', 'product__name', 'product__current_stock', 'units_sold', 'revenue',
+            'average_daily_demand', 'demand_cv', 'turnover', 'days_of_cover', 'abc_class', 'xyz_class',
+        )[(page - 1) * page_size:page * page_size + 1]
+    ]
+    return JsonResponse({
+        'classification': classification.matrix(),
+        'products': products[:page_size],
+        'pagination': {'page': page, 'page_size': page_size, 'has_previous': page > 1,
+                       'has_next': len(products) > page_size},
+    })
+
+
+def reorder_suggestions_api(request):
+    """Products to reorder from the sales forecast.
+
+    GET returns the last preview, computed by a background job that writes
+    nothing (started when none ran today); POST writes the suggestions as
+    draft purchase orders, one per supplier, in a background job.
+    """
+    if request.method == 'POST':
+        job = jobs.enqueue('suggest_reorders')
+        return _job_started(request, job, "Calcul des commandes de réapprovisionnement lancé en arrière-plan")
+
+    # Forecasting the whole catalogue is left to the jobs worker: GET serves
+    # the last preview, and starts today's if it has not run yet
+    done, running = _last_result('suggest_reorders', {'dry_run': True}, params__dry_run=True)
+    if done is None:
+        return _job_started(request, running, "Calcul des suggestions de réapprovisionnement lancé")
+    return JsonResponse({
+        **done.result,
+        'computed_at': done.finished_at.isoformat(),
+        'job': _job_data(running) if running else None,
+    })
+
+@csrf_exempt
+def receive_purchase_order_api(request, order_id):
+    """Book a delivery against a purchase order, in one transaction.
+
+    POST the lines either as an uploaded ``.xlsx``/``.csv`` file (``file``)
+    or as form fields repeated once per line (``product_id``,
+    ``batch_number``, ``expiry_date``, ``quantity`` and optionally
+    ``purchase_price``). Exempt from CSRF checks like the POS APIs, as it is
+    posted by scanners and scripts rather than by a page of the app.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Méthode non autorisée'}, status=405)
+    order = get_object_or_404(PurchaseOrder, pk=order_id)
+    try:
+        if request.FILES.get('file'):
+            lines = read_delivery_file(request.FILES['file'])
+        else:
+            columns = [request.POST.getlist(name) for name in RECEIPT_FIELDS]
+            length = max(map(len, columns))
+            lines = parse_lines(zip(*[column + [None] * (length - len(column)) for column in columns]))
+        result = receive_purchase_order(order.pk, lines)
+    except ReceiptError as exc:
+        return JsonResponse({'error': str(exc), 'errors': exc.errors}, status=400)
+    return JsonResponse({
+        'order_number': result.order_number,
+        'status': result.status,
+        'batches': result.batches,
+        'units': result.units,
+        'pending': result.pending,
     })
 
 # Supplier and PurchaseOrder UI removed — features intentionally deleted from views
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -131,3 +132,19 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Background jobs (inventory.jobs): imports, exports, PDF reports and the
+# nightly jobs, which the worker enqueues when the day changes.
+# Set JOBS_RUN_IN_PROCESS=0 to run them with `manage.py run_jobs` instead of
+# a worker thread of the web server.
+JOBS_ROOT = BASE_DIR / 'job_files'
+JOBS_RUN_IN_PROCESS = os.environ.get('JOBS_RUN_IN_PROCESS', '1') != '0'
+JOBS_RETENTION_DAYS = 7
+
+# Rendered PDF reports, reused until the inventory changes (inventory.reports)
+REPORTS_ROOT = BASE_DIR / 'report_files'
+
+# Stock movements older than this are moved to the archive table by
+# `manage.py archive_stock_movements` (inventory.ledger)
+STOCK_MOVEMENTS_RETENTION_DAYS = 365
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Sale, SaleItem
+from .models import CreditPayment, CustomerAccount, Sale, SaleItem, SaleItemBatch
 
 class SaleItemInline(admin.TabularInline):
     model = SaleItem
@@ -14,8 +14,37 @@ class SaleAdmin(admin.ModelAdmin):
     inlines = [SaleItemInline]
     readonly_fields = ('sale_date',)
 
+class SaleItemBatchInline(admin.TabularInline):
+    model = SaleItemBatch
+    extra = 0
+    readonly_fields = ('batch', 'batch_number', 'expiry_date', 'quantity')
+
 @admin.register(SaleItem)
 class SaleItemAdmin(admin.ModelAdmin):
     list_display = ('sale', 'product', 'quantity', 'unit_price', 'total_price')
     list_filter = ('sale__sale_date',)
     readonly_fields = ('total_price',)
+    inlines = [SaleItemBatchInline]
+
+@admin.register(CustomerAccount)
+class CustomerAccountAdmin(admin.ModelAdmin):
+    list_display = ('name', 'balance', 'total_credit', 'total_paid', 'last_activity')
+    search_fields = ('name',)
+    readonly_fields = ('balance', 'total_credit', 'total_paid', 'last_activity')
+
+@admin.register(CreditPayment)
+class CreditPaymentAdmin(admin.ModelAdmin):
+    # Read-only: payments go through credit.record_payment, which keeps the
+    # account balance and the sales' amount paid in step with the ledger
+    list_display = ('account', 'amount', 'sale', 'balance_after', 'payment_date')
+    list_filter = ('payment_date',)
+    search_fields = ('account__name',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,113 @@
+"""Credit accounts: what each customer owes and what they have paid.
+
+A credit sale adds its total to the customer's ``CustomerAccount`` balance and
+each ``CreditPayment`` takes its amount off, both with ``F()`` updates, so
+the outstanding total and the top debtors are read from one row per
+customer. Payments are also spread over the customer's credit sales, oldest
+first unless a sale is given, and tracked in ``Sale.amount_paid``.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import CreditPayment, CustomerAccount, Sale
+
+CENT = Decimal('0.01')
+
+
+class CreditError(Exception):
+    pass
+
+
+def parse_amount(value):
+    try:
+        amount = Decimal(str(value)).quantize(CENT)
+    except (InvalidOperation, ValueError):
+        raise CreditError('Montant invalide')
+    if not amount.is_finite() or amount <= 0:
+        raise CreditError('Le montant doit être positif')
+    return amount
+
+
+def normalize_name(name):
+    """A customer name as accounts are keyed: trimmed, inner spaces collapsed."""
+    return ' '.join(str(name or '').split())
+
+
+def account_for(name):
+    """The account of customer ``name``, created on their first credit sale."""
+    name = normalize_name(name)
+    account = CustomerAccount.objects.filter(name=name).first()
+    if account is None:
+        try:
+            with transaction.atomic():
+                account = CustomerAccount.objects.create(name=name)
+        except IntegrityError:
+            # Opened by a concurrent checkout
+            account = CustomerAccount.objects.get(name=name)
+    return account
+
+
+def charge(account, amount):
+    """Add a credit sale of ``amount`` to the account balance."""
+    amount = Decimal(str(amount)).quantize(CENT)
+    CustomerAccount.objects.filter(pk=account.pk).update(
+        balance=F('balance') + amount,
+        total_credit=F('total_credit') + amount,
+        last_activity=timezone.now(),
+    )
+
+
+def record_payment(account_id, amount, sale_id=None, note='', created_by='Système'):
+    """Record a payment of ``amount`` and return the ``CreditPayment``.
+
+    With ``sale_id`` the payment settles (part of) that credit sale, and
+    cannot exceed what remains due on it. Otherwise it cannot exceed the
+    account balance and settles the oldest sales first. Must run inside a
+    transaction.
+    """
+    amount = parse_amount(amount)
+    account = CustomerAccount.objects.select_for_update().get(pk=account_id)
+    unpaid = Sale.objects.select_for_update().filter(
+        sale_type='credit', customer_account=account, amount_paid__lt=F('total_amount')
+    )
+
+    sale = None
+    if sale_id is not None:
+        sale = unpaid.filter(pk=sale_id).first()
+        if sale is None:
+            raise CreditError(f'Aucun reste dû sur la vente #{sale_id} pour {account.name}')
+        remaining = sale.total_amount - sale.amount_paid
+        if amount > remaining:
+            raise CreditError(f'Le montant dépasse le reste dû sur la vente #{sale.id}: {remaining} FCFA')
+        settled = [(sale, amount)]
+    else:
+        if amount > account.balance:
+            raise CreditError(f'Le montant dépasse le solde dû par {account.name}: {account.balance} FCFA')
+        settled = []
+        left = amount
+        for unpaid_sale in unpaid.order_by('sale_date', 'id'):
+            if not left:
+                break
+            part = min(left, unpaid_sale.total_amount - unpaid_sale.amount_paid)
+            settled.append((unpaid_sale, part))
+            left -= part
+
+    for settled_sale, part in settled:
+        Sale.objects.filter(pk=settled_sale.pk).update(amount_paid=F('amount_paid') + part)
+
+    CustomerAccount.objects.filter(pk=account.pk).update(
+        balance=F('balance') - amount,
+        total_paid=F('total_paid') + amount,
+        last_activity=timezone.now(),
+    )
+    return CreditPayment.objects.create(
+        account=account,
+        sale=sale,
+        amount=amount,
+        balance_after=account.balance - amount,
+        note=note,
+        created_by=created_by,
+    )
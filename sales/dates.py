@@ -0,0 +1,16 @@
+"""Local-day boundaries for filtering ``DateTimeField`` columns.
+
+Filtering with ``sale_date__date`` converts every row to a local date before
+comparing it, so the database cannot use an index on ``sale_date``. Comparing
+the raw column with the datetimes at which local days start keeps the
+predicate index-friendly: days ``first`` to ``last`` are
+``day_start(first) <= sale_date < day_start(last + 1 day)``.
+"""
+from datetime import datetime, time
+
+from django.utils import timezone
+
+
+def day_start(day):
+    """The aware datetime at which local day ``day`` starts."""
+    return timezone.make_aware(datetime.combine(day, time.min))
@@ -0,0 +1,27 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from sales import rollups
+from sales.models import DailyProductSalesRollup, DailySalesRollup
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from the recorded sales (all history by default)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help="First day to rebuild (YYYY-MM-DD)")
+        parser.add_argument('--end', help="Last day to rebuild (YYYY-MM-DD)")
+
+    def handle(self, *args, **options):
+        try:
+            start = date.fromisoformat(options['start']) if options['start'] else None
+            end = date.fromisoformat(options['end']) if options['end'] else None
+        except ValueError as exc:
+            raise CommandError(f"Date invalide: {exc}")
+
+        rollups.rebuild(start, end)
+        self.stdout.write(self.style.SUCCESS(
+            f"{DailySalesRollup.objects.count()} cumul(s) journalier(s), "
+            f"{DailyProductSalesRollup.objects.count()} cumul(s) par produit"
+        ))
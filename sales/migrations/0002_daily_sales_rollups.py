@@ -0,0 +1,54 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:47
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0007_inventorysummary'),
+        ('sales', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('sale_type', models.CharField(choices=[('paid', 'Comptant'), ('credit', 'Crédit')], max_length=10, verbose_name='Type de vente')),
+                ('sales_count', models.IntegerField(default=0, verbose_name='Nombre de ventes')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name="Chiffre d'affaires")),
+            ],
+            options={
+                'verbose_name': 'Cumul journalier des ventes',
+                'verbose_name_plural': 'Cumuls journaliers des ventes',
+                'ordering': ['date', 'sale_type'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyProductSalesRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Date')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Quantité vendue')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name="Chiffre d'affaires")),
+                ('cost', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name="Coût d'achat")),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='inventory.product', verbose_name='Produit')),
+            ],
+            options={
+                'verbose_name': 'Cumul journalier par produit',
+                'verbose_name_plural': 'Cumuls journaliers par produit',
+                'ordering': ['date'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailysalesrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'sale_type'), name='unique_daily_sales_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyproductsalesrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'product'), name='unique_daily_product_sales_rollup'),
+        ),
+    ]
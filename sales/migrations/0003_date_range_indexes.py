@@ -0,0 +1,22 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0008_date_range_indexes'),
+        ('sales', '0002_daily_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sale',
+            index=models.Index(fields=['sale_date', 'sale_type'], name='sale_date_type_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='saleitem',
+            index=models.Index(fields=['sale', 'product'], name='saleitem_sale_product_idx'),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 5.0.2 on 2026-10-18 15:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0003_date_range_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sale',
+            name='amount_paid',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Montant réglé'),
+        ),
+        migrations.CreateModel(
+            name='CustomerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=200, unique=True, verbose_name='Nom du client')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Solde dû')),
+                ('total_credit', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Total des ventes à crédit')),
+                ('total_paid', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Total payé')),
+                ('last_activity', models.DateTimeField(blank=True, null=True, verbose_name='Dernière opération')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Compte client',
+                'verbose_name_plural': 'Comptes clients',
+                'ordering': ['-balance', 'name'],
+                'indexes': [models.Index(fields=['-balance'], name='customeraccount_balance_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='CreditPayment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Montant')),
+                ('balance_after', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Solde après paiement')),
+                ('note', models.CharField(blank=True, max_length=200, verbose_name='Note')),
+                ('created_by', models.CharField(default='Système', max_length=100, verbose_name='Enregistré par')),
+                ('payment_date', models.DateTimeField(auto_now_add=True, verbose_name='Date de paiement')),
+                ('sale', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payments', to='sales.sale', verbose_name='Vente réglée')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='sales.customeraccount', verbose_name='Compte client')),
+            ],
+            options={
+                'verbose_name': 'Paiement de crédit',
+                'verbose_name_plural': 'Paiements de crédit',
+                'ordering': ['-payment_date'],
+            },
+        ),
+        migrations.AddField(
+            model_name='sale',
+            name='customer_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sales', to='sales.customeraccount', verbose_name='Compte client'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+from django.db import migrations
+from django.db.models import Q
+
+
+def normalize_name(name):
+    # As sales.credit.normalize_name, which keys the accounts of later sales
+    return ' '.join(str(name or '').split())
+
+
+def backfill_accounts(apps, schema_editor):
+    """One account per credit customer, owing the total of their credit sales."""
+    Sale = apps.get_model('sales', 'Sale')
+    CustomerAccount = apps.get_model('sales', 'CustomerAccount')
+
+    credit_sales = Sale.objects.filter(sale_type='credit').exclude(Q(customer_name='') | Q(customer_name__isnull=True))
+    customers = {}
+    for pk, customer_name, total, sale_date in credit_sales.values_list('pk', 'customer_name', 'total_amount', 'sale_date'):
+        name = normalize_name(customer_name)
+        if not name:
+            continue
+        customer = customers.setdefault(name, {'sales': [], 'total': 0, 'last': sale_date})
+        customer['sales'].append(pk)
+        customer['total'] += total
+        customer['last'] = max(customer['last'], sale_date)
+
+    for name, customer in customers.items():
+        account = CustomerAccount.objects.create(
+            name=name,
+            balance=customer['total'],
+            total_credit=customer['total'],
+            last_activity=customer['last'],
+        )
+        Sale.objects.filter(pk__in=customer['sales']).update(customer_account=account, customer_name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0004_credit_accounts'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_accounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.2 on 2026-10-18 16:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('inventory', '0010_batch_fefo_index'),
+        ('sales', '0005_backfill_customer_accounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleItemBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('batch_number', models.CharField(max_length=100, verbose_name='Numéro de lot')),
+                ('expiry_date', models.DateField(verbose_name="Date d'expiration")),
+                ('quantity', models.PositiveIntegerField(verbose_name='Quantité')),
+                ('batch', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sale_items', to='inventory.productbatch', verbose_name='Lot')),
+                ('sale_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='batches', to='sales.saleitem', verbose_name='Article vendu')),
+            ],
+            options={
+                'verbose_name': 'Lot vendu',
+                'verbose_name_plural': 'Lots vendus',
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+from django.db import migrations
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def backfill_rollups(apps, schema_editor):
+    """The daily rollups of the sales recorded before checkout maintained them.
+
+    As sales.rollups.rebuild, which ``manage.py rebuild_sales_rollups`` runs:
+    product costs are the current purchase prices.
+    """
+    Sale = apps.get_model('sales', 'Sale')
+    SaleItem = apps.get_model('sales', 'SaleItem')
+    DailySalesRollup = apps.get_model('sales', 'DailySalesRollup')
+    DailyProductSalesRollup = apps.get_model('sales', 'DailyProductSalesRollup')
+
+    DailySalesRollup.objects.all().delete()
+    DailyProductSalesRollup.objects.all().delete()
+    DailySalesRollup.objects.bulk_create([
+        DailySalesRollup(**row)
+        for row in Sale.objects.annotate(date=TruncDate('sale_date')).values('date', 'sale_type').annotate(
+            sales_count=Count('id'),
+            revenue=Sum('total_amount'),
+        ).order_by()
+    ], batch_size=1000)
+    DailyProductSalesRollup.objects.bulk_create([
+        DailyProductSalesRollup(
+            date=row['date'], product_id=row['product_id'],
+            quantity=row['units'], revenue=row['line_revenue'], cost=row['line_cost'],
+        )
+        for row in SaleItem.objects.annotate(date=TruncDate('sale__sale_date')).values('date', 'product_id').annotate(
+            units=Sum('quantity'),
+            line_revenue=Sum(ExpressionWrapper(F('quantity') * F('unit_price'), output_field=MONEY)),
+            line_cost=Sum(ExpressionWrapper(F('quantity') * F('product__cost_price'), output_field=MONEY)),
+        ).order_by()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sales', '0006_sale_item_batches'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_rollups, migrations.RunPython.noop),
+    ]
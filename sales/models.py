@@ -1,6 +1,27 @@
 from django.db import models
 from inventory.models import Product
 
+class CustomerAccount(models.Model):
+    """A credit customer, with a balance kept up to date by ``sales.credit``."""
+    name = models.CharField(max_length=200, unique=True, verbose_name="Nom du client")
+    balance = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Solde dû")
+    total_credit = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Total des ventes à crédit")
+    total_paid = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Total payé")
+    last_activity = models.DateTimeField(null=True, blank=True, verbose_name="Dernière opération")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Compte client"
+        verbose_name_plural = "Comptes clients"
+        ordering = ['-balance', 'name']
+        indexes = [
+            models.Index(fields=['-balance'], name='customeraccount_balance_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} - Solde: {self.balance} FCFA"
+
+
 class Sale(models.Model):
     SALE_TYPES = (
         ('paid', 'Comptant'),
@@ -11,11 +32,23 @@ class Sale(models.Model):
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Montant total")
     customer_name = models.CharField(max_length=200, blank=True, verbose_name="Nom du client")
     sale_date = models.DateTimeField(auto_now_add=True, verbose_name="Date de vente")
+    customer_account = models.ForeignKey(
+        CustomerAccount,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sales',
+        verbose_name="Compte client"
+    )
+    amount_paid = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name="Montant réglé")
 
     class Meta:
         verbose_name = "Vente"
         verbose_name_plural = "Ventes"
         ordering = ['-sale_date']
+        indexes = [
+            models.Index(fields=['sale_date', 'sale_type'], name='sale_date_type_idx'),
+        ]
 
     def __str__(self):
         return f"Vente #{self.id} - {self.total_amount} FCFA - {self.get_sale_type_display()}"
@@ -29,6 +62,9 @@ class SaleItem(models.Model):
     class Meta:
         verbose_name = "Article vendu"
         verbose_name_plural = "Articles vendus"
+        indexes = [
+            models.Index(fields=['sale', 'product'], name='saleitem_sale_product_idx'),
+        ]
 
     def __str__(self):
         return f"{self.product.name} x{self.quantity}"
@@ -36,3 +72,91 @@ class SaleItem(models.Model):
     @property
     def total_price(self):
         return self.unit_price * self.quantity
+
+
+class SaleItemBatch(models.Model):
+    """Units of a ``SaleItem`` taken from one ``ProductBatch``, earliest expiry first."""
+    sale_item = models.ForeignKey(SaleItem, related_name='batches', on_delete=models.CASCADE, verbose_name="Article vendu")
+    batch = models.ForeignKey(
+        'inventory.ProductBatch',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sale_items',
+        verbose_name="Lot"
+    )
+    # Kept for traceability if the batch is deleted later
+    batch_number = models.CharField(max_length=100, verbose_name="Numéro de lot")
+    expiry_date = models.DateField(verbose_name="Date d'expiration")
+    quantity = models.PositiveIntegerField(verbose_name="Quantité")
+
+    class Meta:
+        verbose_name = "Lot vendu"
+        verbose_name_plural = "Lots vendus"
+
+    def __str__(self):
+        return f"{self.sale_item} - Lot: {self.batch_number} x{self.quantity}"
+
+
+class CreditPayment(models.Model):
+    account = models.ForeignKey(CustomerAccount, on_delete=models.CASCADE, related_name='payments', verbose_name="Compte client")
+    sale = models.ForeignKey(
+        Sale,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='payments',
+        verbose_name="Vente réglée"
+    )
+    amount = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="Montant")
+    balance_after = models.DecimalField(max_digits=14, decimal_places=2, verbose_name="Solde après paiement")
+    note = models.CharField(max_length=200, blank=True, verbose_name="Note")
+    created_by = models.CharField(max_length=100, default="Système", verbose_name="Enregistré par")
+    payment_date = models.DateTimeField(auto_now_add=True, verbose_name="Date de paiement")
+
+    class Meta:
+        verbose_name = "Paiement de crédit"
+        verbose_name_plural = "Paiements de crédit"
+        ordering = ['-payment_date']
+
+    def __str__(self):
+        return f"{self.account.name} - {self.amount} FCFA"
+
+
+class DailySalesRollup(models.Model):
+    """Sales totals per day and payment type, kept up to date at checkout (see ``sales.rollups``)."""
+    date = models.DateField(verbose_name="Date")
+    sale_type = models.CharField(max_length=10, choices=Sale.SALE_TYPES, verbose_name="Type de vente")
+    sales_count = models.IntegerField(default=0, verbose_name="Nombre de ventes")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Chiffre d'affaires")
+
+    class Meta:
+        verbose_name = "Cumul journalier des ventes"
+        verbose_name_plural = "Cumuls journaliers des ventes"
+        ordering = ['date', 'sale_type']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'sale_type'], name='unique_daily_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.get_sale_type_display()}: {self.sales_count} ventes"
+
+
+class DailyProductSalesRollup(models.Model):
+    """Units sold, revenue and cost per day and product, kept up to date at checkout."""
+    date = models.DateField(verbose_name="Date")
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales', verbose_name="Produit")
+    quantity = models.IntegerField(default=0, verbose_name="Quantité vendue")
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Chiffre d'affaires")
+    cost = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name="Coût d'achat")
+
+    class Meta:
+        verbose_name = "Cumul journalier par produit"
+        verbose_name_plural = "Cumuls journaliers par produit"
+        ordering = ['date']
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'product'], name='unique_daily_product_sales_rollup'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} - {self.product.name}: {self.quantity}"
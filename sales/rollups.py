@@ -0,0 +1,122 @@
+"""Daily sales rollups.
+
+``DailySalesRollup`` and ``DailyProductSalesRollup`` are incremented inside the
+checkout transaction, so the analytics screens read one row per day (and per
+product) instead of every sale line of the period. Days are local dates in
+``TIME_ZONE``. Migration 0007 fills them from the sales recorded before;
+``manage.py rebuild_sales_rollups`` recomputes them from the raw sales at any
+time.
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .dates import day_start
+from .models import DailyProductSalesRollup, DailySalesRollup, Sale, SaleItem
+
+CENT = Decimal('0.01')
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(CENT)
+
+
+def _increment(model, day, key, rows):
+    """Add ``rows`` (``{key value: {field: delta}}``) to the rollups of ``day``.
+
+    Existing rows are updated with a single ``UPDATE``; missing ones are
+    inserted, falling back to an update if another transaction created them
+    in the meantime.
+    """
+    if not rows:
+        return
+    fields = {field for values in rows.values() for field in values}
+
+    def update(keys):
+        model.objects.filter(date=day, **{f'{key}__in': keys}).update(**{
+            field: F(field) + Case(
+                *[When(**{key: value}, then=Value(rows[value].get(field, 0))) for value in keys],
+                default=Value(0),
+                output_field=model._meta.get_field(field),
+            )
+            for field in fields
+        })
+
+    existing = set(model.objects.filter(date=day, **{f'{key}__in': list(rows)}).values_list(key, flat=True))
+    if existing:
+        update(list(existing))
+    missing = [value for value in rows if value not in existing]
+    if missing:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([model(date=day, **{key: value}, **rows[value]) for value in missing])
+        except IntegrityError:
+            update(missing)
+
+
+def record_sale(sale, items, unit_costs):
+    """Add a new sale and its ``SaleItem`` rows to the rollups of its day.
+
+    ``unit_costs`` maps product ids to their purchase price at the time of sale.
+    """
+    day = timezone.localdate(sale.sale_date)
+    _increment(DailySalesRollup, day, 'sale_type', {
+        sale.sale_type: {'sales_count': 1, 'revenue': _money(sale.total_amount)},
+    })
+
+    products = {}
+    for item in items:
+        row = products.setdefault(item.product_id, {'quantity': 0, 'revenue': Decimal(0), 'cost': Decimal(0)})
+        row['quantity'] += item.quantity
+        row['revenue'] += _money(item.unit_price) * item.quantity
+        row['cost'] += _money(unit_costs.get(item.product_id)) * item.quantity
+    _increment(DailyProductSalesRollup, day, 'product_id', products)
+
+
+def rebuild(start=None, end=None):
+    """Recompute the rollups of the days ``start`` to ``end`` (inclusive, open-ended if ``None``).
+
+    Product costs come from the current purchase prices, which is the best
+    available estimate for sales recorded before the rollups existed.
+    """
+    sales = Sale.objects.all()
+    items = SaleItem.objects.all()
+    daily = DailySalesRollup.objects.all()
+    product_daily = DailyProductSalesRollup.objects.all()
+    if start is not None:
+        sales = sales.filter(sale_date__gte=day_start(start))
+        items = items.filter(sale__sale_date__gte=day_start(start))
+        daily = daily.filter(date__gte=start)
+        product_daily = product_daily.filter(date__gte=start)
+    if end is not None:
+        sales = sales.filter(sale_date__lt=day_start(end + timedelta(days=1)))
+        items = items.filter(sale__sale_date__lt=day_start(end + timedelta(days=1)))
+        daily = daily.filter(date__lte=end)
+        product_daily = product_daily.filter(date__lte=end)
+
+    with transaction.atomic():
+        daily.delete()
+        product_daily.delete()
+        DailySalesRollup.objects.bulk_create([
+            DailySalesRollup(**row)
+            for row in sales.annotate(date=TruncDate('sale_date')).values('date', 'sale_type').annotate(
+                sales_count=Count('id'),
+                revenue=Sum('total_amount'),
+            ).order_by()
+        ], batch_size=1000)
+        DailyProductSalesRollup.objects.bulk_create([
+            DailyProductSalesRollup(
+                date=row['date'], product_id=row['product_id'],
+                quantity=row['units'], revenue=row['line_revenue'], cost=row['line_cost'],
+            )
+            for row in items.annotate(date=TruncDate('sale__sale_date')).values('date', 'product_id').annotate(
+                units=Sum('quantity'),
+                line_revenue=Sum(ExpressionWrapper(F('quantity') * F('unit_price'), output_field=MONEY)),
+                line_cost=Sum(ExpressionWrapper(F('quantity') * F('product__cost_price'), output_field=MONEY)),
+            ).order_by()
+        ], batch_size=1000)
@@ -7,9 +7,12 @@ urlpatterns = [
     path('credit-ledger/', views.credit_ledger_view, name='credit_ledger'),
     path('api/products/search/', views.product_search_api, name='product_search'),
     path('api/products/barcode-search/', views.product_barcode_search_api, name='product_barcode_search'),  # New
+    path('api/products/barcode-cache/stats/', views.barcode_cache_stats_api, name='barcode_cache_stats'),
 
     path('api/sales/complete/', views.complete_sale_api, name='complete_sale'),
     path('api/sales/history/', views.sales_history_api, name='sales_history_api'),
     path('api/credit/ledger/', views.credit_ledger_api, name='credit_ledger_api'),
+    path('api/credit/customer/', views.credit_customer_sales_api, name='credit_customer_sales_api'),
     path('api/credit/<int:sale_id>/mark-paid/', views.mark_credit_paid_api, name='mark_credit_paid'),
+    path('api/credit/payments/', views.credit_payment_api, name='credit_payment_api'),
 ]
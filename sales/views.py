@@ -1,66 +1,41 @@
 from django.shortcuts import render
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+import base64
 import json
 from inventory.models import Product
-from .models import Sale, SaleItem
+from .models import CustomerAccount, Sale, SaleItem, SaleItemBatch
 from django.utils import timezone
 from datetime import datetime, timedelta
-from django.db.models import Sum
-from django.db.models import Sum, Q
-from inventory.models import Product, StockMovement  # Add StockMovement here
+from django.db.models import Count, F, Prefetch, Sum, Q
+from inventory.barcode_cache import barcode_cache
+from inventory.search import catalogue_index
+from inventory.stock import InsufficientStock, apply_stock_changes, consume_batches, run_with_retry
+from . import credit, rollups
+from .dates import day_start
+
+
+CREDIT_RECENT_PAYMENTS = 20
 
 
 def credit_ledger_view(request):
     return render(request, 'sales/credit_ledger.html')
 
 def credit_ledger_api(request):
-    # Get customers with outstanding credit
-    credit_sales = Sale.objects.filter(
-        sale_type='credit'
-    ).exclude(
-        Q(customer_name='') | Q(customer_name__isnull=True)
-    )
-
-    # Group by customer and calculate totals
-    customer_totals = {}
-    for sale in credit_sales:
-        customer_name = sale.customer_name
-        if customer_name not in customer_totals:
-            customer_totals[customer_name] = {
-                'total_owed': 0,
-                'sales_count': 0,
-                'sales': []
-            }
-
-        customer_totals[customer_name]['total_owed'] += float(sale.total_amount)
-        customer_totals[customer_name]['sales_count'] += 1
-        customer_totals[customer_name]['sales'].append({
-            'id': sale.id,
-            'total_amount': float(sale.total_amount),
-            'sale_date': sale.sale_date.strftime('%d/%m/%Y %H:%M'),
-            'items': [
-                {
-                    'product_name': item.product.name,
-                    'quantity': item.quantity,
-                    'unit_price': float(item.unit_price)
-                }
-                for item in sale.items.all()
-            ]
-        })
-
-    # Convert to list for template
-    customers = []
-    for customer_name, data in customer_totals.items():
-        customers.append({
-            'name': customer_name,
-            'total_owed': data['total_owed'],
-            'sales_count': data['sales_count'],
-            'sales': data['sales']
-        })
-
-    # Sort by total owed (highest first)
-    customers.sort(key=lambda x: x['total_owed'], reverse=True)
+    # Customers with an outstanding balance, read from their accounts
+    accounts = CustomerAccount.objects.filter(balance__gt=0).annotate(
+        sales_count=Count('sales', filter=Q(sales__amount_paid__lt=F('sales__total_amount')))
+    ).order_by('-balance', 'name')
+    customers = [
+        {
+            'id': account.id,
+            'name': account.name,
+            'total_owed': float(account.balance),
+            'total_paid': float(account.total_paid),
+            'sales_count': account.sales_count,
+        }
+        for account in accounts
+    ]
 
     # Calculate overall totals
     total_outstanding = sum(customer['total_owed'] for customer in customers)
@@ -72,19 +47,76 @@ def credit_ledger_api(request):
         'total_customers': total_customers
     })
 
+
+def credit_customer_sales_api(request):
+    # Unpaid credit sales and recent payments of one customer, loaded when the ledger entry is opened
+    customer_name = credit.normalize_name(request.GET.get('customer', ''))
+    if not customer_name:
+        return JsonResponse({'success': False, 'message': 'Client non spécifié'}, status=400)
+    account = CustomerAccount.objects.filter(name=customer_name).first()
+    if account is None:
+        return JsonResponse({'success': False, 'message': 'Client non trouvé'}, status=404)
+
+    sales = account.sales.filter(
+        sale_type='credit', amount_paid__lt=F('total_amount')
+    ).order_by('-sale_date', '-id').prefetch_related(
+        Prefetch('items', queryset=SaleItem.objects.select_related('product').only(
+            'sale_id', 'quantity', 'unit_price', 'product__name'
+        ))
+    )
+    return JsonResponse({
+        'success': True,
+        'customer': account.name,
+        'balance': float(account.balance),
+        'sales': [
+            {
+                'id': sale.id,
+                'total_amount': float(sale.total_amount),
+                'amount_paid': float(sale.amount_paid),
+                'amount_due': float(sale.total_amount - sale.amount_paid),
+                'sale_date': sale.sale_date.strftime('%d/%m/%Y %H:%M'),
+                'items': [
+                    {
+                        'product_name': item.product.name,
+                        'quantity': item.quantity,
+                        'unit_price': float(item.unit_price)
+                    }
+                    for item in sale.items.all()
+                ]
+            }
+            for sale in sales
+        ],
+        'payments': [
+            {
+                'amount': float(payment.amount),
+                'balance_after': float(payment.balance_after),
+                'sale_id': payment.sale_id,
+                'note': payment.note,
+                'payment_date': payment.payment_date.strftime('%d/%m/%Y %H:%M'),
+            }
+            for payment in account.payments.all()[:CREDIT_RECENT_PAYMENTS]
+        ]
+    })
+
+
 @csrf_exempt
 def mark_credit_paid_api(request, sale_id):
     if request.method == 'POST':
         try:
-            sale = Sale.objects.get(id=sale_id, sale_type='credit')
-            # For now, we'll just change sale type to 'paid'
-            # In a more advanced version, we might want to track payments separately
-            sale.sale_type = 'paid'
-            sale.save()
+            sale = Sale.objects.get(id=sale_id, sale_type='credit', customer_account__isnull=False)
+            # Settle whatever remains due on this sale
+            payment = run_with_retry(
+                credit.record_payment,
+                sale.customer_account_id,
+                sale.total_amount - sale.amount_paid,
+                sale_id=sale.id,
+                note=f"Règlement de la vente #{sale.id}"
+            )
 
             return JsonResponse({
                 'success': True,
-                'message': f'Crédit #{sale_id} marqué comme payé!'
+                'message': f'Crédit #{sale_id} marqué comme payé!',
+                'balance': float(payment.balance_after)
             })
 
         except Sale.DoesNotExist:
@@ -92,6 +124,52 @@ def mark_credit_paid_api(request, sale_id):
                 'success': False,
                 'message': 'Vente crédit non trouvée'
             })
+        except credit.CreditError as e:
+            return JsonResponse({
+                'success': False,
+                'message': str(e)
+            })
+        except Exception as e:
+            return JsonResponse({
+                'success': False,
+                'message': f'Erreur: {str(e)}'
+            })
+
+    return JsonResponse({'success': False, 'message': 'Méthode non autorisée'})
+
+
+@csrf_exempt
+def credit_payment_api(request):
+    # Full or partial payment by a credit customer
+    if request.method == 'POST':
+        try:
+            data = json.loads(request.body)
+            account = CustomerAccount.objects.get(name=credit.normalize_name(data.get('customer', '')))
+            payment = run_with_retry(
+                credit.record_payment,
+                account.id,
+                data.get('amount'),
+                sale_id=data.get('sale_id'),
+                note=data.get('note', '')
+            )
+
+            return JsonResponse({
+                'success': True,
+                'payment_id': payment.id,
+                'balance': float(payment.balance_after),
+                'message': f'Paiement de {payment.amount} FCFA enregistré pour {account.name}'
+            })
+
+        except CustomerAccount.DoesNotExist:
+            return JsonResponse({
+                'success': False,
+                'message': 'Client non trouvé'
+            })
+        except credit.CreditError as e:
+            return JsonResponse({
+                'success': False,
+                'message': str(e)
+            })
         except Exception as e:
             return JsonResponse({
                 'success': False,
@@ -104,12 +182,73 @@ def mark_credit_paid_api(request, sale_id):
 def sales_history_view(request):
     return render(request, 'sales/sales_history.html')
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 500
+HISTORY_EXPORT_CHUNK = 500
+
+
+def _encode_cursor(sale):
+    return base64.urlsafe_b64encode(json.dumps([sale.sale_date.isoformat(), sale.id]).encode()).decode()
+
+
+def _decode_cursor(cursor):
+    """Return the ``(sale_date, id)`` of the last sale of the previous page."""
+    try:
+        sale_date, sale_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(sale_date), int(sale_id)
+    except (ValueError, TypeError):
+        raise ValueError('Curseur invalide')
+
+
+def _sales_page(sales, after=None, size=HISTORY_PAGE_SIZE):
+    """Up to ``size`` sales, newest first, following the ``(sale_date, id)`` keyset ``after``."""
+    if after is not None:
+        sale_date, sale_id = after
+        sales = sales.filter(Q(sale_date__lt=sale_date) | Q(sale_date=sale_date, id__lt=sale_id))
+    return list(sales.order_by('-sale_date', '-id').prefetch_related(
+        Prefetch('items', queryset=SaleItem.objects.select_related('product').only(
+            'sale_id', 'quantity', 'unit_price', 'product__name'
+        ))
+    )[:size])
+
+
+def _sale_row(sale):
+    return {
+        'id': sale.id,
+        'sale_type': sale.get_sale_type_display(),
+        'total_amount': float(sale.total_amount),
+        'customer_name': sale.customer_name,
+        'sale_date': sale.sale_date.strftime('%d/%m/%Y %H:%M'),
+        'items': [
+            {
+                'product_name': item.product.name,
+                'quantity': item.quantity,
+                'unit_price': float(item.unit_price),
+                'total_price': float(item.total_price)
+            }
+            for item in sale.items.all()
+        ]
+    }
+
+
+def _stream_sales(sales):
+    """Yield every sale as one NDJSON line, loading them chunk by chunk."""
+    after = None
+    while True:
+        page = _sales_page(sales, after, HISTORY_EXPORT_CHUNK)
+        for sale in page:
+            yield json.dumps(_sale_row(sale), ensure_ascii=False) + '\n'
+        if len(page) < HISTORY_EXPORT_CHUNK:
+            return
+        after = (page[-1].sale_date, page[-1].id)
+
+
 def sales_history_api(request):
     # Get filter parameters
     filter_type = request.GET.get('filter', 'today')
 
     # Calculate date range
-    today = timezone.now().date()
+    today = timezone.localdate()
 
     if filter_type == 'today':
         start_date = today
@@ -128,44 +267,44 @@ def sales_history_api(request):
     sales = Sale.objects.all()
 
     if start_date and end_date:
-        sales = sales.filter(sale_date__date__gte=start_date, sale_date__date__lt=end_date)
-
-    sales = sales.select_related().prefetch_related('items__product').order_by('-sale_date')
-
-    # Calculate totals
-    total_sales = sales.count()
-    total_revenue = sales.aggregate(Sum('total_amount'))['total_amount__sum'] or 0
-
-    # Prepare data for template
-    sales_data = []
-    for sale in sales:
-        sales_data.append({
-            'id': sale.id,
-            'sale_type': sale.get_sale_type_display(),
-            'total_amount': float(sale.total_amount),
-            'customer_name': sale.customer_name,
-            'sale_date': sale.sale_date.strftime('%d/%m/%Y %H:%M'),
-            'items': [
-                {
-                    'product_name': item.product.name,
-                    'quantity': item.quantity,
-                    'unit_price': float(item.unit_price),
-                    'total_price': float(item.total_price)
-                }
-                for item in sale.items.all()
-            ]
-        })
-
-    return JsonResponse({
-        'sales': sales_data,
-        'total_sales': total_sales,
-        'total_revenue': float(total_revenue),
+        # Half-open datetime range, so the sale_date index can be used
+        sales = sales.filter(sale_date__gte=day_start(start_date), sale_date__lt=day_start(end_date))
+
+    # Export: the whole period as newline-delimited JSON, streamed
+    if request.GET.get('format') == 'ndjson':
+        response = StreamingHttpResponse(_stream_sales(sales), content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename=ventes_{filter_type}.ndjson'
+        return response
+
+    # One page at a time, continuing after the cursor of the previous page
+    try:
+        page_size = min(max(int(request.GET.get('page_size', HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        cursor = request.GET.get('cursor')
+        after = _decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return JsonResponse({'success': False, 'message': str(e)}, status=400)
+
+    page = _sales_page(sales, after, page_size + 1)
+    has_more = len(page) > page_size
+    page = page[:page_size]
+
+    data = {
+        'sales': [_sale_row(sale) for sale in page],
+        'next_cursor': _encode_cursor(page[-1]) if has_more else None,
+        'has_more': has_more,
+        'page_size': page_size,
         'filter_type': filter_type,
         'date_range': {
             'start': start_date.strftime('%d/%m/%Y') if start_date else 'Tous',
             'end': end_date.strftime('%d/%m/%Y') if end_date else 'Tous'
         }
-    })
+    }
+    # Period totals are only computed for the first page
+    if after is None:
+        totals = sales.aggregate(total_sales=Count('id'), total_revenue=Sum('total_amount'))
+        data['total_sales'] = totals['total_sales']
+        data['total_revenue'] = float(totals['total_revenue'] or 0)
+    return JsonResponse(data)
 
 def pos_view(request):
     return render(request, 'sales/pos.html')
@@ -174,11 +313,11 @@ def product_search_api(request):
     query = request.GET.get('q', '').strip()
 
     if query:
-        # Search by name OR barcode
-        products = Product.objects.filter(
-            Q(name__icontains=query) | Q(barcode__icontains=query),
-            is_active=True
-        )[:10]
+        # Search name, DCI and barcode through the in-memory catalogue index,
+        # then load the (fresh) rows by primary key
+        product_ids = catalogue_index.search(query, limit=10)
+        products = Product.objects.filter(is_active=True).in_bulk(product_ids)
+        products = [products[pid] for pid in product_ids if pid in products]
         results = [
             {
                 'id': product.id,
@@ -194,6 +333,103 @@ def product_search_api(request):
     else:
         results = []
     return JsonResponse(results, safe=False)
+def _whole_number(value):
+    """``value`` as an ``int``; ``ValueError`` unless it is a whole number (``2``, ``2.0`` or ``"2"``)."""
+    if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+        raise ValueError(value)
+    return int(value)
+
+
+def _parse_cart(cart):
+    """The cart lines with integer ``id`` and ``quantity``; ``ValueError`` if one is invalid."""
+    if not isinstance(cart, list) or not cart:
+        raise ValueError('Le panier est vide')
+    lines = []
+    for item in cart:
+        try:
+            line = {'id': _whole_number(item['id']), 'quantity': _whole_number(item['quantity']), 'price': float(item['price'])}
+        except (TypeError, KeyError, ValueError, OverflowError):
+            raise ValueError('Ligne de panier invalide')
+        if line['quantity'] <= 0 or not 0 <= line['price'] < float('inf'):
+            raise ValueError('Ligne de panier invalide')
+        lines.append(line)
+    return lines
+
+
+def _record_sale(sale_type, customer_name, cart_items):
+    # Calculate total
+    total_amount = sum(item['price'] * item['quantity'] for item in cart_items)
+
+    # Units per product (the same product may appear on several lines)
+    quantities = {}
+    for item in cart_items:
+        quantities[item['id']] = quantities.get(item['id'], 0) + item['quantity']
+
+    # Credit sales are charged to the customer's account (the name is checked
+    # by complete_sale_api)
+    account = None
+    if sale_type == 'credit':
+        account = credit.account_for(customer_name)
+
+    # Create sale
+    sale = Sale.objects.create(
+        sale_type=sale_type,
+        total_amount=total_amount,
+        customer_name=account.name if account is not None else '',
+        customer_account=account
+    )
+    if account is not None:
+        credit.charge(account, total_amount)
+
+    # DEDUCT STOCK and LOG STOCK MOVEMENTS; raises before anything is committed
+    # if a product is missing or short
+    movements = apply_stock_changes(
+        {product_id: -quantity for product_id, quantity in quantities.items()},
+        movement_type='sale',
+        reference=f"Vente #{sale.id}",
+        reason=f"Vente au {sale.get_sale_type_display().lower()}",
+        created_by="Système POS"
+    )
+
+    items = SaleItem.objects.bulk_create([
+        SaleItem(
+            sale=sale,
+            product_id=item['id'],
+            quantity=item['quantity'],
+            unit_price=item['price']
+        )
+        for item in cart_items
+    ])
+
+    # Batches the units came from, earliest expiry first
+    allocations = consume_batches(quantities, {movement.product_id: movement.product for movement in movements})
+    SaleItemBatch.objects.bulk_create(_batch_lines(items, allocations))
+
+    # Daily analytics totals, in the same transaction
+    rollups.record_sale(sale, items, {movement.product_id: movement.product.cost_price for movement in movements})
+    return sale
+
+
+def _batch_lines(items, allocations):
+    """Spread each product's batch allocations over its sale lines, in order."""
+    pending = {product_id: list(lines) for product_id, lines in allocations.items()}
+    for item in items:
+        lines = pending.get(item.product_id)
+        needed = item.quantity
+        while lines and needed:
+            batch, units = lines[0]
+            used = min(units, needed)
+            yield SaleItemBatch(
+                sale_item=item, batch=batch, batch_number=batch.batch_number,
+                expiry_date=batch.expiry_date, quantity=used,
+            )
+            needed -= used
+            if used == units:
+                lines.pop(0)
+            else:
+                lines[0] = (batch, units - used)
+
+
 @csrf_exempt
 def complete_sale_api(request):
     if request.method == 'POST':
@@ -201,54 +437,21 @@ def complete_sale_api(request):
             data = json.loads(request.body)
             sale_type = data.get('sale_type')
             customer_name = data.get('customer_name', '')
-            cart_items = data.get('cart', [])
-
-            # Calculate total
-            total_amount = sum(item['price'] * item['quantity'] for item in cart_items)
-
-            # Create sale
-            sale = Sale.objects.create(
-                sale_type=sale_type,
-                total_amount=total_amount,
-                customer_name=customer_name if sale_type == 'credit' else ''
-            )
-
-            # Create sale items AND update stock
-            for item in cart_items:
-                product = Product.objects.get(id=item['id'])
-                previous_stock = product.current_stock
-
-                # Check if enough stock is available
-                if previous_stock < item['quantity']:
-                    sale.delete()
-                    return JsonResponse({
-                        'success': False,
-                        'message': f'Stock insuffisant pour {product.name}. Stock disponible: {previous_stock}'
-                    })
-
-                # Create sale item
-                SaleItem.objects.create(
-                    sale=sale,
-                    product=product,
-                    quantity=item['quantity'],
-                    unit_price=item['price']
-                )
-
-                # DEDUCT STOCK from product
-                product.current_stock -= item['quantity']
-                product.save()
-
-                # LOG STOCK MOVEMENT
-                StockMovement.objects.create(
-                    product=product,
-                    movement_type='sale',
-                    quantity=-item['quantity'],  # Negative for sales
-                    previous_stock=previous_stock,
-                    new_stock=product.current_stock,
-                    reference=f"Vente #{sale.id}",
-                    reason=f"Vente au {sale.get_sale_type_display().lower()}",
-                    created_by="Système POS"
-                )
+            try:
+                cart_items = _parse_cart(data.get('cart', []))
+            except ValueError as e:
+                # Ids sent as strings are accepted; anything else is refused here
+                # rather than failing halfway through the checkout
+                return JsonResponse({'success': False, 'message': str(e)}, status=400)
+            if sale_type == 'credit' and not credit.normalize_name(customer_name):
+                # Without a name the debt would belong to no account
+                return JsonResponse({
+                    'success': False,
+                    'message': 'Le nom du client est obligatoire pour une vente à crédit'
+                }, status=400)
+
+            # The whole checkout is one transaction: a failure leaves no partial sale
+            sale = run_with_retry(_record_sale, sale_type, customer_name, cart_items)
 
             return JsonResponse({
                 'success': True,
@@ -256,6 +459,11 @@ def complete_sale_api(request):
                 'message': f"Vente #{sale.id} enregistrée avec succès! Stock mis à jour."
             })
 
+        except InsufficientStock as e:
+            return JsonResponse({
+                'success': False,
+                'message': str(e)
+            })
         except Product.DoesNotExist:
             return JsonResponse({
                 'success': False,
@@ -272,21 +480,14 @@ def product_barcode_search_api(request):
     barcode = request.GET.get('barcode', '').strip()
 
     if barcode:
-        try:
-            product = Product.objects.get(barcode=barcode, is_active=True)
-            result = {
-                'id': product.id,
-                'name': product.name,
-                'dci': product.dci,
-                'price': float(product.selling_price),
-                'current_stock': product.current_stock,
-                'minimum_stock_level': product.minimum_stock_level,
-                'barcode': product.barcode,
-            }
-            return JsonResponse({'success': True, 'product': result})
-        except Product.DoesNotExist:
+        # Served from the barcode cache; the database is only hit on a miss
+        result = barcode_cache.get(barcode)
+        if result is None:
             return JsonResponse({'success': False, 'message': 'Produit non trouvé pour ce code-barres'})
-        except Product.MultipleObjectsReturned:
-            return JsonResponse({'success': False, 'message': 'Plusieurs produits avec le même code-barres'})
+        return JsonResponse({'success': True, 'product': result})
 
     return JsonResponse({'success': False, 'message': 'Code-barres vide'})
+
+
+def barcode_cache_stats_api(request):
+    return JsonResponse(barcode_cache.stats())
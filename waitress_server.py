@@ -30,6 +30,11 @@ if __name__ == '__main__':
     # Windows: ensure static files are served by Django/WhiteNoise
     # (WhiteNoise is enabled in settings.py)
 
+    # Start the background jobs worker now rather than with the first job, so
+    # it enqueues the nightly jobs (expiry write-off...) even on a quiet day
+    from inventory import jobs
+    jobs.wake()
+
     # Waitress does not support HTTPS directly; use a reverse proxy for SSL in production
     serve(
         application,